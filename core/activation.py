@@ -1,18 +1,59 @@
-import math
 import sys
 
+import numpy as np
+
 EPSILON = sys.float_info.epsilon
 
 
-def sigmoid(x):
-    return 1.0 / (1.0 + math.e ** (-4.9 * x))
+def sigmoid(x, out=None):
+    """ Logistic function of slope 4.9, computed as (1 + tanh(2.45x)) / 2 so that it cannot overflow """
+    z = np.multiply(x, 2.45, out=out)
+    out = z if isinstance(z, np.ndarray) else None
+    z = np.tanh(z, out=out)
+    z = np.add(z, 1., out=out)
+    return np.multiply(z, .5, out=out)
+
+
+def relu(x, out=None):
+    return np.maximum(x, 0, out=out)
+
+
+def leaky_relu(x, out=None):
+    return np.maximum(x, np.multiply(x, EPSILON), out=out)
+
+
+class ActivationTypes:
+    """ Dataclass used as an enum for the different activation functions """
+    sigmoid, relu, leaky_relu = 1, 2, 3
+
+
+_activations = {
+    ActivationTypes.sigmoid: sigmoid,
+    ActivationTypes.relu: relu,
+    ActivationTypes.leaky_relu: leaky_relu,
+}
+
 
+def register_activation(activation_id, activation_func):
+    """
+    Makes an activation function referable by id.
 
-def relu(x):
-    return max(0, x)
+    :param int activation_id: id not already used by another activation function
+    :param activation_func: numpy-aware callable with the signature activation_func(x, out=None)
+    """
+    if activation_id in _activations:
+        raise ValueError(f"An activation function is already registered with the id {activation_id}")
+    _activations[activation_id] = activation_func
 
 
-def leaky_relu(x):
-    if x > 0:
-        return x
-    return EPSILON * x
+def get_activation(activation):
+    """
+    :param activation: registered activation id, or an activation function which is returned as is
+    :return: the activation function
+    """
+    if callable(activation):
+        return activation
+    try:
+        return _activations[activation]
+    except KeyError:
+        raise ValueError(f"No activation function is registered with the id {activation}") from None
@@ -0,0 +1,285 @@
+"""
+Versioned binary files of named numpy arrays, which can be memory-mapped back in, and the checkpoint of a whole
+population stored in them.
+"""
+
+import json
+import os
+import struct
+
+import numpy as np
+
+from core.orm.database import placeholders
+from core.orm.metadata import ModelMetadata
+
+CHECKPOINT_VERSION = 2
+
+_MAGIC = b'NEATARR\0'
+# magic, format version and byte length of the JSON index which follows
+_HEADER = struct.Struct('<8sII')
+_FORMAT_VERSION = 1
+# arrays start on cache line boundaries, so that memory-mapped ones are aligned for every dtype
+_ALIGNMENT = 64
+
+
+def _align(offset):
+    return -(-offset // _ALIGNMENT) * _ALIGNMENT
+
+
+def write_arrays(path, arrays, meta=None):
+    """
+    Writes named arrays contiguously after a JSON index of their dtype, shape and offset. The file is written next to
+    path and then renamed, so that readers never see a partial file.
+
+    :param str path:
+    :param dict arrays: mapping of name to numpy array
+    :param dict meta: JSON serializable values stored in the index
+    """
+    arrays = {name: np.ascontiguousarray(array) for name, array in arrays.items()}
+    index = {'meta': meta or {}, 'arrays': {}}
+    offset = 0
+    for name, array in arrays.items():
+        index['arrays'][name] = [array.dtype.str, list(array.shape), offset]
+        offset = _align(offset + array.nbytes)
+    encoded_index = json.dumps(index).encode()
+    data_start = _align(_HEADER.size + len(encoded_index))
+
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb', buffering=2 ** 16) as array_file:
+        array_file.write(_HEADER.pack(_MAGIC, _FORMAT_VERSION, len(encoded_index)))
+        array_file.write(encoded_index)
+        for name, array in arrays.items():
+            array_file.seek(data_start + index['arrays'][name][2])
+            array_file.write(array.tobytes())
+        array_file.truncate(data_start + offset)
+    os.replace(tmp_path, path)
+
+
+def _read_index(array_file, path):
+    """
+    :return: tuple of the JSON index of an opened array file and of the offset its arrays start at
+    """
+    magic, version, index_length = _HEADER.unpack(array_file.read(_HEADER.size))
+    if magic != _MAGIC:
+        raise ValueError(f"{path} is not a NEAT array file")
+    if version > _FORMAT_VERSION:
+        raise ValueError(f"{path} uses the array file version {version}, newer than {_FORMAT_VERSION}")
+    return json.loads(array_file.read(index_length)), _align(_HEADER.size + index_length)
+
+
+def read_meta(path):
+    """
+    :param str path: file written by write_arrays
+    :return: the meta values of the file, without mapping its arrays
+    """
+    with open(path, 'rb') as array_file:
+        return _read_index(array_file, path)[0]['meta']
+
+
+def read_arrays(path, mmap=True):
+    """
+    :param str path: file written by write_arrays
+    :param bool mmap: whether to memory-map the arrays read-only instead of reading them in memory
+    :return: tuple of the dict of the arrays and of the meta values
+    """
+    with open(path, 'rb') as array_file:
+        index, data_start = _read_index(array_file, path)
+        arrays = {}
+        for name, (dtype, shape, offset) in index['arrays'].items():
+            dtype, shape = np.dtype(dtype), tuple(shape)
+            if not np.prod(shape, dtype=np.int64):
+                arrays[name] = np.empty(shape, dtype=dtype)
+            elif mmap:
+                arrays[name] = np.memmap(path, dtype=dtype, mode='r', offset=data_start + offset, shape=shape)
+            else:
+                array_file.seek(data_start + offset)
+                arrays[name] = np.fromfile(array_file, dtype=dtype, count=int(np.prod(shape))).reshape(shape)
+    return arrays, index['meta']
+
+
+def offsets(counts):
+    """
+    :param counts: number of items of every group stored contiguously
+    :return: int64 array of len(counts) + 1 offsets, group i spanning offsets[i]:offsets[i + 1]
+    """
+    return np.concatenate(([0], np.cumsum(counts, dtype=np.int64)))
+
+
+def dump_population(db, population_id):
+    """
+    Gathers everything needed to resume from a population: the node and innovation tables, the genotypes of its
+    individuals as flat arrays, their species and scores, and the model metadata.
+
+    :param core.orm.database.Database db:
+    :param int population_id:
+    :return: tuple of the dict of the arrays and of the meta values of the checkpoint
+    """
+    res = db.execute("""SELECT id, generation_id FROM population WHERE id = ? LIMIT 1""", (population_id,))
+    if not res:
+        raise ValueError("Specified population_id doesn't exist")
+    individuals = np.array(
+        db.execute(
+            """SELECT id, genotype_id, specie_id, score FROM individual WHERE population_id = ? ORDER BY id""",
+            (population_id,),
+        ),
+        dtype=float,
+    ).reshape(-1, 4)
+    nodes = np.array(
+        db.execute("""SELECT id, node_type_id, IFNULL(connection_historical_id, 0) FROM node ORDER BY id"""),
+        dtype=np.int64,
+    ).reshape(-1, 3)
+    historical = np.array(
+        db.execute("""SELECT id, in_node_id, out_node_id FROM connection_historical ORDER BY id"""), dtype=np.int64,
+    ).reshape(-1, 3)
+    genotype_ids = np.unique(individuals[:, 1].astype(np.int64))
+    parents = np.array(
+        db.execute_in(
+            """
+            SELECT id, IFNULL(parent_1_id, 0), IFNULL(parent_2_id, 0)
+            FROM genotype
+            WHERE id IN ({ids})
+            ORDER BY id
+            """,
+            genotype_ids.tolist(),
+        ),
+        dtype=np.int64,
+    ).reshape(-1, 3)
+    genotype_nodes = np.array(
+        db.execute_in(
+            """
+            SELECT genotype_id, node_id
+            FROM genotype_node_rel
+            WHERE genotype_id IN ({ids})
+            ORDER BY genotype_id, node_id
+            """,
+            genotype_ids.tolist(),
+        ),
+        dtype=np.int64,
+    ).reshape(-1, 2)
+    connections = np.array(
+        db.execute_in(
+            """
+            SELECT genotype_id, historical_id, weight, is_enabled, id
+            FROM connection
+            WHERE genotype_id IN ({ids})
+            ORDER BY genotype_id, historical_id
+            """,
+            genotype_ids.tolist(),
+        ),
+        dtype=float,
+    ).reshape(-1, 5)
+
+    arrays = {
+        'node_ids': nodes[:, 0],
+        'node_types': nodes[:, 1],
+        'node_split_ids': nodes[:, 2],
+        'historical_ids': historical[:, 0],
+        'historical_in_node_ids': historical[:, 1],
+        'historical_out_node_ids': historical[:, 2],
+        'genotype_ids': genotype_ids,
+        'genotype_parent_ids': parents[:, 1:],
+        'node_offsets': offsets(np.searchsorted(genotype_nodes[:, 0], genotype_ids, side='right') -
+                                np.searchsorted(genotype_nodes[:, 0], genotype_ids)),
+        'genotype_node_ids': genotype_nodes[:, 1],
+        'connection_offsets': offsets(np.searchsorted(connections[:, 0], genotype_ids, side='right') -
+                                      np.searchsorted(connections[:, 0], genotype_ids)),
+        'connection_ids': connections[:, 4].astype(np.int64),
+        'innovations': connections[:, 1].astype(np.int64),
+        'weights': connections[:, 2],
+        'enabled': connections[:, 3].astype(bool),
+        'individual_ids': individuals[:, 0].astype(np.int64),
+        'individual_genotype_ids': individuals[:, 1].astype(np.int64),
+        'specie_ids': individuals[:, 2].astype(np.int64),
+        'scores': individuals[:, 3],
+    }
+    meta = {
+        'version': CHECKPOINT_VERSION,
+        'population_id': population_id,
+        'generation_id': res[1],
+        'metadata': ModelMetadata.of(db)._asdict(),
+    }
+    return arrays, meta
+
+
+def restore_population(db, arrays, meta):
+    """
+    Writes a checkpoint made by dump_population in a database holding no population yet, keeping every id.
+    The parents of the genotypes which are not part of the checkpoint are not kept. Nodes already in the database must
+    match those of the checkpoint, and its hyperparameters must be newer than every model_metadata row, so that they
+    become the current ones.
+
+    :param core.orm.database.Database db:
+    """
+    if meta.get('version') != CHECKPOINT_VERSION:
+        raise ValueError(f"Unsupported checkpoint version {meta.get('version')}, expected {CHECKPOINT_VERSION}")
+    if db.execute("""SELECT COUNT(*) FROM population""")[0][0]:
+        raise ValueError("A checkpoint can only be restored in a database holding no population")
+    if (db.execute("""SELECT MAX(id) FROM model_metadata""")[0][0] or 0) >= meta['metadata']['id']:
+        raise ValueError("A checkpoint can only be restored in a database holding older model_metadata rows")
+    nodes = tuple(zip(arrays['node_ids'].tolist(), arrays['node_types'].tolist(),
+                      (split_id or None for split_id in arrays['node_split_ids'].tolist())))
+    existing_nodes = {row[0]: row for row in db.execute(
+        """SELECT id, node_type_id, connection_historical_id FROM node""")}
+    if any(existing_nodes.get(node[0], node) != node for node in nodes):
+        raise ValueError("The nodes of the database differ from those of the checkpoint")
+    genotype_ids = arrays['genotype_ids'].tolist()
+    known_ids = set(genotype_ids)
+    node_offsets, connection_offsets = arrays['node_offsets'].tolist(), arrays['connection_offsets'].tolist()
+    genotype_node_ids = arrays['genotype_node_ids'].tolist()
+    connection_ids, innovations = arrays['connection_ids'].tolist(), arrays['innovations'].tolist()
+    weights = arrays['weights'].tolist()
+    enabled = arrays['enabled'].tolist()
+    metadata = {key: value for key, value in meta['metadata'].items() if key != 'mutation_rate'}
+
+    with db.transaction():
+        db.executemany(
+            """INSERT INTO node (id, node_type_id, connection_historical_id) VALUES (?, ?, ?)""",
+            (node for node in nodes if node[0] not in existing_nodes),
+        )
+        db.executemany(
+            """INSERT INTO connection_historical (id, in_node_id, out_node_id) VALUES (?, ?, ?)""",
+            zip(arrays['historical_ids'].tolist(), arrays['historical_in_node_ids'].tolist(),
+                arrays['historical_out_node_ids'].tolist()),
+        )
+        db.execute(
+            f"""INSERT INTO model_metadata ({', '.join(metadata)}) VALUES ({placeholders(metadata)})""",
+            tuple(metadata.values()),
+        )
+        db.execute("""INSERT INTO generation (id) VALUES (?)""", (meta['generation_id'],))
+        db.execute(
+            """INSERT INTO population (id, generation_id) VALUES (?, ?)""",
+            (meta['population_id'], meta['generation_id']),
+        )
+        db.executemany(
+            """INSERT INTO specie (id) VALUES (?)""",
+            ((specie_id,) for specie_id in sorted(set(arrays['specie_ids'].tolist()))),
+        )
+        db.executemany(
+            """INSERT INTO genotype (id, parent_1_id, parent_2_id) VALUES (?, ?, ?)""",
+            (
+                (genotype_id, *(parent_id if parent_id in known_ids else None for parent_id in parent_ids))
+                for genotype_id, parent_ids in zip(genotype_ids, arrays['genotype_parent_ids'].tolist())
+            ),
+        )
+        db.executemany(
+            """INSERT INTO genotype_node_rel (genotype_id, node_id) VALUES (?, ?)""",
+            (
+                (genotype_id, node_id) for i, genotype_id in enumerate(genotype_ids)
+                for node_id in genotype_node_ids[node_offsets[i]:node_offsets[i + 1]]
+            ),
+        )
+        db.executemany(
+            """INSERT INTO connection (id, historical_id, genotype_id, is_enabled, weight) VALUES (?, ?, ?, ?, ?)""",
+            (
+                (connection_ids[j], innovations[j], genotype_id, enabled[j], weights[j])
+                for i, genotype_id in enumerate(genotype_ids)
+                for j in range(connection_offsets[i], connection_offsets[i + 1])
+            ),
+        )
+        db.executemany(
+            """INSERT INTO individual (id, genotype_id, specie_id, score, population_id) VALUES (?, ?, ?, ?, ?)""",
+            zip(arrays['individual_ids'].tolist(), arrays['individual_genotype_ids'].tolist(),
+                arrays['specie_ids'].tolist(), arrays['scores'].tolist(),
+                (meta['population_id'] for _ in range(len(arrays['individual_ids'])))),
+        )
+    db.cache.clear()
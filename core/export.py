@@ -1,72 +1,140 @@
+import contextlib
+import itertools
 import os.path
+import subprocess
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import NamedTuple
 
 from core.orm.enums import NodeTypes
-from core.orm.node import Node
 
 
-class Export(object):
-    def __init__(self, genotype_dicts, folderpath):
-        if os.path.exists(folderpath):
-            self._folderpath = folderpath
+def stream_genotype_dicts(db, genotype_ids=None, generation_id=None, specie_id=None, top_k=None):
+    """
+    Streams genotypes out of a single query joining their nodes, node types and connections, without building any
+    ORM element.
+
+    :param core.orm.database.Database db:
+    :param genotype_ids: optional iterable of the genotype ids to export
+    :param int generation_id: only exports the genotypes of the individuals of that generation
+    :param int specie_id: only exports the genotypes of the individuals of that specie
+    :param int top_k: only exports the genotypes of the k best scored individuals matching the other filters
+    :return: generator of dicts of the genotype_id, node_ids, node_types and connection_dicts of every genotype,
+        sorted by genotype_id
+    """
+    genotype_ids = tuple(genotype_ids) if genotype_ids is not None else None
+    id_placeholders = ', '.join('?' * len(genotype_ids or ()))
+    if generation_id is None and specie_id is None and top_k is None:
+        selection = f"""
+            SELECT id AS genotype_id
+            FROM genotype
+            {f'WHERE id IN ({id_placeholders})' if genotype_ids is not None else ''}
+        """
+        parameters = genotype_ids or ()
+    else:
+        conditions, parameters = [], []
+        for condition, value in (
+                (f"ind.genotype_id IN ({id_placeholders})", genotype_ids),
+                ("pop.generation_id = ?", generation_id),
+                ("ind.specie_id = ?", specie_id),
+        ):
+            if value is not None:
+                conditions.append(condition)
+                parameters.extend(value if isinstance(value, tuple) else (value,))
+        selection = f"""
+            SELECT ind.genotype_id
+            FROM individual AS ind
+            INNER JOIN population AS pop ON pop.id = ind.population_id
+            {'WHERE ' + ' AND '.join(conditions) if conditions else ''}
+            GROUP BY ind.genotype_id
+            ORDER BY MAX(ind.score) DESC, ind.genotype_id
+            LIMIT ?
+        """
+        parameters.append(top_k if top_k is not None else -1)
+    rows = db.stream(
+        f"""
+        WITH selected AS ({selection})
+        SELECT rel.genotype_id, 0, rel.id, rel.node_id, node.node_type_id, NULL, NULL, NULL
+        FROM selected
+        INNER JOIN genotype_node_rel AS rel ON rel.genotype_id = selected.genotype_id
+        INNER JOIN node ON node.id = rel.node_id
+        UNION ALL
+        SELECT conn.genotype_id, 1, conn.id, ch.in_node_id, ch.out_node_id, conn.weight, conn.is_enabled,
+            conn.historical_id
+        FROM selected
+        INNER JOIN connection AS conn ON conn.genotype_id = selected.genotype_id
+        INNER JOIN connection_historical AS ch ON ch.id = conn.historical_id
+        ORDER BY 1, 2, 3
+        """,
+        tuple(parameters),
+    )
+    genotype = None
+    for genotype_id, is_connection, _, first_id, second_id, weight, is_enabled, historical_id in rows:
+        if genotype is None or genotype['genotype_id'] != genotype_id:
+            if genotype is not None:
+                yield genotype
+            genotype = {'genotype_id': genotype_id, 'node_ids': set(), 'node_types': {}, 'connection_dicts': []}
+        if is_connection:
+            genotype['connection_dicts'].append({
+                'connection_id': historical_id,
+                'in_node_id': first_id,
+                'out_node_id': second_id,
+                'weight': weight,
+                'is_enabled': bool(is_enabled),
+            })
         else:
-            raise FileNotFoundError(f"The folderpath {folderpath} does not exist")
-        self._genotypes = genotype_dicts
+            genotype['node_ids'].add(first_id)
+            genotype['node_types'][first_id] = second_id
+    if genotype is not None:
+        yield genotype
 
-    @staticmethod
-    def _get_connection_color(weight, is_enabled):
-        def convert_to_hex(value):
-            color_dict = dict(enumerate("0123456789abcdefghijklmnopqrstuvwxyz"))
-            value = min(max(value, 0), 256)
-            first_digit = color_dict[value // 36]
-            second_digit = color_dict[value % 36]
-            return f'{first_digit}{second_digit}'
 
-        if not is_enabled:
-            return '#888888'
-        blue = round(weight * 128) if weight > 0 else 0
-        red = round(weight * 128) if weight < 0 else 0
+class Layout(NamedTuple):
+    """ Precomputed drawing of a genotype, shared by every style of DotRenderer """
+    genotype_id: int
+    # sorted node ids of every node type
+    nodes: dict[int, tuple[int, ...]]
+    # (in_node_id, out_node_id, weight, is_enabled, node_type) of every connection, node_type being the input, hidden
+    # or output group the connection is drawn in
+    connections: tuple[tuple[int, int, float, bool, int], ...]
 
-        return f'#{convert_to_hex(red)}00{convert_to_hex(blue)}'
 
-    @staticmethod
-    def _render_nodes(genotype):
-        input_node_lines, hidden_node_lines, output_node_lines = [], [], []
-        bias_node = ""
-        for node_id in sorted(genotype['node_ids']):
-            node = Node(genotype['db'], node_id=node_id)
-            bias_node_line = 'node_{0} [label="{0}\\nBias" shape="diamond"]'
-            node_line = 'node_{0} [label="{0}"]'
-            match node.node_type:
-                case NodeTypes.bias:
-                    bias_node = bias_node_line.format(node.id)
-                case NodeTypes.input:
-                    input_node_lines.append(node_line.format(node.id))
-                case NodeTypes.hidden:
-                    hidden_node_lines.append(node_line.format(node.id))
-                case NodeTypes.output:
-                    output_node_lines.append(node_line.format(node.id))
-
-        return {
-            'bias_node': bias_node,
-            'input_nodes': '\n    '.join(input_node_lines),
-            'hidden_nodes': '\n    '.join(hidden_node_lines),
-            'output_nodes': '\n    '.join(output_node_lines),
-        }
+def _export_color(weight, is_enabled):
+    def convert_to_hex(value):
+        color_dict = dict(enumerate("0123456789abcdefghijklmnopqrstuvwxyz"))
+        value = min(max(value, 0), 256)
+        first_digit = color_dict[value // 36]
+        second_digit = color_dict[value % 36]
+        return f'{first_digit}{second_digit}'
+
+    if not is_enabled:
+        return '#888888'
+    blue = round(weight * 128) if weight > 0 else 0
+    red = round(weight * 128) if weight < 0 else 0
+
+    return f'#{convert_to_hex(red)}00{convert_to_hex(blue)}'
 
-    @staticmethod
-    def _render_connections(genotype):
-        connection_lines = []
-        for connection in genotype['connection_dicts']:
-            color = Export._get_connection_color(connection['weight'], connection['is_enabled'])
-            connection_lines.append(
-                f'node_{connection["in_node_id"]} -> node_{connection["out_node_id"]} [color="{color}"]')
 
-        return '\n    '.join(connection_lines)
+def _draw_color(weight, is_enabled):
+    weight *= 1 if is_enabled else 0
+    if weight == 0.:
+        return '#888888'
+    is_pos = weight > 0
+    intensity = round(min(255, max(0, ((max(0, round(abs(weight) - 1)) * 2) ** (1 / 2.1)) * 32) + 128))
+    ramp = '0123456789abcdef'
+    intensity = ramp[intensity // 16] + ramp[intensity % 16]
+    return f"#{'00' if is_pos else intensity}00{intensity if is_pos else '00'}"
 
-    def _render(self, genotype):
-        nodes = self._render_nodes(genotype)
-        connections = self._render_connections(genotype)
-        return f"""digraph {{
+
+def _render_export(layout):
+    node_line = 'node_{0} [label="{0}"]'
+    nodes = {node_type: '\n    '.join(node_line.format(node_id) for node_id in node_ids)
+             for node_type, node_ids in layout.nodes.items()}
+    bias_node = 'node_{0} [label="{0}\\nBias" shape="diamond"]'.format(layout.nodes[NodeTypes.bias][-1]) if \
+        layout.nodes[NodeTypes.bias] else ''
+    connections = '\n    '.join(
+        f'node_{in_node_id} -> node_{out_node_id} [color="{_export_color(weight, is_enabled)}"]'
+        for in_node_id, out_node_id, weight, is_enabled, _ in layout.connections)
+    return f"""digraph {{
     rankdir="LR"
     splines=polyline
     bgcolor="invis"
@@ -76,26 +144,218 @@ class Export(object):
     subgraph {{
     rank=same
     node [shape=square fillcolor=cyan]
-    {nodes['bias_node']}
-    {nodes['input_nodes']}
+    {bias_node}
+    {nodes[NodeTypes.input]}
     }}
     """ + (f"""
     subgraph {{
     node [shape=circle fillcolor=blue]
-    {nodes['hidden_nodes']}
+    {nodes[NodeTypes.hidden]}
     }}
-    """ if nodes['hidden_nodes'] else '') + f"""
+    """ if nodes[NodeTypes.hidden] else '') + f"""
     subgraph {{
     rank=same
     node [shape=square fillcolor=red]
-    {nodes['output_nodes']}
+    {nodes[NodeTypes.output]}
     }}
     
     {connections}
 }}
 """
 
-    def render(self):
-        for genotype in self._genotypes:
-            with open(os.path.join(self._folderpath, f'genotype_{genotype["genotype_id"]}.dot'), 'wt+') as gen_file:
-                gen_file.write(self._render(genotype))
+
+def _render_draw(layout):
+    graph_lines = [
+        'digraph {', '    rankdir = "LR"', '    splines = polyline', '    bgcolor = "invis"',
+        ('    node [margin = 0 fontcolor = black fontsize = 32 width = 0.5 style = filled fixsized = True '
+         'labelloc = b fontname = calibri]'),
+        '    edge [arrowhead = onormal width = 0.1 tailport = e headclip = True tailclip = True penwidth = 0.5]',
+        '',
+        '    subgraph {',
+        '    rank = same',
+        '    node [shape = square fillcolor = cyan]',
+    ]
+    graph_lines += [f'    node_{node_id} [label = "{node_id}\\nBias" shape = "diamond"]'
+                    for node_id in layout.nodes[NodeTypes.bias]]
+    graph_lines += [f'    node_{node_id} [label = "{node_id}"]' for node_id in layout.nodes[NodeTypes.input]]
+    graph_lines += ['    }', '    subgraph {', '    node [shape = circle fillcolor = blue]']
+    graph_lines += [f'    node_{node_id} [label = "{node_id}"]' for node_id in layout.nodes[NodeTypes.hidden]]
+    graph_lines += ['    }', '    subgraph {', '    rank = same', '    node [shape = square fillcolor = red]']
+    graph_lines += [f'    node_{node_id} [label = "{node_id}"]' for node_id in layout.nodes[NodeTypes.output]]
+    graph_lines += ['    }', '']
+    for group in (NodeTypes.input, NodeTypes.hidden, NodeTypes.output):
+        graph_lines += [
+            f'    node_{in_node_id} -> node_{out_node_id} [color = "{_draw_color(weight, is_enabled)}"]'
+            for in_node_id, out_node_id, weight, is_enabled, node_type in layout.connections if node_type == group
+        ]
+    graph_lines += ['}', '']
+    return '\n'.join(graph_lines)
+
+
+_STYLES = {'export': _render_export, 'draw': _render_draw}
+
+
+class DotRenderer:
+    """
+    Renders genotype dicts in the DOT language, in the style of the exports or of Genotype.draw, classifying every
+    node id once for a whole batch of genotypes.
+    """
+    def __init__(self, style='export', db=None):
+        """
+
+        :param str style: 'export' or 'draw'
+        :param core.orm.database.Database db: database read for the node types missing from the genotype dicts
+        """
+        if style not in _STYLES:
+            raise ValueError(f"Unknown style {style}, expected one of {', '.join(_STYLES)}")
+        self.style = style
+        self._db = db
+        self._node_types = {}
+
+    def __getstate__(self):
+        # workers render detached genotype dicts, without the database nor the node types met so far
+        return {'style': self.style, '_db': None, '_node_types': {}}
+
+    def node_types(self, genotype):
+        """
+        :return: dict mapping the node ids of the genotype to their node type, the unknown ones being read at once
+        """
+        self._node_types.update(genotype.get('node_types') or {})
+        node_ids = set(genotype['node_ids']).union(
+            *((connection['in_node_id'], connection['out_node_id']) for connection in genotype['connection_dicts']))
+        missing_ids = tuple(node_id for node_id in node_ids if node_id not in self._node_types)
+        db = genotype.get('db') or self._db
+        if missing_ids and db is not None:
+            self._node_types.update(
+                db.execute_in("""SELECT id, node_type_id FROM node WHERE id IN ({ids})""", missing_ids))
+        return {node_id: self._node_types[node_id] for node_id in node_ids if node_id in self._node_types}
+
+    def layout(self, genotype):
+        """
+        :return: the Layout of a genotype dict, holding its node_types or read from the db it or the renderer holds
+        """
+        node_types = self.node_types(genotype)
+        nodes = {node_type: [] for node_type in (NodeTypes.bias, NodeTypes.input, NodeTypes.hidden, NodeTypes.output)}
+        for node_id in sorted(genotype['node_ids']):
+            nodes[node_types[node_id]].append(node_id)
+        connections = []
+        for connection in genotype['connection_dicts']:
+            in_node_id, out_node_id = connection['in_node_id'], connection['out_node_id']
+            if node_types.get(in_node_id) == NodeTypes.input:
+                node_type = NodeTypes.input
+            elif node_types.get(out_node_id) == NodeTypes.output:
+                node_type = NodeTypes.output
+            else:
+                node_type = NodeTypes.hidden
+            connections.append(
+                (in_node_id, out_node_id, connection['weight'], bool(connection['is_enabled']), node_type))
+        return Layout(
+            genotype['genotype_id'], {node_type: tuple(node_ids) for node_type, node_ids in nodes.items()},
+            tuple(connections))
+
+    def detach(self, genotype):
+        """ Copies a genotype dict without its db, the node types being resolved, so that it can be pickled """
+        node_types = self.node_types(genotype)
+        return dict(((key, value) for key, value in genotype.items() if key != 'db'), node_types=node_types)
+
+    def render(self, genotype):
+        """
+        :param genotype: genotype dict of its genotype_id, node_ids, connection_dicts, and node_types or db
+        :return: the DOT text of the genotype
+        """
+        return _STYLES[self.style](self.layout(genotype))
+
+
+class Export(object):
+    def __init__(self, genotype_dicts, folderpath, style='export', db=None):
+        """
+
+        :param genotype_dicts: iterable of genotype dicts, holding either the node_types of their nodes, as streamed
+            by stream_genotype_dicts, or the db to read them from, as given by Genotype.as_dict
+        :param str folderpath: existing folder the dot files are written to
+        :param str style: style of the DotRenderer
+        :param core.orm.database.Database db: database read for the node types missing from the genotype dicts
+        """
+        if os.path.exists(folderpath):
+            self._folderpath = folderpath
+        else:
+            raise FileNotFoundError(f"The folderpath {folderpath} does not exist")
+        self._genotypes = genotype_dicts
+        self._renderer = DotRenderer(style, db)
+
+    @classmethod
+    def from_database(cls, db, folderpath, genotype_ids=None, generation_id=None, specie_id=None, top_k=None,
+                      style='export'):
+        """ Exports the genotypes selected by the filters of stream_genotype_dicts """
+        return cls(stream_genotype_dicts(db, genotype_ids, generation_id, specie_id, top_k), folderpath, style, db)
+
+    def _write(self, genotype_id, dot_text):
+        """
+        Writes the dot file of a genotype, unless it already holds the same content.
+
+        :return: tuple of the path of the dot file and whether it was written
+        """
+        filepath = os.path.join(self._folderpath, f'genotype_{genotype_id}.dot')
+        content = dot_text.encode()
+        if os.path.exists(filepath):
+            with open(filepath, 'rb') as gen_file:
+                if gen_file.read() == content:
+                    return filepath, False
+        with open(filepath, 'wb', buffering=2 ** 16) as gen_file:
+            gen_file.write(content)
+        return filepath, True
+
+    @staticmethod
+    def _draw_image(dot_binary, image_format, filepath):
+        image_path = f'{os.path.splitext(filepath)[0]}.{image_format}'
+        subprocess.run([dot_binary, f'-T{image_format}', filepath, '-o', image_path], check=True, capture_output=True)
+        return image_path
+
+    def render(self, workers=1, image_format=None, dot_binary='dot', max_concurrent_images=None, batch_size=256):
+        """
+        Writes one dot file per genotype, consuming the genotype dicts one batch at a time. Files whose content did not
+        change are not rewritten, and their image is only drawn again when missing.
+
+        :param int workers: number of processes rendering the dot text, None using every core
+        :param str image_format: optional Graphviz output format, e.g. 'png', drawn next to every dot file
+        :param str dot_binary: path of the Graphviz dot executable
+        :param int max_concurrent_images: number of Graphviz processes run at once, defaulting to the core count
+        :param int batch_size: number of genotypes rendered per batch
+        :return: number of rendered genotypes
+        """
+        workers = workers or os.cpu_count()
+        count = 0
+        image_futures = []
+        with (ProcessPoolExecutor(max_workers=workers) if workers > 1 else _InProcessExecutor()) as executor, \
+                (ThreadPoolExecutor(max_workers=max_concurrent_images or os.cpu_count()) if image_format
+                 else contextlib.nullcontext()) as image_executor:
+            genotypes = iter(self._genotypes)
+            while batch := list(itertools.islice(genotypes, batch_size)):
+                if workers > 1:
+                    batch = [self._renderer.detach(genotype) for genotype in batch]
+                chunksize = max(1, len(batch) // (workers * 4))
+                for genotype, dot_text in zip(
+                        batch, executor.map(self._renderer.render, batch, chunksize=chunksize)):
+                    filepath, written = self._write(genotype['genotype_id'], dot_text)
+                    if image_format and (written or not os.path.exists(
+                            f'{os.path.splitext(filepath)[0]}.{image_format}')):
+                        image_futures.append(
+                            image_executor.submit(self._draw_image, dot_binary, image_format, filepath))
+                count += len(batch)
+            for future in image_futures:
+                future.result()
+        return count
+
+
+class _InProcessExecutor:
+    """ Serial stand-in for ProcessPoolExecutor, rendering in the calling process when a single worker is used """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    @staticmethod
+    def map(fn, iterable, chunksize=1):
+        return map(fn, iterable)
@@ -0,0 +1,177 @@
+import numpy as np
+
+from core.activation import ActivationTypes
+from core.phenotype import Phenotype
+
+
+def compatibility_distance(connection_genes, other_connection_genes, excess_coef=1., disjoint_coef=1.,
+                           weight_coef=.4):
+    """
+    NEAT compatibility distance excess_coef * E / N + disjoint_coef * D / N + weight_coef * W, where E and D are the
+    excess and disjoint genes, N the size of the larger genome and W the mean weight difference of matching genes.
+
+    :param connection_genes: tuple of the sorted innovation numbers of a genotype and of their aligned weights
+    :param other_connection_genes: tuple of the sorted innovation numbers of another genotype and of their weights
+    :return: float distance, 0 for genotypes with the same genes and weights
+    """
+    return float(compatibility_distances(
+        connection_genes, (other_connection_genes,), excess_coef, disjoint_coef, weight_coef)[0])
+
+
+def compatibility_distances(connection_genes, others, excess_coef=1., disjoint_coef=1., weight_coef=.4):
+    """
+    Vectorized compatibility_distance from one genotype to each of many others, in a single pass over their genes.
+
+    :param connection_genes: tuple of the sorted innovation numbers of a genotype and of their aligned weights
+    :param others: sequence of tuples of the sorted innovation numbers and aligned weights of the other genotypes
+    :return: (n_others,) array of the distances
+    """
+    innovations, weights = connection_genes
+    size = len(innovations)
+    sizes = np.array([len(other_innovations) for other_innovations, _ in others], dtype=np.int64)
+    other_innovations = np.concatenate([genes[0] for genes in others] or [np.empty(0, dtype=np.int64)])
+    other_weights = np.concatenate([genes[1] for genes in others] or [np.empty(0)])
+    owners = np.repeat(np.arange(len(sizes)), sizes)
+
+    positions = np.searchsorted(innovations, other_innovations)
+    found = positions < size
+    found[found] = innovations[positions[found]] == other_innovations[found]
+    matching = np.bincount(owners[found], minlength=len(sizes))
+    weight_diff = np.bincount(owners[found], weights=np.abs(other_weights[found] - weights[positions[found]]),
+                              minlength=len(sizes)) / np.maximum(matching, 1)
+
+    # Genes of the others beyond the last one of the genotype, and genes of the genotype beyond the last of each other
+    beyond = np.bincount(owners[other_innovations > innovations[-1]] if size else owners, minlength=len(sizes))
+    beyond_others = np.full(len(sizes), size)
+    has_genes = sizes > 0
+    beyond_others[has_genes] -= np.searchsorted(innovations, other_innovations[np.cumsum(sizes)[has_genes] - 1],
+                                                side='right')
+    excess = beyond + beyond_others
+    disjoint = size + sizes - 2 * matching - excess
+    return (excess_coef * excess + disjoint_coef * disjoint) / np.maximum(np.maximum(sizes, size), 1) + \
+        weight_coef * weight_diff
+
+
+def distance_matrix(connection_genes, excess_coef=1., disjoint_coef=1., weight_coef=.4):
+    """
+    Vectorized compatibility_distance between every pair of many genotypes.
+
+    :param connection_genes: sequence of tuples of the sorted innovation numbers and aligned weights of every genotype
+    :return: symmetric (n_genotypes, n_genotypes) array of the distances
+    """
+    count = len(connection_genes)
+    innovations = np.unique(np.concatenate([genes[0] for genes in connection_genes] or [np.empty(0, dtype=int)]))
+    present = np.zeros((count, len(innovations)), dtype=bool)
+    weights = np.zeros((count, len(innovations)))
+    for row, (genotype_innovations, genotype_weights) in enumerate(connection_genes):
+        columns = np.searchsorted(innovations, genotype_innovations)
+        present[row, columns] = True
+        weights[row, columns] = genotype_weights
+
+    counts = present.astype(np.int64)
+    sizes = counts.sum(axis=1)
+    matching = counts @ counts.T
+    # cumulative[i, k + 1] counts the genes of i up to innovation column k, and last[j] is the last column of j
+    cumulative = np.concatenate((np.zeros((count, 1), dtype=np.int64), np.cumsum(counts, axis=1)), axis=1)
+    last = np.full(count, -1)
+    if len(innovations):
+        has_genes = sizes > 0
+        last[has_genes] = len(innovations) - 1 - np.argmax(present[has_genes, ::-1], axis=1)
+    beyond = sizes[:, None] - cumulative[:, last + 1]
+    excess = beyond + beyond.T
+    disjoint = sizes[:, None] + sizes[None, :] - 2 * matching - excess
+
+    weight_diff = np.zeros((count, count))
+    for row in range(count):
+        shared = present[row] & present
+        weight_diff[row] = (np.abs(weights[row] - weights) * shared).sum(axis=1)
+    weight_diff /= np.maximum(matching, 1)
+    return (excess_coef * excess + disjoint_coef * disjoint) / np.maximum(
+        np.maximum(sizes[:, None], sizes[None, :]), 1) + weight_coef * weight_diff
+
+
+class Genome:
+    """ In-memory genotype, its connection genes held as parallel arrays sorted by innovation number """
+
+    __slots__ = ('enabled', 'in_node_ids', 'innovations', 'node_ids', 'out_node_ids', 'weights')
+
+    def __init__(self, node_ids, innovations=(), in_node_ids=(), out_node_ids=(), weights=(), enabled=()):
+        """
+
+        :param node_ids: iterable of the node ids of the genome
+        :param innovations: historical_connection_id of every connection gene
+        :param in_node_ids: in_node_id of every connection gene
+        :param out_node_ids: out_node_id of every connection gene
+        :param weights: weight of every connection gene
+        :param enabled: is_enabled flag of every connection gene
+        """
+        innovations = np.asarray(innovations, dtype=np.int64)
+        order = np.argsort(innovations, kind='stable')
+        self.node_ids = set(node_ids)
+        self.innovations = innovations[order]
+        self.in_node_ids = np.asarray(in_node_ids, dtype=np.int64)[order]
+        self.out_node_ids = np.asarray(out_node_ids, dtype=np.int64)[order]
+        self.weights = np.asarray(weights, dtype=float)[order]
+        self.enabled = np.asarray(enabled, dtype=bool)[order]
+
+    def __len__(self):
+        return len(self.innovations)
+
+    def copy(self):
+        return Genome(
+            self.node_ids, self.innovations, self.in_node_ids, self.out_node_ids, self.weights.copy(),
+            self.enabled.copy())
+
+    @property
+    def pairs(self):
+        """ List of the (in_node_id, out_node_id) pair of every connection gene """
+        return list(zip(self.in_node_ids.tolist(), self.out_node_ids.tolist()))
+
+    @property
+    def connection_genes(self):
+        """ Tuple of the sorted innovation numbers and of their aligned weights, as used by compatibility_distance """
+        return self.innovations, self.weights
+
+    def add_connections(self, innovations, in_node_ids, out_node_ids, weights, enabled):
+        """ Appends connection genes, keeping the arrays sorted by innovation number """
+        if not len(innovations):
+            return
+        innovations = np.concatenate((self.innovations, np.asarray(innovations, dtype=np.int64)))
+        order = np.argsort(innovations, kind='stable')
+        self.innovations = innovations[order]
+        self.in_node_ids = np.concatenate((self.in_node_ids, np.asarray(in_node_ids, dtype=np.int64)))[order]
+        self.out_node_ids = np.concatenate((self.out_node_ids, np.asarray(out_node_ids, dtype=np.int64)))[order]
+        self.weights = np.concatenate((self.weights, np.asarray(weights, dtype=float)))[order]
+        self.enabled = np.concatenate((self.enabled, np.asarray(enabled, dtype=bool)))[order]
+
+    def distance(self, other, excess_coef=1., disjoint_coef=1., weight_coef=.4):
+        return compatibility_distance(
+            self.connection_genes, other.connection_genes, excess_coef, disjoint_coef, weight_coef)
+
+    def compile(self, node_types, activation_func=ActivationTypes.sigmoid, node_activations=None):
+        """
+        :param dict node_types: mapping of node_id to node_type_id, holding at least the nodes of this genome
+        :return: the core.phenotype.Phenotype of the enabled connections
+        """
+        connections = tuple(zip(
+            self.in_node_ids[self.enabled].tolist(), self.out_node_ids[self.enabled].tolist(),
+            self.weights[self.enabled].tolist()))
+        node_ids = set(self.node_ids)
+        for in_node_id, out_node_id, _ in connections:
+            node_ids |= {in_node_id, out_node_id}
+        return Phenotype(
+            {node_id: node_types[node_id] for node_id in node_ids}, connections, activation_func, node_activations)
+
+    def as_genotype_kwargs(self, parent_genotype_ids=()):
+        """
+        :return: the kwargs creating the core.orm.genotype.Genotype persisting this genome
+        """
+        return {
+            'node_ids': set(self.node_ids),
+            'connection_dicts': tuple(
+                {'historical_connection_id': innovation, 'weight': weight, 'is_enabled': is_enabled}
+                for innovation, weight, is_enabled in
+                zip(self.innovations.tolist(), self.weights.tolist(), self.enabled.tolist())
+            ),
+            'parent_genotype_ids': set(parent_genotype_ids),
+        }
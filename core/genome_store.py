@@ -0,0 +1,127 @@
+"""
+Read-only store of the genomes of every published generation, one immutable array file per generation, which
+evaluator processes memory-map instead of receiving pickled genomes or querying the database.
+"""
+
+import os
+
+import numpy as np
+
+from core.activation import ActivationTypes
+from core.checkpoint import offsets, read_arrays, read_meta, write_arrays
+from core.genome import Genome
+
+STORE_VERSION = 1
+
+
+def generation_path(folderpath, generation_id):
+    return os.path.join(folderpath, f'generation_{generation_id}.bin')
+
+
+def publish_generation(folderpath, run_id, population_id, generation_id, individuals, genomes, node_types):
+    """
+    Appends a generation to the store as an offsets table over contiguous node and connection arrays. A file already
+    published by the same run for the same population is kept as it is, any other one being atomically replaced, so
+    that readers which mapped it keep their copy.
+
+    :param str folderpath: folder of the store
+    :param str run_id: identity of the model publishing, telling its files apart from those of other runs
+    :param int population_id:
+    :param int generation_id:
+    :param dict individuals: mapping of every individual_id to its genotype_id and specie_id
+    :param dict genomes: mapping of every genotype_id to its core.genome.Genome
+    :param dict node_types: mapping of every node_id used to its node_type_id
+    :return: path of the generation file
+    """
+    path = generation_path(folderpath, generation_id)
+    meta = {'version': STORE_VERSION, 'run_id': run_id, 'population_id': population_id, 'generation_id': generation_id}
+    if os.path.exists(path):
+        try:
+            if read_meta(path) == meta:
+                return path
+        except ValueError:
+            pass
+    os.makedirs(folderpath, exist_ok=True)
+    genotype_ids = sorted(genomes)
+    position = {genotype_id: index for index, genotype_id in enumerate(genotype_ids)}
+    ordered = [genomes[genotype_id] for genotype_id in genotype_ids]
+
+    def concatenate(attribute, dtype):
+        return np.concatenate([getattr(genome, attribute) for genome in ordered] or [np.empty(0, dtype=dtype)])
+
+    arrays = {
+        'individual_ids': np.array(list(individuals), dtype=np.int64),
+        'individual_genomes': np.array([position[genotype_id] for genotype_id, _ in individuals.values()],
+                                       dtype=np.int64),
+        'genotype_ids': np.array(genotype_ids, dtype=np.int64),
+        'node_offsets': offsets([len(genome.node_ids) for genome in ordered]),
+        'genome_node_ids': np.array([node_id for genome in ordered for node_id in sorted(genome.node_ids)],
+                                    dtype=np.int64),
+        'connection_offsets': offsets([len(genome) for genome in ordered]),
+        'innovations': concatenate('innovations', np.int64),
+        'in_node_ids': concatenate('in_node_ids', np.int64),
+        'out_node_ids': concatenate('out_node_ids', np.int64),
+        'weights': concatenate('weights', float),
+        'enabled': concatenate('enabled', bool),
+        'node_ids': np.array(sorted(node_types), dtype=np.int64),
+        'node_types': np.array([node_types[node_id] for node_id in sorted(node_types)], dtype=np.int64),
+    }
+    write_arrays(path, arrays, meta)
+    return path
+
+
+class GenomeStore:
+    """ Zero-copy view of one published generation, its arrays being memory-mapped read-only """
+
+    def __init__(self, path):
+        """
+
+        :param str path: generation file written by publish_generation
+        """
+        self.path = path
+        self._arrays, meta = read_arrays(path)
+        if meta.get('version') != STORE_VERSION:
+            raise ValueError(f"Unsupported genome store version {meta.get('version')}, expected {STORE_VERSION}")
+        self.run_id = meta['run_id']
+        self.population_id = meta['population_id']
+        self.generation_id = meta['generation_id']
+        self._individual_index = None
+        self._node_types = None
+
+    def __len__(self):
+        return len(self._arrays['individual_ids'])
+
+    def __getitem__(self, name):
+        return self._arrays[name]
+
+    @property
+    def individual_ids(self):
+        return self._arrays['individual_ids'].tolist()
+
+    @property
+    def node_types(self):
+        """ Dict mapping every node_id of the generation to its node_type_id, built once """
+        if self._node_types is None:
+            self._node_types = dict(zip(self._arrays['node_ids'].tolist(), self._arrays['node_types'].tolist()))
+        return self._node_types
+
+    def genome(self, individual_id):
+        """
+        :return: the core.genome.Genome of the individual, copied out of the mapped slices of its genotype
+        """
+        if self._individual_index is None:
+            self._individual_index = {
+                individual_id: index for index, individual_id in enumerate(self._arrays['individual_ids'].tolist())}
+        index = int(self._arrays['individual_genomes'][self._individual_index[individual_id]])
+        node_start, node_stop = self._arrays['node_offsets'][index:index + 2]
+        start, stop = self._arrays['connection_offsets'][index:index + 2]
+        return Genome(
+            self._arrays['genome_node_ids'][node_start:node_stop].tolist(),
+            *(self._arrays[name][start:stop] for name in
+              ('innovations', 'in_node_ids', 'out_node_ids', 'weights', 'enabled')))
+
+    def compile(self, individual_id, activation_func=ActivationTypes.sigmoid):
+        """
+        :return: the core.phenotype.Phenotype of the individual
+        """
+        return self.genome(individual_id).compile(self.node_types, activation_func)
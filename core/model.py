@@ -1,23 +1,103 @@
+import os
 import random
+import tempfile
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 
+import numpy as np
+
+from core.checkpoint import dump_population, read_arrays, restore_population, write_arrays
 from core.export import Export
+from core.genome_store import GenomeStore, publish_generation
 from core.orm.connections import HistoricalConnection, Connection
+from core.orm.database import placeholders
 from core.orm.enums import NodeTypes
 from core.orm.generation import Generation
 from core.orm.genotype import Genotype
 from core.orm.individual import Specie, Individual
+from core.orm.innovation import InnovationRegistry
+from core.orm.metadata import ModelMetadata
 from core.orm.node import Node
 from core.orm.population import Population
+from core.reproduction import crossover, mutate, offspring_quotas, select
+
+_worker_batch_inputs = None
+_worker_fitness_fn = None
+_worker_store = None
+
+
+def _init_worker(batch_inputs, fitness_fn):
+    global _worker_batch_inputs, _worker_fitness_fn, _worker_store
+    _worker_batch_inputs = batch_inputs
+    _worker_fitness_fn = fitness_fn
+    _worker_store = None
+
+
+def _evaluate_individual(individual_id, store_path):
+    global _worker_store
+    if _worker_store is None or _worker_store.path != store_path:  # mapped once per generation and worker
+        _worker_store = GenomeStore(store_path)
+    return _worker_fitness_fn(_worker_store.compile(individual_id).forward(_worker_batch_inputs))
 
 
 class NEATModel:
-    def __init__(self, db):
+    def __init__(self, db, workers=1, store_folder=None):
+        """
+
+        :param core.orm.database.Database db:
+        :param int workers: number of processes used for evaluation, 1 evaluates in-process and None uses every core
+        :param str store_folder: folder where the genomes of every evaluated generation are published, see
+            core.genome_store, a temporary folder being used by the workers when not given
+        """
         self._db = db
+        self._workers = workers
+        self._store_folder = store_folder
+        self._run_id = uuid.uuid4().hex  # tells the generations published by this model apart in a shared store
+        self._tmp_store = None
+        self._executor = None  # pool of the workers evaluating the generations of the current run
+        self._innovations = self._db.innovations = InnovationRegistry(self._db)
         self._start_generation = None
         self._generation = None
         self._population = None
         self._input_node_ids = tuple()
         self._output_node_ids = tuple()
+        self.reload_metadata()
+        self._db.on_rollback(self.reload_metadata)
+
+    @property
+    def metadata(self):
+        """ Hyperparameters shared with the ORM elements, its id being their version """
+        return self._db.metadata
+
+    def reload_metadata(self):
+        """
+        Loads the latest model_metadata row once for the model and every ORM element of its database. Must be called
+        whenever model_metadata is changed other than through set_metadata.
+
+        :return: the current core.orm.metadata.ModelMetadata, None while the table is empty
+        """
+        has_metadata = self._db.execute("""SELECT COUNT(*) FROM model_metadata""")[0][0]
+        self._db.metadata = ModelMetadata.load(self._db) if has_metadata else None
+        return self._db.metadata
+
+    def set_metadata(self, **hyperparameters):
+        """
+        Stores a new version of the hyperparameters as a new model_metadata row, the unspecified ones being kept.
+
+        :return: the new core.orm.metadata.ModelMetadata
+        """
+        columns = tuple(field for field in ModelMetadata._fields if field not in ('id', 'mutation_rate'))
+        if set(hyperparameters) - set(columns):
+            raise ValueError(f"Unknown hyperparameters {', '.join(sorted(set(hyperparameters) - set(columns)))}")
+        values = self._db.metadata._asdict() if self._db.metadata is not None else {}
+        values = {column: hyperparameters.get(column, values.get(column)) for column in columns}
+        values = {column: value for column, value in values.items() if value is not None}
+        self._db.execute(
+            f"""INSERT INTO model_metadata ({', '.join(values)}) VALUES ({placeholders(values)})""",
+            tuple(values.values()),
+        )
+        return self.reload_metadata()
 
     def _initialize_nodes(self, size_input, size_output):
         self._start_generation = self._generation = self.get_generation()
@@ -45,12 +125,16 @@ class NEATModel:
                 individual_dicts))
 
     def initialize(self, size_input, size_output, pop_size=100, speciation_tresh=0.25):
-        self._db.execute(
-            f"""
-        INSERT INTO model_metadata (speciation_tresh, population_size) VALUES ({speciation_tresh}, {pop_size})
-        """)
-        self._initialize_nodes(size_input, size_output)
-        self._initialize_population(pop_size)
+        with self._db.transaction():
+            self._db.execute(
+                """
+            INSERT INTO model_metadata (speciation_tresh, population_size) VALUES (?, ?)
+            """,
+                (speciation_tresh, pop_size),
+            )
+            self.reload_metadata()
+            self._initialize_nodes(size_input, size_output)
+            self._initialize_population(pop_size)
 
     #####################
     # classes shortcuts #
@@ -90,11 +174,199 @@ class NEATModel:
     #      actions      #
     #####################
 
-    def export_individual(self, folderpath, genotype_id=None):
-        genotype_ids = [genotype_id] if genotype_id else self._db.execute(
-            """
-                    SELECT genotype.id
-                    FROM genotype
-                    """)
-        exporter = Export((Genotype(self._db, genotype_id).as_dict() for genotype_id in genotype_ids), folderpath)
-        exporter.render()
+    def publish_generation(self, folderpath=None):
+        """
+        Appends the genomes of the current population to the genome store, once per generation.
+
+        :param str folderpath: folder of the store, defaults to the store_folder of the model or a temporary folder
+        :return: path of the generation file, to be opened with core.genome_store.GenomeStore
+        """
+        if self._population is None:
+            raise ValueError("The model must be initialized before publishing a generation")
+        folderpath = folderpath or self._store_folder
+        if folderpath is None:
+            if self._tmp_store is None:
+                self._tmp_store = tempfile.TemporaryDirectory(prefix='neat_store_')
+            folderpath = self._tmp_store.name
+        return publish_generation(
+            folderpath, self._run_id, self._population.id, self._population.generation_id,
+            *self._population.genomes())
+
+    def evaluate(self, batch_inputs, fitness_fn, workers=None):
+        """
+        Scores every individual of the current population and writes the scores back in one bulk update.
+
+        The generation is first published to the genome store, which every worker memory-maps once, so that tasks
+        only carry individual ids. The workers of the run in progress are reused, a pool being created otherwise.
+        fitness_fn must be picklable, e.g. defined at module level.
+
+        :param batch_inputs: array-like of shape (n_samples, n_inputs)
+        :param fitness_fn: callable mapping the (n_samples, n_outputs) outputs of one individual to its score
+        :param int workers: overrides the worker count given to the model
+        :return: dict mapping every individual_id to its score
+        """
+        workers = self._worker_count(workers)
+        if workers == 1:
+            if self._store_folder is not None:
+                self.publish_generation()
+            return self._population.evaluate(batch_inputs, fitness_fn)
+
+        store_path = self.publish_generation()
+        individual_ids = sorted(self._population.individual_ids)
+        chunksize = max(1, len(individual_ids) // (workers * 4))
+        executor = self._executor or self._create_executor(batch_inputs, fitness_fn, workers)
+        try:
+            scores = dict(zip(individual_ids, executor.map(
+                _evaluate_individual, individual_ids, repeat(store_path, len(individual_ids)), chunksize=chunksize)))
+        finally:
+            if executor is not self._executor:
+                executor.shutdown()
+        self._population.set_scores(scores)
+        return scores
+
+    def _worker_count(self, workers=None):
+        return workers or self._workers or os.cpu_count()
+
+    @staticmethod
+    def _create_executor(batch_inputs, fitness_fn, workers):
+        """
+        :return: a pool of worker processes evaluating the individuals of any published generation
+        """
+        return ProcessPoolExecutor(
+            max_workers=workers, initializer=_init_worker,
+            initargs=(np.asarray(batch_inputs, dtype=float), fitness_fn))
+
+    def _breed(self, specie_id, pools, scores, genomes, metadata, node_types, bias_node_id):
+        """
+        :return: genotype_kwargs of one newborn of the specie, cloned and mutated or crossed over
+        """
+        pool = pools[specie_id]
+        parent = select(pool, [scores[individual_id] for individual_id, _ in pool])
+        if random.random() < metadata.reproduction_cloning_rate:
+            genome = mutate(genomes[parent[1]].copy(), metadata, node_types, self._innovations, bias_node_id)
+            return genome.as_genotype_kwargs((parent[1],))
+
+        other_pool = pool
+        if random.random() < metadata.reproduction_interspecie_rate and len(pools) > 1:
+            other_pool = pools[random.choice([other_id for other_id in pools if other_id != specie_id])]
+        other_parent = select(other_pool, [scores[individual_id] for individual_id, _ in other_pool])
+        genome = crossover(
+            genomes[parent[1]], genomes[other_parent[1]], scores[parent[0]], scores[other_parent[0]])
+        return genome.as_genotype_kwargs((parent[1], other_parent[1]))
+
+    def step(self, batch_inputs, fitness_fn, workers=None):
+        """
+        Runs one generation: evaluates the current population, breeds the next one in memory and persists it in a
+        single transaction.
+
+        Every specie gets offspring in proportion to its mean score. Its champion is carried over unchanged, and the
+        others are bred from its best individuals, as kept by specie_cull_rate.
+
+        :param batch_inputs: array-like of shape (n_samples, n_inputs)
+        :param fitness_fn: callable mapping the (n_samples, n_outputs) outputs of one individual to its score
+        :param int workers: overrides the worker count given to the model
+        :return: dict mapping every individual_id of the evaluated population to its score
+        """
+        if self._population is None:
+            raise ValueError("The model must be initialized before running generations")
+        scores = self.evaluate(batch_inputs, fitness_fn, workers)
+        metadata = self._db.metadata
+        individuals, genomes, node_types = self._population.genomes()
+        bias_node_id = next(node_id for node_id, node_type in node_types.items() if node_type == NodeTypes.bias)
+
+        species = {}
+        for individual_id, (genotype_id, specie_id) in individuals.items():
+            species.setdefault(specie_id, []).append((individual_id, genotype_id))
+        quotas = offspring_quotas(
+            {
+                specie_id: [scores[individual_id] for individual_id, _ in members]
+                for specie_id, members in species.items()
+            },
+            metadata.population_size,
+        )
+        pools = {}
+        for specie_id, members in species.items():
+            members.sort(key=lambda member: (-scores[member[0]], member[0]))
+            pools[specie_id] = members[:max(1, round(len(members) * metadata.specie_cull_rate))]
+
+        # bred in the transaction, so that a failure also rolls back the innovations registered by the mutations
+        with self._db.transaction():
+            individual_dicts = []
+            for specie_id, quota in quotas.items():
+                if quota:
+                    individual_dicts.append({'genotype_id': pools[specie_id][0][1], 'specie_id': specie_id})
+                individual_dicts.extend(
+                    {'genotype_kwargs': self._breed(
+                        specie_id, pools, scores, genomes, metadata, node_types, bias_node_id)}
+                    for _ in range(quota - 1)
+                )
+            self._generation = self.get_generation()
+            self._population = Population(
+                self._db, generation_id=self._generation.id, individual_dicts=individual_dicts,
+                parent_population_id=self._population.id)
+        return scores
+
+    def run(self, batch_inputs, fitness_fn, n_generations, workers=None):
+        """
+        Runs n_generations steps, their evaluations sharing one pool of worker processes.
+
+        :return: list of the best score of every evaluated generation, once every generation is written to the database
+        """
+        workers = self._worker_count(workers)
+        if workers != 1:
+            self._executor = self._create_executor(batch_inputs, fitness_fn, workers)
+        try:
+            best_scores = [max(self.step(batch_inputs, fitness_fn, workers).values()) for _ in range(n_generations)]
+        finally:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+        self._db.flush()
+        return best_scores
+
+    def save_checkpoint(self, path):
+        """
+        Writes the current population, with everything needed to resume from it, in a binary file, see
+        core.checkpoint.
+        """
+        if self._population is None:
+            raise ValueError("The model must be initialized before saving a checkpoint")
+        arrays, meta = dump_population(self._db, self._population.id)
+        version, state, gauss = random.getstate()
+        arrays['random_state'] = np.array(state, dtype=np.uint32)
+        meta['random_state'] = [version, gauss]
+        write_arrays(path, arrays, meta)
+
+    def load_checkpoint(self, path):
+        """
+        Resumes from a checkpoint written by save_checkpoint, restoring it in the database of the model, which must hold
+        no population yet, and the state of the random generator.
+        """
+        arrays, meta = read_arrays(path)
+        restore_population(self._db, arrays, meta)
+        self._innovations.load()
+        self.reload_metadata()
+        self._start_generation = self._generation = self.get_generation(meta['generation_id'])
+        self._population = self.get_population(population_id=meta['population_id'])
+        node_ids, node_types = arrays['node_ids'].tolist(), arrays['node_types'].tolist()
+        self._input_node_ids = [
+            node_id for node_id, node_type in zip(node_ids, node_types)
+            if node_type in (NodeTypes.bias, NodeTypes.input)
+        ]
+        self._output_node_ids = [
+            node_id for node_id, node_type in zip(node_ids, node_types) if node_type == NodeTypes.output]
+        version, gauss = meta['random_state']
+        random.setstate((version, tuple(arrays['random_state'].tolist()), gauss))
+
+    def export_individual(self, folderpath, genotype_id=None, generation_id=None, specie_id=None, top_k=None,
+                          **render_kwargs):
+        """
+        Writes the dot file of the given genotype, or of every genotype matching the filters, see
+        core.export.stream_genotype_dicts.
+
+        :param render_kwargs: workers, image_format and other options of core.export.Export.render
+        :return: number of rendered genotypes
+        """
+        genotype_ids = (genotype_id,) if genotype_id else None
+        exporter = Export.from_database(self._db, folderpath, genotype_ids, generation_id, specie_id, top_k)
+        return exporter.render(**render_kwargs)
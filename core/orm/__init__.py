@@ -24,22 +24,27 @@ class AbstractModelElement:
 
     def _search_from_id(self, element_id: int, class_table=None):
         class_table = class_table or self.__class__
+        res = self._db.cache.get(class_table._table, element_id)
+        if res is not None:
+            return self._cast_data_to_types(*res)
         res = self._db.execute(
             f"""
                 SELECT {', '.join(class_table._columns)}
                 FROM {class_table._table}
-                WHERE id = {element_id}
+                WHERE id = ?
                 ORDER BY id DESC
                 LIMIT 1
-            """
+            """,
+            (element_id,),
         )
         if not res:
             raise ValueError(f"No {__class__} exists with that id")
+        self._db.cache.set(class_table._table, element_id, res)
         return self._cast_data_to_types(*res)
 
     def _search_from_data(self, class_table=None, **kwargs):
         class_table = class_table or self.__class__
-        where_clause = ' AND '.join((f"{key} = {value}" for key, value in kwargs.items()))
+        where_clause = ' AND '.join(f"{key} = ?" for key in kwargs)
 
         res = self._db.execute(
             f"""
@@ -48,6 +53,7 @@ class AbstractModelElement:
                 WHERE {where_clause}
                 ORDER BY id DESC
                 LIMIT 1
-            """
+            """,
+            tuple(kwargs.values()),
         )
         return self._cast_data_to_types(*res)
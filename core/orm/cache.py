@@ -0,0 +1,46 @@
+from collections import OrderedDict
+
+
+class EntityCache:
+    """ Identity map of the rows loaded by the ORM, keyed by (table, id) and evicting the least recently used """
+
+    def __init__(self, maxsize=2 ** 16):
+        """
+
+        :param int maxsize: number of rows kept, 0 disabling the cache
+        """
+        self._maxsize = maxsize
+        self._rows = OrderedDict()
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __contains__(self, key):
+        return key in self._rows
+
+    def get(self, table, element_id):
+        """
+        :return: the cached row of the element, or None when it has to be loaded from the database
+        """
+        key = (table, element_id)
+        row = self._rows.get(key)
+        if row is not None:
+            self._rows.move_to_end(key)
+        return row
+
+    def set(self, table, element_id, row):
+        if not self._maxsize:
+            return
+        key = (table, element_id)
+        self._rows[key] = row
+        self._rows.move_to_end(key)
+        while len(self._rows) > self._maxsize:
+            self._rows.popitem(last=False)
+
+    def invalidate(self, table, *element_ids):
+        """ Drops the cached rows of elements written outside of a full reload """
+        for element_id in element_ids:
+            self._rows.pop((table, element_id), None)
+
+    def clear(self):
+        self._rows.clear()
@@ -1,6 +1,7 @@
 from typing import Dict
 
 from core.orm import AbstractModelElement
+from core.orm.database import transactional
 
 
 class HistoricalConnection(AbstractModelElement):
@@ -10,13 +11,20 @@ class HistoricalConnection(AbstractModelElement):
     in_node: int
     out_node: int
 
+    @transactional
     def __init__(self, db, historical_connection_id=None, in_node_id=None, out_node_id=None):
         if not (historical_connection_id or (in_node_id and out_node_id)):
             raise ValueError("Must be given either an existing historical_connection_id or in and out_node_id")
 
         super().__init__(db)
         res = None, None, None
-        if historical_connection_id:
+        innovations = self._db.innovations
+        if innovations is not None:
+            if historical_connection_id:
+                res = (historical_connection_id, *innovations.get_node_pair(historical_connection_id))
+            else:
+                res = (innovations.get_historical_id(in_node_id, out_node_id), in_node_id, out_node_id)
+        elif historical_connection_id:
             res = self._search_from_id(
                 historical_connection_id,
                 class_table=HistoricalConnection,
@@ -39,12 +47,13 @@ class HistoricalConnection(AbstractModelElement):
 
     def _create_historical_connection(self, in_node_id, out_node_id):
         self._db.execute(
-            f"""
-                INSERT INTO connection_historical (in_node_id, out_node_id)
-                    VALUES ({in_node_id}, {out_node_id})
             """
+                INSERT INTO connection_historical (in_node_id, out_node_id)
+                    VALUES (?, ?)
+            """,
+            (in_node_id, out_node_id),
         )
-        return self._search_from_data(class_table=HistoricalConnection, in_node_id=in_node_id, out_node_id=out_node_id)
+        return self._db.lastrowid, in_node_id, out_node_id
 
 
 class Connection(HistoricalConnection):
@@ -62,6 +71,7 @@ class Connection(HistoricalConnection):
     in_node: int
     out_node: int
 
+    @transactional
     def __init__(
             self,
             db,
@@ -95,24 +105,28 @@ class Connection(HistoricalConnection):
 
         if not connection_id:
             res = self._db.execute(
-                f"""
+                """
             SELECT id
             FROM genotype
-            WHERE id = {genotype_id}
+            WHERE id = ?
             ORDER BY id DESC
             LIMIT 1
-            """)
+            """,
+                (genotype_id,),
+            )
             if not res:
                 raise ValueError("Specified genotype_id doesn't exist")
 
             res = self._db.execute(
-                f"""
+                """
             SELECT id, genotype_id, is_enabled, weight
             FROM connection
-            WHERE genotype_id = {genotype_id} AND historical_id = {self.historical_id}
+            WHERE genotype_id = ? AND historical_id = ?
             ORDER BY id DESC
             LIMIT 1
-            """)
+            """,
+                (genotype_id, self.historical_id),
+            )
 
             if res:
                 self.id, self.genotype_id, self._is_enabled, self._weight = res
@@ -124,24 +138,14 @@ class Connection(HistoricalConnection):
                 is_enabled = is_enabled if is_enabled is not None else True
                 weight = weight if weight is not None else 1.0
                 self._db.execute(
-                    f"""
+                    """
                 INSERT INTO connection (historical_id, genotype_id, is_enabled, weight)
-                    VALUES ({self.historical_id}, {genotype_id}, {is_enabled}, {weight})
-                """)
-
-                res = self._db.execute(
-                    f"""
-                SELECT id
-                FROM connection
-                WHERE (historical_id = {self.historical_id}
-                        AND genotype_id = {genotype_id}
-                        AND is_enabled = {"TRUE" if is_enabled else "FALSE"}
-                        AND weight = {weight})
-                ORDER BY id DESC
-                LIMIT 1
-                """)
-
-                self.id = res[0]
+                    VALUES (?, ?, ?, ?)
+                """,
+                    (self.historical_id, genotype_id, is_enabled, weight),
+                )
+                self.id = self._db.lastrowid
+                self._db.cache.invalidate('genotype', genotype_id)
                 self._weight = weight
                 self._is_enabled = is_enabled
                 self.genotype_id = genotype_id
@@ -149,6 +153,36 @@ class Connection(HistoricalConnection):
             self.in_node = historical_connection.in_node
             self.out_node = historical_connection.out_node
 
+    @classmethod
+    def load_for_genotypes(cls, db, genotype_ids):
+        """
+        Loads the connections of many genotypes, with their historical in and out nodes, in a single query.
+
+        :param core.orm.database.Database db:
+        :param genotype_ids: iterable of genotype ids
+        :return: dict mapping every genotype_id to the list of its connections, sorted by id
+        """
+        genotype_ids = tuple(set(genotype_ids))
+        connections = {genotype_id: [] for genotype_id in genotype_ids}
+        for connection_id, genotype_id, weight, is_enabled, historical_id, in_node_id, out_node_id in db.execute_in(
+                """
+            SELECT conn.id, conn.genotype_id, conn.weight, conn.is_enabled, conn.historical_id, ch.in_node_id,
+                ch.out_node_id
+            FROM connection AS conn
+            INNER JOIN connection_historical AS ch ON ch.id = conn.historical_id
+            WHERE conn.genotype_id IN ({ids})
+            ORDER BY conn.id
+            """,
+                genotype_ids,
+        ):
+            connection = cls.__new__(cls)
+            AbstractModelElement.__init__(connection, db)
+            connection.id, connection.genotype_id, connection.historical_id = connection_id, genotype_id, historical_id
+            connection._weight, connection._is_enabled = float(weight), bool(is_enabled)
+            connection.in_node, connection.out_node = in_node_id, out_node_id
+            connections[genotype_id].append(connection)
+        return connections
+
     @property
     def is_enabled(self):
         return self._is_enabled
@@ -156,11 +190,14 @@ class Connection(HistoricalConnection):
     @is_enabled.setter
     def is_enabled(self, value: bool):
         self._db.execute(
-            f"""
+            """
         UPDATE connection
-            SET is_enabled = {"TRUE" if value else "FALSE"}
-        WHERE id = {self.id}
-        """)
+            SET is_enabled = ?
+        WHERE id = ?
+        """,
+            (bool(value), self.id),
+        )
+        self._db.cache.invalidate(self._table, self.id)
         self._is_enabled = value
 
     @property
@@ -169,5 +206,6 @@ class Connection(HistoricalConnection):
 
     @weight.setter
     def weight(self, value: float):
-        self._db.execute(f"""UPDATE connection SET weight = {value} WHERE id = {self.id}""")
+        self._db.execute("""UPDATE connection SET weight = ? WHERE id = ?""", (value, self.id))
+        self._db.cache.invalidate(self._table, self.id)
         self._weight = value
@@ -1,20 +1,186 @@
+import functools
 import os
+import queue
 import sqlite3 as sql
+import threading
+from contextlib import contextmanager
 
-from core import PATH
+from core.orm.cache import EntityCache
+from core.orm.enums import validate_enums
+
+
+class _Writer(threading.Thread):
+    """ Thread replaying the committed write batches of a Database on its file through its own connection """
+
+    def __init__(self, filename, max_pending, pragmas):
+        super().__init__(name=f"Database writer {filename}", daemon=True)
+        self._filename = filename
+        self._pragmas = pragmas
+        self._batches = queue.Queue(max_pending)
+        self.error = None
+        self.dropped = 0  # committed batches not written since the error
+
+    def put(self, batch):
+        """ Queues a batch of (query, parameters, many) statements, blocking while max_pending are already queued """
+        if self.error is not None:
+            self.dropped += 1
+        self._raise()
+        self._batches.put(batch)
+
+    def flush(self):
+        """ Waits until every queued batch is written """
+        self._batches.join()
+        self._raise()
+
+    def close(self):
+        self._batches.put(None)
+        self.join()
+        self._raise()
+
+    def _raise(self):
+        if self.error is not None:
+            raise RuntimeError(
+                f"Writing to {self._filename} failed, {self.dropped} later committed transactions were not written"
+            ) from self.error
+
+    def run(self):
+        con = sql.connect(self._filename, cached_statements=512)
+        for pragma in self._pragmas:
+            con.execute(pragma)
+        try:
+            while True:
+                batch = self._batches.get()
+                try:
+                    if batch is None:
+                        return
+                    if self.error is not None:
+                        # nothing is written after a failed batch, which would leave the file inconsistent
+                        self.dropped += 1
+                        continue
+                    with con:
+                        for query, parameters, many in batch:
+                            (con.executemany if many else con.execute)(query, parameters)
+                except sql.Error as sql_error:
+                    self.error = sql_error
+                finally:
+                    self._batches.task_done()
+        finally:
+            con.close()
 
 
 class Database:
-    def __init__(self, name, override=False):
+    # PRAGMA values set on every connection: durable commits survive power losses and keep sqlite's rollback journal,
+    # fast ones survive application crashes, opting into WAL, and ephemeral ones are meant for databases which are
+    # thrown away
+    _profiles = {
+        'durable': {
+            'journal_mode': 'DELETE', 'synchronous': 'FULL', 'cache_size': -16384, 'mmap_size': 0,
+            'temp_store': 'DEFAULT',
+        },
+        'fast': {
+            'journal_mode': 'WAL', 'synchronous': 'NORMAL', 'cache_size': -65536, 'mmap_size': 2 ** 28,
+            'temp_store': 'MEMORY',
+        },
+        'ephemeral': {
+            'journal_mode': 'MEMORY', 'synchronous': 'OFF', 'cache_size': -65536, 'mmap_size': 2 ** 28,
+            'temp_store': 'MEMORY',
+        },
+    }
+
+    # Schema migrations applied in order on top of init_db, the schema version being stored as the user_version. A
+    # (query, script) pair only runs its script when the query returns a true value, i.e. on files it still applies to
+    _migrations = (
+        """
+            CREATE INDEX IF NOT EXISTS connection_genotype_idx
+                ON connection (genotype_id, historical_id, is_enabled, weight);
+            CREATE INDEX IF NOT EXISTS connection_historical_nodes_idx
+                ON connection_historical (in_node_id, out_node_id);
+            CREATE INDEX IF NOT EXISTS genotype_node_rel_genotype_idx
+                ON genotype_node_rel (genotype_id, node_id);
+            CREATE INDEX IF NOT EXISTS individual_population_idx
+                ON individual (population_id, genotype_id, specie_id, score);
+            CREATE INDEX IF NOT EXISTS individual_specie_idx
+                ON individual (specie_id, score);
+            CREATE INDEX IF NOT EXISTS population_generation_idx
+                ON population (generation_id);
+        """,
+        # scores are whatever the fitness function returns, so the INTEGER score column of older files becomes REAL
+        (
+            """SELECT type = 'INTEGER' FROM pragma_table_info('individual') WHERE name = 'score'""",
+            """
+            PRAGMA foreign_keys = OFF;
+            BEGIN;
+            CREATE TABLE individual_real_score (
+                id INTEGER PRIMARY KEY,
+                genotype_id INTEGER NOT NULL,
+                specie_id INTEGER NOT NULL,
+                score REAL DEFAULT 0 NOT NULL,
+                population_id INTEGER NOT NULL,
+                FOREIGN KEY (genotype_id)
+                    REFERENCES genotype(id)
+                    ON DELETE CASCADE
+                    ON UPDATE CASCADE ,
+                FOREIGN KEY (specie_id)
+                    REFERENCES specie (id)
+                    ON DELETE CASCADE
+                    ON UPDATE CASCADE,
+                FOREIGN KEY (population_id)
+                    REFERENCES population (id)
+                    ON DELETE CASCADE
+                    ON UPDATE CASCADE
+                );
+            INSERT INTO individual_real_score (id, genotype_id, specie_id, score, population_id)
+                SELECT id, genotype_id, specie_id, CAST(score AS REAL), population_id FROM individual;
+            DROP TABLE individual;
+            ALTER TABLE individual_real_score RENAME TO individual;
+            CREATE INDEX individual_population_idx
+                ON individual (population_id, genotype_id, specie_id, score);
+            CREATE INDEX individual_specie_idx
+                ON individual (specie_id, score);
+            COMMIT;
+            PRAGMA foreign_keys = ON;
+            """,
+        ),
+    )
+
+    # Largest id set bound as placeholders by execute_in, bigger ones being joined through a temporary table
+    _max_bound_ids = 512
+
+    def __init__(self, name, override=False, cache_size=2 ** 16, write_behind=False, max_pending=8,
+                 profile='durable'):
+        """
+
+        :param str name: path of the database file, or ':memory:'
+        :param bool override: whether to recreate the database from scratch
+        :param int cache_size: number of rows kept in the identity map of the ORM elements
+        :param bool write_behind: whether to work on an in-memory copy of the file, every committed transaction being
+            written to the file by a background thread, see flush and close
+        :param int max_pending: number of committed transactions queued for the writer before committing blocks
+        :param str profile: 'durable', 'fast' or 'ephemeral', setting the journal, synchronous, cache, mmap and
+            temp_store pragmas of the connections
+        """
         name = name + ".sqlite" if (not name.endswith('.sqlite') and name != ':memory:') else name
         name = os.path.abspath(name) if name != ':memory:' else name
         if os.path.exists(name) and not override:
             raise FileExistsError("A database with this name already exists")
         elif name != ':memory:' and not os.path.exists(name) and not override:
             raise FileNotFoundError("No database with this name exists")
+        if write_behind and name == ':memory:':
+            raise ValueError("Write-behind needs a database file")
+        if profile not in self._profiles:
+            raise ValueError(f"Unknown connection profile {profile}, expected one of {', '.join(self._profiles)}")
 
         self._filename = name
         self._name = '.'.join(name.split('.')[:-1])
+        self._transaction_depth = 0
+        self._profile = profile
+        self._rollback_callbacks = []
+        self.innovations = None  # core.orm.innovation.InnovationRegistry shared by the elements of this database
+        self.metadata = None  # core.orm.metadata.ModelMetadata loaded once by the model using this database
+        self.cache = EntityCache(cache_size)
+        self.on_rollback(self.cache.clear)
+        self._writer = None
+        self._pending = []  # (query, parameters, many) writes of the current transaction, queued for the writer
         self._con = self._connect()
         self._cursor = self._create_cursor()
 
@@ -25,25 +191,175 @@ class Database:
             self._con.commit()
         except sql.OperationalError:
             pass
+        self.migrate()
+        validate_enums(self)
+        if write_behind:
+            self._start_writer(max_pending)
 
     def _connect(self):
-        return sql.connect(self._filename)
+        con = sql.connect(self._filename, cached_statements=512)
+        for pragma in self._pragmas():
+            con.execute(pragma)
+        return con
+
+    def _pragmas(self):
+        pragmas = [f"PRAGMA {pragma} = {value}" for pragma, value in self._profiles[self._profile].items()]
+        # sqlite only enforces the foreign keys of connections enabling them
+        return pragmas + ["PRAGMA foreign_keys = ON"]
+
+    @property
+    def profile(self):
+        return self._profile
 
     def _create_cursor(self):
         return self._con.cursor()
 
+    def _start_writer(self, max_pending):
+        """ Moves the work to an in-memory copy of the file, which the writer thread then keeps up to date """
+        memory_con = sql.connect(':memory:', cached_statements=512)
+        memory_con.execute("PRAGMA foreign_keys = ON")
+        self._con.backup(memory_con)
+        self._con.close()
+        self._con = memory_con
+        self._cursor = self._create_cursor()
+        self._writer = _Writer(self._filename, max_pending, self._pragmas())
+        self._writer.start()
+
+    @property
+    def write_behind(self):
+        return self._writer is not None
+
+    def flush(self):
+        """ Blocks until every committed transaction is written to the file, raising if the writer failed """
+        if self._writer is not None:
+            self._writer.flush()
+
+    def close(self):
+        """ Writes the committed transactions, stops the writer and closes the connection """
+        try:
+            if self._writer is not None:
+                self._writer.close()
+        finally:
+            self._writer = None
+            self._con.close()
+
+    def _record(self, query, parameters, changes, many=False):
+        """
+        Queues a statement for the writer when it changed rows, as counted by sqlite, or the schema or a persistent
+        pragma, so that reads whatever their form are never replayed.
+
+        :param int changes: number of rows the statement inserted, updated or deleted
+        """
+        if self._writer is None:
+            return
+        verb = query.split(None, 1)[0].upper() if query.strip() else ''
+        if changes or verb in ('CREATE', 'DROP', 'ALTER') or (verb == 'PRAGMA' and '=' in query):
+            self._pending.append((query, parameters, many))
+
+    def _queue_pending(self):
+        if self._pending:
+            batch, self._pending = self._pending, []
+            self._writer.put(batch)
+
     def _clear(self):
-        query = """
-            PRAGMA writable_schema = 1;
-            delete from sqlite_master where type in ('table', 'index', 'trigger');
-            PRAGMA writable_schema = 0;
-            VACUUM;
-            PRAGMA INTEGRITY_CHECK;
+        """ Drops every table, view and trigger, which is much cheaper than rewriting the file with VACUUM """
+        schema = self._cursor.execute(
+            """
+            SELECT type, name
+            FROM sqlite_master
+            WHERE type IN ('table', 'view', 'trigger') AND name NOT LIKE 'sqlite_%'
+            """
+        ).fetchall()
+        drops = ''.join(f'DROP {element_type.upper()} IF EXISTS "{name}";' for element_type, name in schema)
+        self._cursor.executescript(
+            f"""
+            PRAGMA foreign_keys = OFF;
+            BEGIN;
+            {drops}
+            COMMIT;
+            PRAGMA user_version = 0;
             PRAGMA foreign_keys = ON;
+            """
+        )
+
+    @property
+    def schema_version(self):
+        return self._cursor.execute("""PRAGMA user_version""").fetchone()[0]
+
+    def migrate(self):
+        """ Applies the schema migrations not yet recorded in the database """
+        for version in range(self.schema_version, len(self._migrations)):
+            script = self._migrations[version]
+            if isinstance(script, tuple):
+                applies = self._cursor.execute(script[0]).fetchone()
+                script = script[1] if applies and applies[0] else ''
+            self._cursor.executescript(f"""{script} PRAGMA user_version = {version + 1};""")
+
+    def explain(self, query, parameters=()):
+        """
+        :return: list of the detail lines of the query plan sqlite would use to run the query
+        """
+        return [row[-1] for row in self._cursor.execute(f"EXPLAIN QUERY PLAN {query}", parameters).fetchall()]
+
+    def on_rollback(self, callback):
+        """ Registers a callable run after every rollback undoing writes, so that in-memory mirrors can resync """
+        self._rollback_callbacks.append(callback)
+
+    def _run_rollback_callbacks(self):
+        for callback in self._rollback_callbacks:
+            callback()
+
+    @contextmanager
+    def transaction(self):
         """
+        Defers every commit until the outermost transaction block exits, rolling everything back on error.
+        Nested blocks are savepoints, so an error caught around a nested block only undoes that block.
+        """
+        savepoint = f"transaction_{self._transaction_depth}"
+        pending_count = len(self._pending)
+        total_changes = self._con.total_changes
+        if self._transaction_depth:
+            self._cursor.execute(f"SAVEPOINT {savepoint}")
+        elif not self._con.in_transaction:
+            self._cursor.execute("BEGIN")
+        self._transaction_depth += 1
+        try:
+            yield self
+        except BaseException:
+            self._transaction_depth -= 1
+            if self._transaction_depth:
+                self._cursor.execute(f"ROLLBACK TO {savepoint}")
+                self._cursor.execute(f"RELEASE {savepoint}")
+            else:
+                self._con.rollback()
+            del self._pending[pending_count:]
+            if self._con.total_changes != total_changes:
+                self._run_rollback_callbacks()
+            raise
+        self._transaction_depth -= 1
+        if self._transaction_depth:
+            self._cursor.execute(f"RELEASE {savepoint}")
+        else:
+            self._commit()
 
-        self._cursor.executescript(query)
-        self._con.commit()
+    def _commit(self):
+        if not self._transaction_depth:
+            self._con.commit()
+            if self._writer is not None:
+                self._queue_pending()
+
+    def _rollback(self, total_changes=None):
+        """
+        Ends the implicit transaction of a failed statement, leaving explicit transactions to their scope.
+
+        :param int total_changes: changes of the connection before the statement, the rollback callbacks only running
+            when it wrote rows before failing
+        """
+        if not self._transaction_depth:
+            self._con.rollback()
+            self._pending.clear()
+            if total_changes is not None and self._con.total_changes != total_changes:
+                self._run_rollback_callbacks()
 
     def init_db(self):
         self._cursor.executescript(
@@ -165,7 +481,7 @@ class Database:
                     id INTEGER PRIMARY KEY,
                     genotype_id INTEGER NOT NULL,
                     specie_id INTEGER NOT NULL,
-                    score INTEGER DEFAULT 0 NOT NULL,
+                    score REAL DEFAULT 0 NOT NULL,
                     population_id INTEGER NOT NULL,
                     FOREIGN KEY (genotype_id)
                         REFERENCES genotype(id)
@@ -200,22 +516,106 @@ class Database:
             """
         )
 
-    def execute(self, query):
-        query += '' if query.endswith(';') else ';'
-        query = query.replace('!= NULL', 'IS NOT NULL')
-        query = query.replace('= NULL', 'IS NULL')
+    def execute(self, query, parameters=()):
+        """
+        :param str query: constant SQL text, using ? placeholders so that its compiled statement is reused
+        :param parameters: values bound to the placeholders of the query
+        """
+        total_changes = self._con.total_changes
         try:
-            res = self._cursor.execute(query)
+            res = self._cursor.execute(query, parameters)
         except sql.IntegrityError as sql_error:
+            self._rollback(total_changes)
             raise ValueError(query) from sql_error
         except sql.OperationalError as sql_error:
+            self._rollback(total_changes)
             raise SyntaxError(query) from sql_error
-        if "INSERT INTO" in query or "UPDATE" in query:
-            self._con.commit()
+        self._record(query, parameters, self._con.total_changes - total_changes)
+        if self._con.in_transaction or self._pending:
+            self._commit()
         res = res.fetchall()
         if len(res) == 1 and 'LIMIT 1' in query:
             return res[0]
         return res
 
+    def execute_in(self, query, ids, parameters=()):
+        """
+        Runs a query filtering on any number of ids at once, written as `IN ({ids})` in the query.
+
+        :param str query: SQL text where {ids} stands for the ids, using ? placeholders for the other parameters
+        :param ids: iterable of the ids
+        :param parameters: values bound to the placeholders following {ids} in the query
+        :return: list of every row, even when the query holds 'LIMIT 1'
+        """
+        ids = tuple(ids)
+        if len(ids) <= self._max_bound_ids:
+            return self._fetchall(query.format(ids=placeholders(ids)), (*ids, *parameters))
+        self._cursor.execute("""CREATE TEMP TABLE IF NOT EXISTS selected_ids (id INTEGER PRIMARY KEY)""")
+        self._cursor.executemany("""INSERT OR IGNORE INTO temp.selected_ids (id) VALUES (?)""", ((i,) for i in ids))
+        try:
+            return self._fetchall(query.format(ids="""SELECT id FROM temp.selected_ids"""), parameters)
+        finally:
+            self._cursor.execute("""DELETE FROM temp.selected_ids""")
+            self._commit()
+
+    def stream(self, query, parameters=(), batch_size=1024):
+        """
+        Iterates over the rows of a read query through its own cursor, fetching them in batches instead of all at once.
+
+        :return: generator of the rows
+        """
+        try:
+            cursor = self._con.execute(query, parameters)
+        except sql.OperationalError as sql_error:
+            raise SyntaxError(query) from sql_error
+        try:
+            while rows := cursor.fetchmany(batch_size):
+                yield from rows
+        finally:
+            cursor.close()
+
+    def _fetchall(self, query, parameters):
+        try:
+            return self._cursor.execute(query, parameters).fetchall()
+        except sql.OperationalError as sql_error:
+            self._rollback()
+            raise SyntaxError(query) from sql_error
+
+    @property
+    def lastrowid(self):
+        """ Id of the row inserted by the last INSERT statement executed """
+        return self._cursor.lastrowid
+
+    def executemany(self, query, parameters):
+        """ Runs one parameterized statement for every row of parameters, followed by at most one commit """
+        if self._writer is not None:
+            parameters = tuple(parameters)
+        total_changes = self._con.total_changes
+        try:
+            self._cursor.executemany(query, parameters)
+        except sql.IntegrityError as sql_error:
+            self._rollback(total_changes)
+            raise ValueError(query) from sql_error
+        except sql.OperationalError as sql_error:
+            self._rollback(total_changes)
+            raise SyntaxError(query) from sql_error
+        self._record(query, parameters, self._con.total_changes - total_changes, many=True)
+        self._commit()
+
+
+def placeholders(values):
+    """ Returns the '?, ?, ...' placeholder list binding every one of the given values """
+    return ', '.join('?' * len(values))
+
+
+def transactional(method):
+    """ Runs an ORM method in a transaction of its Database, given as first argument when constructing """
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        db = getattr(self, '_db', None) or (args[0] if args else kwargs['db'])
+        with db.transaction():
+            return method(self, *args, **kwargs)
+
+    return wrapper
 
-_db = Database(f'{PATH}/data/template', override=True)
@@ -1,14 +1,26 @@
-from core.orm.database import _db
+class NodeTypes:
+    """ Dataclass used as an enum for the different node types, matching the ids of the node_type table """
+    bias, input, hidden, output = 1, 2, 3, 4
 
-_matching_node_types = dict(_db.execute("""SELECT name, id FROM node_type ORDER BY id"""))
-_matching_mutation_types = dict(_db.execute("""SELECT name, id FROM mutation_type ORDER BY id"""))
 
+class MutationTypes:
+    """ Dataclass used as an enum for the different types of connection, matching the ids of the mutation_type table """
+    weight_change, switch_enabled, split_connection, = 1, 2, 3
 
-class NodeTypes:
-    """ Dataclass used as an enum for the different node types """
-    bias, input, hidden, output = _matching_node_types.values()
 
+_node_type_names = {'Bias': NodeTypes.bias, 'Input': NodeTypes.input, 'Hidden': NodeTypes.hidden,
+                    'Output': NodeTypes.output}
+_mutation_type_names = {'Weight': MutationTypes.weight_change, 'Enabling': MutationTypes.switch_enabled,
+                        'Split': MutationTypes.split_connection}
 
-class MutationTypes:
-    """ Dataclass used as an enum for the different types of connection """
-    weight_change, switch_enabled, split_connection, = _matching_mutation_types.values()
+
+def validate_enums(db):
+    """
+    Checks that the node_type and mutation_type tables of a database hold the ids of the enums.
+
+    :param core.orm.database.Database db:
+    """
+    for table, names in (('node_type', _node_type_names), ('mutation_type', _mutation_type_names)):
+        rows = dict(db.execute(f"""SELECT name, id FROM {table} ORDER BY id"""))
+        if rows != names:
+            raise ValueError(f"The {table} table does not match the enum ids {names}, got {rows}")
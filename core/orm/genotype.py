@@ -1,113 +1,375 @@
 import os
-import random
 
+import numpy as np
+
+from core.activation import ActivationTypes
+from core.export import DotRenderer, stream_genotype_dicts
+from core.genome import Genome, compatibility_distance
 from core.orm.connections import Connection
+from core.orm.database import placeholders, transactional
 from core.orm.enums import NodeTypes
+from core.orm.innovation import InnovationRegistry
+from core.orm.metadata import ModelMetadata
 from core.orm.node import Node
+from core.reproduction import mutate
 
 
 class Genotype:
+    @transactional
     def __init__(self, db, genotype_id=None, node_ids=None, connection_dicts=None, parent_genotype_ids=None):
         self._db = db
+        self._connection_genes = None
         parent_genotype_ids = parent_genotype_ids or []
         if not (genotype_id or (node_ids and connection_dicts)):
             raise ValueError("Must specify either an existing genotype_id or both node_ids and connection_dicts")
 
-        if genotype_id:
+        cached = self._db.cache.get('genotype', genotype_id) if genotype_id else None
+        if cached:
+            self.id, parent_ids, connection_ids, node_ids = cached
+            self.parent_ids, self.connection_ids, self.node_ids = set(parent_ids), set(connection_ids), set(node_ids)
+        elif genotype_id:
             res = self._db.execute(
-                f"""
+                """
             SELECT id, parent_1_id, parent_2_id
             FROM genotype
-            WHERE id = {genotype_id}
+            WHERE id = ?
             ORDER BY id DESC
             LIMIT 1
-            """)
+            """,
+                (genotype_id,),
+            )
             if not res:
                 raise ValueError("Specified genotype_id doesn't exist")
             self.id, *self.parent_ids = res
             self.parent_ids = set((parent for parent in self.parent_ids if parent))
             res = self._db.execute(
-                f"""
+                """
             SELECT connection.id
             FROM connection
-            WHERE connection.genotype_id = {genotype_id}
-            """)
+            WHERE connection.genotype_id = ?
+            """,
+                (genotype_id,),
+            )
             self.connection_ids = set((sub_res[0] for sub_res in res))
             res = self._db.execute(
-                f"""
+                """
             SELECT node_id
             FROM genotype_node_rel
-            WHERE genotype_node_rel.genotype_id = {genotype_id}
-            """)
+            WHERE genotype_node_rel.genotype_id = ?
+            """,
+                (genotype_id,),
+            )
             self.node_ids = set((sub_res[0] for sub_res in res))
+            self._cache()
         else:
+            self._insert(self._db, ((self, node_ids, connection_dicts, parent_genotype_ids),))
+
+    def _cache(self):
+        """ Stores a frozen copy of the loaded genotype, so that later loads do not share its mutable sets """
+        self._db.cache.set(
+            'genotype', self.id,
+            (self.id, frozenset(self.parent_ids), frozenset(self.connection_ids), frozenset(self.node_ids)))
+
+    def _resolve_historical_ids(self, connection_dicts):
+        """
+        Finds, or creates in one batch, the historical connection of every connection dict.
+
+        :return: list of the historical_id of every connection dict, in the same order
+        """
+        node_pairs = []
+        for connection in connection_dicts:
+            in_node_id, out_node_id = connection.get('in_node_id'), connection.get('out_node_id')
+            if connection.get('historical_connection_id'):
+                continue
+            if not (in_node_id and out_node_id):
+                raise ValueError("Every connection must have either a historical_connection_id or in and out_node_id")
+            if in_node_id == out_node_id:
+                raise ValueError("in_node_id and out_node_id must be different nodes")
+            node_pairs.append((int(in_node_id), int(out_node_id)))
+
+        given_ids = set(
+            int(connection['historical_connection_id']) for connection in connection_dicts
+            if connection.get('historical_connection_id'))
+        innovations = self._db.innovations
+        if innovations is not None:
+            if not all(historical_id in innovations for historical_id in given_ids):
+                raise ValueError("No HistoricalConnection exists with that id")
+            historical_ids = iter(innovations.get_historical_ids(node_pairs))
+            return [
+                int(connection['historical_connection_id']) if connection.get('historical_connection_id') else
+                next(historical_ids)
+                for connection in connection_dicts
+            ]
+
+        if given_ids:
             res = self._db.execute(
-                """
-            SELECT MAX(id)
-            FROM genotype
-            LIMIT 1
-            """)
-            self.id = (res[0] or 0) + 1
-            self.parent_ids = set((parent for parent in parent_genotype_ids if parent))
-            parent_genotype_ids = list(sorted(self.parent_ids)) + ['NULL', 'NULL']
-            self._db.execute(
                 f"""
-            INSERT INTO genotype (id, parent_1_id, parent_2_id)
-                VALUES ({self.id}, {parent_genotype_ids[0]}, {parent_genotype_ids[1]})
-            """)
+            SELECT id
+            FROM connection_historical
+            WHERE id IN ({placeholders(given_ids)})
+            """,
+                tuple(given_ids),
+            )
+            if len(res) != len(given_ids):
+                raise ValueError("No HistoricalConnection exists with that id")
 
-            node_ids |= set(
-                row[0] for row in self._db.execute(
-                    """
-                        SELECT node.id
-                        FROM node
-                        LEFT JOIN node_type AS nt on node.node_type_id = nt.id
-                        WHERE nt.name = 'Bias'
-                    """
+        historical_ids = {}
+        if node_pairs:
+            unique_pairs = set(node_pairs)
+            res = self._db.execute(
+                f"""
+            SELECT MIN(id), in_node_id, out_node_id
+            FROM connection_historical
+            WHERE (in_node_id, out_node_id) IN (VALUES {', '.join(('(?, ?)',) * len(unique_pairs))})
+            GROUP BY in_node_id, out_node_id
+            """,
+                tuple(node_id for pair in unique_pairs for node_id in pair),
+            )
+            historical_ids = {(in_node_id, out_node_id): hist_id for hist_id, in_node_id, out_node_id in res}
+            new_pairs = tuple(dict.fromkeys((pair for pair in node_pairs if pair not in historical_ids)))
+            if new_pairs:
+                first_id = (self._db.execute("""SELECT MAX(id) FROM connection_historical""")[0][0] or 0) + 1
+                new_rows = tuple((first_id + i, in_node_id, out_node_id) for i, (in_node_id, out_node_id) in
+                                 enumerate(new_pairs))
+                self._db.executemany(
+                    """INSERT INTO connection_historical (id, in_node_id, out_node_id) VALUES (?, ?, ?)""",
+                    new_rows,
                 )
+                historical_ids.update(((in_node_id, out_node_id), hist_id) for hist_id, in_node_id, out_node_id in
+                                      new_rows)
+
+        return [
+            int(connection['historical_connection_id']) if connection.get('historical_connection_id') else
+            historical_ids[(int(connection['in_node_id']), int(connection['out_node_id']))]
+            for connection in connection_dicts
+        ]
+
+    @classmethod
+    def create_many(cls, db, genotype_kwargs):
+        """
+        Creates many genotypes with a fixed number of multi-row statements, whatever their count.
+
+        :param core.orm.database.Database db:
+        :param genotype_kwargs: iterable of dicts of the node_ids, connection_dicts and parent_genotype_ids of each
+        :return: list of the created genotypes, in the same order
+        """
+        new_genotypes = []
+        for kwargs in genotype_kwargs:
+            if not (kwargs.get('node_ids') and kwargs.get('connection_dicts')):
+                raise ValueError("Must specify both node_ids and connection_dicts")
+            genotype = cls.__new__(cls)
+            genotype._db = db
+            genotype._connection_genes = None
+            new_genotypes.append(
+                (genotype, kwargs['node_ids'], kwargs['connection_dicts'], kwargs.get('parent_genotype_ids')))
+        with db.transaction():
+            cls._insert(db, new_genotypes)
+        return [genotype for genotype, *_ in new_genotypes]
+
+    @classmethod
+    def load_many(cls, db, genotype_ids):
+        """
+        Loads many genotypes with three queries whatever their count, the cached ones being reused.
+
+        :param core.orm.database.Database db:
+        :param genotype_ids: iterable of existing genotype ids
+        :return: list of the genotypes, in the same order
+        """
+        genotype_ids = tuple(genotype_ids)
+        rows = {genotype_id: db.cache.get('genotype', genotype_id) for genotype_id in set(genotype_ids)}
+        missing_ids = tuple(genotype_id for genotype_id, row in rows.items() if row is None)
+        if missing_ids:
+            loaded = {
+                genotype_id: (genotype_id, {parent for parent in parent_ids if parent}, set(), set())
+                for genotype_id, *parent_ids in db.execute_in(
+                    """SELECT id, parent_1_id, parent_2_id FROM genotype WHERE id IN ({ids})""", missing_ids)
+            }
+            if len(loaded) != len(missing_ids):
+                raise ValueError("Specified genotype_id doesn't exist")
+            for connection_id, genotype_id in db.execute_in(
+                    """SELECT id, genotype_id FROM connection WHERE genotype_id IN ({ids})""", missing_ids):
+                loaded[genotype_id][2].add(connection_id)
+            for node_id, genotype_id in db.execute_in(
+                    """SELECT node_id, genotype_id FROM genotype_node_rel WHERE genotype_id IN ({ids})""", missing_ids):
+                loaded[genotype_id][3].add(node_id)
+            rows.update(loaded)
+
+        genotypes = {}
+        for genotype_id, (_, parent_ids, connection_ids, node_ids) in rows.items():
+            genotype = cls.__new__(cls)
+            genotype._db = db
+            genotype._connection_genes = None
+            genotype.id = genotype_id
+            genotype.parent_ids, genotype.connection_ids, genotype.node_ids = (
+                set(parent_ids), set(connection_ids), set(node_ids))
+            genotype._cache()
+            genotypes[genotype_id] = genotype
+        return [genotypes[genotype_id] for genotype_id in genotype_ids]
+
+    @staticmethod
+    def _insert(db, new_genotypes):
+        """
+        Inserts the rows of new genotypes, their node relations, historical connections and connections in batches.
+
+        :param new_genotypes: sequence of (genotype, node_ids, connection_dicts, parent_genotype_ids) tuples
+        """
+        if not new_genotypes:
+            return
+        first_id = (db.execute("""SELECT MAX(id) FROM genotype LIMIT 1""")[0] or 0) + 1
+        bias_node_ids = set(
+            row[0] for row in db.execute(
+                """
+                    SELECT node.id
+                    FROM node
+                    LEFT JOIN node_type AS nt on node.node_type_id = nt.id
+                    WHERE nt.name = 'Bias'
+                """
             )
-            node_values = ",\n".join((f"({self.id}, {node_id})" for node_id in sorted(node_ids)))
-            self._db.execute(
-                f"""
-            INSERT INTO genotype_node_rel (genotype_id, node_id)
-                VALUES {node_values}
-            """)
+        )
+        genotype_rows, node_rows, all_connection_dicts = [], [], []
+        for i, (genotype, node_ids, connection_dicts, parent_genotype_ids) in enumerate(new_genotypes):
+            genotype.id = first_id + i
+            genotype.parent_ids = set((parent for parent in (parent_genotype_ids or []) if parent))
+            parent_genotype_ids = list(sorted(genotype.parent_ids)) + [None, None]
+            genotype_rows.append((genotype.id, parent_genotype_ids[0], parent_genotype_ids[1]))
+            genotype.node_ids = set(node_ids) | bias_node_ids
+            node_rows.extend((genotype.id, node_id) for node_id in sorted(genotype.node_ids))
+            all_connection_dicts.append(tuple(connection_dicts))
+        db.executemany("""INSERT INTO genotype (id, parent_1_id, parent_2_id) VALUES (?, ?, ?)""", genotype_rows)
+        db.executemany("""INSERT INTO genotype_node_rel (genotype_id, node_id) VALUES (?, ?)""", node_rows)
+
+        historical_ids = iter(new_genotypes[0][0]._resolve_historical_ids(
+            tuple(connection for connection_dicts in all_connection_dicts for connection in connection_dicts)))
+        first_id = (db.execute("""SELECT MAX(id) FROM connection""")[0][0] or 0) + 1
+        connection_rows = []
+        for (genotype, *_), connection_dicts in zip(new_genotypes, all_connection_dicts):
+            connections = {}
+            for connection, historical_id in zip(connection_dicts, historical_ids):
+                is_enabled = connection.get('is_enabled')
+                weight = connection.get('weight')
+                connections[historical_id] = (
+                    bool(is_enabled) if is_enabled is not None else True,
+                    float(weight) if weight is not None else 1.0,
+                )
+            rows = tuple(
+                (first_id + len(connection_rows) + i, historical_id, genotype.id, is_enabled, weight)
+                for i, (historical_id, (is_enabled, weight)) in enumerate(connections.items())
+            )
+            connection_rows.extend(rows)
+            genotype.connection_ids = set((row[0] for row in rows))
+            sorted_historical_ids = sorted(connections)
+            genotype._connection_genes = (
+                np.array(sorted_historical_ids, dtype=np.int64),
+                np.array([connections[historical_id][1] for historical_id in sorted_historical_ids], dtype=float),
+            )
+            genotype._cache()
+        db.executemany(
+            """INSERT INTO connection (id, historical_id, genotype_id, is_enabled, weight) VALUES (?, ?, ?, ?, ?)""",
+            connection_rows,
+        )
+
+    @property
+    def connection_genes(self):
+        """
+        :return: tuple of the sorted innovation numbers of the connections and of their aligned weights, loaded once
+        """
+        if self._connection_genes is None:
             res = self._db.execute(
-                f"""
-            SELECT node_id
-            FROM genotype_node_rel
-            WHERE genotype_node_rel.genotype_id = {self.id}
-            """)
-            self.node_ids = set((row[0] for row in res))
-            self.connection_ids = set()
-            for connection in connection_dicts:
-                connection.update({'genotype_id': self.id})
-                self.connection_ids.add(Connection(self._db, **connection).id)
+                """
+            SELECT historical_id, weight
+            FROM connection
+            WHERE genotype_id = ?
+            ORDER BY historical_id
+            """,
+                (self.id,),
+            )
+            self._connection_genes = (
+                np.array([row[0] for row in res], dtype=np.int64),
+                np.array([row[1] for row in res], dtype=float),
+            )
+        return self._connection_genes
 
     @property
     def historical_connection_ids(self):
-        connection_ids = ', '.join((str(c_id) for c_id in self.connection_ids))
-        res = self._db.execute(
-            f"""
-        SELECT historical_id
-        FROM connection
-        WHERE id IN ({connection_ids})
-        """)
-        return set((row[0] for row in res))
+        return set(self.connection_genes[0].tolist())
 
     def __and__(self, other):
+        """ Similarity to another genotype, 1 minus their compatibility distance, from 0 to 1 for identical genes """
         if not isinstance(other, Genotype):
             raise TypeError(
                 "Cannot use and operator between an instance of 'Genotype' and an instance of another class"
             )
-        diff_nodes = len(other.node_ids ^ self.node_ids)
-        total_nodes = max(len(other.node_ids), len(self.node_ids))
-        diff_connections = len(other.historical_connection_ids ^ self.historical_connection_ids)
-        total_connections = max(len(other.historical_connection_ids), len(self.historical_connection_ids))
-        return (total_nodes + total_connections - diff_nodes - diff_connections) / (total_nodes + total_connections)
+        return max(0., 1. - self.distance(other))
+
+    def distance(self, other, excess_coef=1., disjoint_coef=1., weight_coef=.4):
+        """ NEAT compatibility distance to another genotype, see compatibility_distance """
+        return compatibility_distance(
+            self.connection_genes, other.connection_genes, excess_coef, disjoint_coef, weight_coef)
+
+    @staticmethod
+    def load_genes(db, genotype_ids):
+        """
+        Loads the genes compared by speciation for many genotypes at once, with a single query.
+
+        :return: dict mapping every genotype_id to its connection_genes, as used by compatibility_distance
+        """
+        genotype_ids = tuple(set(genotype_ids))
+        genes = {genotype_id: ([], []) for genotype_id in genotype_ids}
+        if genotype_ids:
+            for genotype_id, historical_id, weight in db.execute_in(
+                    """
+                SELECT genotype_id, historical_id, weight
+                FROM connection
+                WHERE genotype_id IN ({ids})
+                ORDER BY genotype_id, historical_id
+                """,
+                    genotype_ids,
+            ):
+                genes[genotype_id][0].append(historical_id)
+                genes[genotype_id][1].append(weight)
+        return {
+            genotype_id: (np.array(innovations, dtype=np.int64), np.array(weights, dtype=float))
+            for genotype_id, (innovations, weights) in genes.items()
+        }
+
+    def compile(self, activation_func=ActivationTypes.sigmoid, node_activations=None):
+        """
+        Builds the feed-forward network of the enabled connections of this genotype.
+
+        :param activation_func: activation id or function applied to the hidden and output nodes
+        :param dict node_activations: optional mapping of node_id to the activation id or function overriding it
+        :return: a core.phenotype.Phenotype evaluated without any further database access
+        """
+        genome = self.as_genome()
+        node_ids = genome.node_ids | set(genome.in_node_ids.tolist()) | set(genome.out_node_ids.tolist())
+        node_types = dict(
+            self._db.execute(
+                f"""
+        SELECT id, node_type_id
+        FROM node
+        WHERE id IN ({placeholders(node_ids)})
+        """,
+                tuple(node_ids),
+            ))
+        return genome.compile(node_types, activation_func, node_activations)
+
+    def as_genome(self):
+        """
+        :return: the core.genome.Genome holding this genotype in memory
+        """
+        res = self._db.execute(
+            """
+        SELECT connection.historical_id, ch.in_node_id, ch.out_node_id, connection.weight, connection.is_enabled
+        FROM connection
+        INNER JOIN connection_historical AS ch ON connection.historical_id = ch.id
+        WHERE connection.genotype_id = ?
+        """,
+            (self.id,),
+        )
+        return Genome(self.node_ids, *(zip(*res) if res else ((),) * 5))
 
     def as_dict(self):
-        connections = (Connection(self._db, connection_id=connection) for connection in sorted(self.connection_ids))
+        connections = Connection.load_for_genotypes(self._db, (self.id,))[self.id]
         return {
             'db': self._db,
             'genotype_id': self.id,
@@ -125,211 +387,33 @@ class Genotype:
         }
 
     def get_mutated(self):
-        split_rate, weight_rate, add_rate, switch_rate, weight_std = self._db.execute(
-            """
-            SELECT (
-            mutation_split_rate, mutation_weight_rate, mutation_add_rate, mutation_switch_rate, mutation_weight_std
-            )
-            FROM model_metadata
-            ORDER BY id DESC
-            LIMIT 1
-        """)[0]
-        mutant = self.as_dict()
-        bias_node_id = list(
-            sorted(
-                (row[0] for row in self._db.execute(
-                    """
-            SELECT node.id
-            FROM node
-            LEFT JOIN node_type AS nt on node.node_type_id = nt.id
-            WHERE nt.name = 'Bias'
-            LIMIT 1
-            """))))
-        mutant['node_ids'].add(bias_node_id)
-        new_connections = list(mutant.get('connection_dicts', []))
-        add_connection_count = 0
-        in_out_node_mapping = {}
-        for connection in mutant.get('connection_dicts', []):
-            historical_id = connection['connection_id']
-            in_out_node_mapping.setdefault(connection['in_node_id'], []).append(connection['out_node_id'])
-            del connection['connection_id']
-            r = random.random()
-            m_rate = weight_rate
-            if r < m_rate:
-                connection['weight'] += (random.random() - .5) * 2 * weight_std
-                continue
-            m_rate += switch_rate
-            if r < m_rate:
-                connection['is_enabled'] = not connection.get('is_enabled', True)
-                continue
-            m_rate += add_rate
-            if r < m_rate:
-                add_connection_count += 1
-                continue
-            m_rate += split_rate
-            if r < m_rate:
-                new_node_id = Node(self._db, connection_historical_id=historical_id).id
-                if new_node_id in mutant['node_ids']:
-                    continue
-                connection['is_enabled'] = False
-                mutant['node_ids'].add(new_node_id)
-                new_connections.extend(
-                    ({
-                         'in_node_id': connection['in_node'],
-                         'out_node_id': new_node_id,
-                         'weight': 1,
-                         'is_enabled': True,
-                     }, {
-                         'in_node_id': bias_node_id,
-                         'out_node_id': new_node_id,
-                         'weight': 0.,
-                         'is_enabled': True,
-                     }, {
-                         'in_node_id': new_node_id,
-                         'out_node_id': connection['out_node'],
-                         'weight': connection.weight,
-                         'is_enabled': connection.is_enabled,
-                     },
-                    ))
-        query = """
-            SELECT node.id
-            FROM genotype_node_rel
-            INNER JOIN node ON genotype_node_rel.node_id = node.id
-            INNER JOIN node_type AS nt ON node.node_type_id = nt.id
-            WHERE genotype_node_rel.genotype_id = {}
-                AND node_type.name = {}
-                AND node.id IN ({})
         """
-        input_nodes = set(
-            (
-                row[0] for row in self._db.execute(
-                query.format(mutant['genotype_id'], 'Input', ', '.join(mutant['node_ids']))
-            )))
-        hidden_nodes = set(
-            (
-                row[0] for row in self._db.execute(
-                query.format(mutant['genotype_id'], 'Hidden', ', '.join(mutant['node_ids']))
-            )))
-        output_nodes = set(
-            (
-                row[0] for row in self._db.execute(
-                query.format(mutant['genotype_id'], 'Output', ', '.join(mutant['node_ids']))
-            )))
-        escape = False
-        for input_node in input_nodes | hidden_nodes:
-            for output_node in (hidden_nodes if input_node not in hidden_nodes else {}) | output_nodes:
-                if output_node not in in_out_node_mapping.get(input_node, []):
-                    new_connections.append(
-                        {
-                            'in_node_id': input_node,
-                            'out_node_id': output_node,
-                            'weight': (random.random() * 2) - 1,
-                            'is_enabled': True,
-                        })
-                    add_connection_count -= 1
-                    escape = add_connection_count > 0
-                    break
-            if escape:
-                break
-        mutant['connection_dicts'] = tuple(new_connections)
-        del mutant['genotype_id']
-        return mutant
+        Mutates a copy of this genotype in memory with core.reproduction.mutate, following the rates of the model.
 
-    def draw(self, save_path=None):
-
-        # graph header declaration
-        graph_lines = [
-            'digraph {', '    rankdir = "LR"', '    splines = polyline', '    bgcolor = "invis"',
-            '    node [margin = 0 fontcolor = black fontsize = 32 width = 0.5 style = filled fixsized = True '
-            'labelloc = b fontname = calibri]',
-            '    edge [arrowhead = onormal width = 0.1 tailport = e headclip = True tailclip = True penwidth = 0.5]',
-            '',
-        ]
+        :return: the genotype_kwargs of the mutant, this genotype being its parent
+        """
+        genome = self.as_genome()
+        bias_node_id = Node(self._db, NodeTypes.bias).id
+        genome.node_ids.add(bias_node_id)
+        node_types = dict(
+            self._db.execute(
+                f"""
+        SELECT id, node_type_id
+        FROM node
+        WHERE id IN ({placeholders(genome.node_ids)})
+        """,
+                tuple(genome.node_ids),
+            ))
+        mutant = mutate(genome, ModelMetadata.of(self._db), node_types, InnovationRegistry.of(self._db), bias_node_id)
+        return mutant.as_genotype_kwargs((self.id,))
 
-        # Assemble necessary node data
-        node_mapping = {
-            NodeTypes.bias: {},
-            NodeTypes.input: {},
-            NodeTypes.hidden: {},
-            NodeTypes.output: {},
-        }
-        for node_id in sorted(self.node_ids):
-            node_mapping[Node(self._db, node_id=node_id).node_type][node_id] = f"node_{node_id}"
-
-        # Add nodes declaration lines
-        graph_lines += [
-            '    subgraph {',
-            '    rank = same',
-            '    node [shape = square fillcolor = cyan]',
-        ]
-        for node_id, name in node_mapping[NodeTypes.bias].items():
-            graph_lines.append(
-                f'    {name} [label = "{node_id}\\nBias" shape = "diamond"]')
-        for node_id, name in node_mapping[NodeTypes.input].items():
-            graph_lines.append(
-                f'    {name} [label = "{node_id}"]')
-        graph_lines += [
-            '    }',
-            '    subgraph {',
-            '    node [shape = circle fillcolor = blue]',
-        ]
-        for node_id, name in node_mapping[NodeTypes.hidden].items():
-            graph_lines.append(
-                f'    {name} [label = "{node_id}"]')
-
-        graph_lines += [
-            '    }',
-            '    subgraph {',
-            '    rank = same',
-            '    node [shape = square fillcolor = red]',
-        ]
-        for node_id, name in node_mapping[NodeTypes.output].items():
-            graph_lines.append(
-                f'    {name} [label = "{node_id}"]')
-
-        graph_lines.append('    }')
-        # Assemble necessary connection data
-        connection_mapping = {
-            NodeTypes.input: [],
-            NodeTypes.hidden: [],
-            NodeTypes.output: [],
-        }
-        for conn_id in sorted(self.connection_ids):
-            conn = Connection(self._db, connection_id=conn_id)
-            in_node_id = conn.in_node
-            out_node_id = conn.out_node
-            weight = conn.weight
-            weight *= 1 if conn.is_enabled else 0
-            if weight != 0.:
-                is_pos = weight > 0
-                intensity = round(min(255, max(0, ((round(abs(weight) - 1) * 2) ** (1 / 2.1)) * 32) + 128))
-                ramp = '0123456789abcdef'
-                intensity = ramp[intensity // 16] + ramp[intensity % 16]
-                color = f"#{'00' if is_pos else intensity}00{intensity if is_pos else '00'}"
-            else:
-                color = '#888888'
-            in_node = Node(self._db, node_id=in_node_id)
-            out_node = Node(self._db, node_id=out_node_id)
-            if in_node.node_type == NodeTypes.input:
-                node_type = NodeTypes.input
-            elif out_node.node_type == NodeTypes.output:
-                node_type = NodeTypes.output
-            else:
-                node_type = NodeTypes.hidden
-            connection_mapping[node_type].append(
-                f'    node_{in_node_id} -> node_{out_node_id} [color = "{color}"]')
-        # Add separator
-        graph_lines.append('')
-
-        # Add connection declaration lines
-        graph_lines += connection_mapping[NodeTypes.input]
-        graph_lines += connection_mapping[NodeTypes.hidden]
-        graph_lines += connection_mapping[NodeTypes.output]
-
-        "Close graph"
-        graph_lines.append("}")
-        graph_lines.append('')
-        graph = "\n".join(graph_lines)
+    def draw(self, save_path=None):
+        """
+        :param str save_path: optional dot file, or folder receiving genotype_<id>.dot, the graph is written to
+        :return: the DOT text of the genotype, built from a single query
+        """
+        genotype = next(stream_genotype_dicts(self._db, genotype_ids=(self.id,)))
+        graph = DotRenderer('draw').render(genotype)
         if save_path:
             if os.path.isdir(save_path):
                 save_path = os.path.join(save_path, f"genotype_{self.id}")
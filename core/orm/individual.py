@@ -1,13 +1,25 @@
 import random
 from collections import deque
 
+import numpy as np
+
+from core.genome import compatibility_distances
+from core.orm.database import placeholders, transactional
 from core.orm.genotype import Genotype
+from core.orm.metadata import ModelMetadata
 
 
 class Individual:
+    @transactional
     def __init__(
             self, db, individual_id=None, population_id=None, genotype_id=None, genotype_kwargs=None,
-            specie_id=None, score=None):
+            specie_id=None, score=None, speciation=None):
+        """
+
+        :param core.orm.database.Database db:
+        :param Speciation speciation: species of the population, shared by the individuals created for it, built from
+            the population when not given
+        """
         genotype_kwargs = genotype_kwargs or {}
         self._db = db
         score = score or 0
@@ -16,16 +28,19 @@ class Individual:
                 "Must specify an individual_id, or a population_id and either an a genotype_id or a genotype_kwargs"
             )
         if individual_id:
-            res = self._db.execute(
-                f"""
+            res = self._db.cache.get('individual', individual_id) or self._db.execute(
+                """
                 SELECT id, genotype_id, specie_id, score, population_id
                 FROM individual
-                WHERE id = {individual_id}
+                WHERE id = ?
                 ORDER BY id DESC
                 LIMIT 1
-            """)
+            """,
+                (individual_id,),
+            )
             if not res:
                 raise ValueError("Specified individual_id doesn't exist")
+            self._db.cache.set('individual', individual_id, res)
             self.id, self.genotype_id, self.specie_id, self._score, self.population_id = res
 
         else:
@@ -41,64 +56,71 @@ class Individual:
                     f"""
                     SELECT id
                     FROM {table}
-                    WHERE id = {value}
+                    WHERE id = ?
                     ORDER BY id DESC
                     LIMIT 1
-                """)
+                """,
+                    (value,),
+                )
                 if not res:
                     raise ValueError(f"Specified {table}_id doesn't exist")
 
             genotype = Genotype(self._db, genotype_id=genotype_id, **genotype_kwargs)
             genotype_id = genotype_id or genotype.id
 
-            if not specie_id:  # Find specie
-                res = self._db.execute(
-                    f"""
-                SELECT gen.id AS genotype_id,
-                       specie.id AS specie_id
-                FROM specie
-                INNER JOIN individual AS ind ON specie.id = ind.specie_id
-                INNER JOIN genotype AS gen ON ind.genotype_id = gen.id
-                WHERE gen.id != {genotype_id} AND ind.population_id = {population_id}
-                """)
-                if res:
-                    best_specie_id = None
-                    best_result = min(1., max(0., 1. - self.speciation_threshold))
-                    for other_id, other_specie_id in res:
-                        other_genotype = Genotype(self._db, genotype_id=other_id)
-                        genotypes_similarity = genotype & other_genotype
-                        if genotypes_similarity > best_result:
-                            best_specie_id = other_specie_id
-                            best_result = genotypes_similarity
-                        if best_result == 1.:  # Best score so no need to continue
-                            break
-                    specie_id = best_specie_id
             if not specie_id:
-                specie_id = Specie(self._db).id
+                specie_id = (speciation or Speciation(self._db, population_id)).assign(
+                    Genotype.load_genes(self._db, (genotype_id,))[genotype_id])
             self._db.execute(
-                f"""
+                """
             INSERT INTO individual (genotype_id, specie_id, score, population_id)
-                VALUES ({genotype_id}, {specie_id}, {score}, {population_id})
-            """)
-            res = self._db.execute(
-                f"""
-            SELECT id
-            FROM individual
-            WHERE ( genotype_id = {genotype_id}
-                AND specie_id = {specie_id}
-                AND score = {score}
-                AND population_id = {population_id}
-                )
-            ORDER BY id DESC
-            LIMIT 1
-            """)
-
-            self.id = res[0]
+                VALUES (?, ?, ?, ?)
+            """,
+                (genotype_id, specie_id, score, population_id),
+            )
+            self.id = self._db.lastrowid
             self.population_id = population_id
             self._score = score
             self.specie_id = specie_id
             self.genotype_id = genotype_id
 
+    @classmethod
+    def load_many(cls, db, individual_ids):
+        """
+        Loads many individuals with a single query, the cached ones being reused.
+
+        :param core.orm.database.Database db:
+        :param individual_ids: iterable of existing individual ids
+        :return: list of the individuals, in the same order
+        """
+        individual_ids = tuple(individual_ids)
+        rows = {individual_id: db.cache.get('individual', individual_id) for individual_id in set(individual_ids)}
+        missing_ids = tuple(individual_id for individual_id, row in rows.items() if row is None)
+        if missing_ids:
+            loaded = {
+                row[0]: row for row in db.execute_in(
+                    """
+                SELECT id, genotype_id, specie_id, score, population_id
+                FROM individual
+                WHERE id IN ({ids})
+                """,
+                    missing_ids,
+                )
+            }
+            if len(loaded) != len(missing_ids):
+                raise ValueError("Specified individual_id doesn't exist")
+            rows.update(loaded)
+
+        individuals = {}
+        for individual_id, row in rows.items():
+            db.cache.set('individual', individual_id, row)
+            individual = cls.__new__(cls)
+            individual._db = db
+            individual.id, individual.genotype_id, individual.specie_id, individual._score, individual.population_id = (
+                row)
+            individuals[individual_id] = individual
+        return [individuals[individual_id] for individual_id in individual_ids]
+
     def __add__(self, other):
         if not isinstance(other, Individual):
             raise TypeError(
@@ -129,11 +151,13 @@ class Individual:
             FROM connection_historical AS ch
             LEFT JOIN connection AS conn_1 ON ch.id = conn_1.historical_id
             LEFT OUTER JOIN connection AS conn_2 ON ch.id = conn_2.historical_id
-            WHERE ( ch.id IN {tuple(hist_conn_ids)}
-                AND conn_1.genotype_id = {self_genotype.id}
-                AND conn_2.genotype_id = {other_genotype.id}
+            WHERE ( ch.id IN ({placeholders(hist_conn_ids)})
+                AND conn_1.genotype_id = ?
+                AND conn_2.genotype_id = ?
                 )
-        """)
+        """,
+            (*hist_conn_ids, self_genotype.id, other_genotype.id),
+        )
 
         for row in connections_data:
             hist_conn_id, in_node_id, out_node_id, self_weight, self_enabled, other_weight, other_enabled = row
@@ -168,16 +192,7 @@ class Individual:
 
     @property
     def speciation_threshold(self):
-        res = self._db.execute(
-            """
-        SELECT speciation_tresh
-        FROM model_metadata
-        ORDER BY id DESC
-        LIMIT 1
-        """)
-        if not res:
-            raise ValueError("There must be at least one row in model_metadata table to fetch data from")
-        return res[0]
+        return ModelMetadata.of(self._db).speciation_tresh
 
     @property
     def score_raw(self):
@@ -186,57 +201,66 @@ class Individual:
     @property
     def score(self):
         res = self._db.execute(
-            f"""
+            """
             SELECT COUNT(individual.id)
             FROM individual
-            WHERE individual.specie_id = {self.specie_id}
-        """)[0][0]
-        return self._score // res
+            WHERE individual.specie_id = ?
+        """,
+            (self.specie_id,),
+        )[0][0]
+        return self._score / res
 
     @score.setter
-    def score(self, value: int):
-        self._db.execute(f"""UPDATE individual SET score = {value} WHERE id = {self.id}""")
+    def score(self, value: float):
+        self._db.execute("""UPDATE individual SET score = ? WHERE id = ?""", (float(value), self.id))
+        self._db.cache.invalidate('individual', self.id)
         self._score = value
 
 
 class Specie:
+    @transactional
     def __init__(self, db, specie_id=None):
         self._db = db
         if specie_id:
             res = self._db.execute(
-                f"""
+                """
             SELECT id
             FROM specie
-            WHERE id = {specie_id}
+            WHERE id = ?
             ORDER BY id DESC
             LIMIT 1
-            """)
+            """,
+                (specie_id,),
+            )
             if not res:
                 raise ValueError("Specified specie_id doesn't exist")
             self.id = res[0]
         else:
             self._db.execute("""INSERT INTO specie DEFAULT VALUES""")
-            res = self._db.execute("""SELECT MAX(id) FROM specie""")
-            self.id = res[0][0]
+            self.id = self._db.lastrowid
 
     @property
     def best_score(self):
         res = self._db.execute(
-            f"""
+            """
         SELECT MAX(score)
         FROM individual
-        WHERE individual.specie_id = {self.id}
-        """)
+        WHERE individual.specie_id = ?
+        """,
+            (self.id,),
+        )
         return res[0][0] or 0
 
     @property
     def individual_ids(self):
         res = self._db.execute(
-            f"""
+            """
         SELECT id
         FROM individual
-        WHERE individual.specie_id = {self.id}
-        """)
+        WHERE individual.specie_id = ?
+        """,
+            (self.id,),
+        )
         return set((row[0] for row in res))
 
     def get_sorted_individuals(self, desc=True):
@@ -244,19 +268,15 @@ class Specie:
             f"""
             SELECT id, score
             FROM individual
-            WHERE individual.specie_id = {self.id}
+            WHERE individual.specie_id = ?
             ORDER BY score {'DESC' if desc else ''}
-        """)
+        """,
+            (self.id,),
+        )
         return tuple((row[0] for row in res)), tuple((row[1] for row in res))
 
     def get_culled_individuals(self):
-        cull_rate = self._db.execute(
-            """
-            SELECT specie_cull_rate
-            FROM model_metadata
-            ORDER BY id
-            LIMIT 1
-        """)[0]
+        cull_rate = ModelMetadata.of(self._db).specie_cull_rate
         individuals, scores = self.get_sorted_individuals()
         individuals = individuals[:round(len(individuals) * cull_rate)]
         return individuals, scores[:len(individuals)]
@@ -266,42 +286,93 @@ class Specie:
         scores = self.get_culled_individuals()[1]
         return sum(scores) / len(scores)
 
-    def select_individual(self):
+    def select_individual(self, excluded_id=None):
+        """
+        :param int excluded_id: individual not to pick, unless it is the only one left after culling
+        :return: the id of an individual of the culled specie, picked with a probability proportional to its score
+        """
         individuals, scores = self.get_culled_individuals()
-        individuals = deque(individuals)
-        scores = deque(scores)
-        total_score = sum(scores)
-        r = random.random() * total_score
+        if excluded_id in individuals and len(individuals) > 1:
+            index = individuals.index(excluded_id)
+            individuals, scores = individuals[:index] + individuals[index + 1:], scores[:index] + scores[index + 1:]
+        if not any(scores):
+            return random.choice(individuals)
+        r = random.random() * sum(scores)
         current_score = 0
-        while current_score < r and individuals and scores:
-            individual = individuals.popleft()
-            current_score = scores.popleft()
-        return individual
+        for individual, score in zip(individuals, scores):
+            current_score += score
+            if current_score >= r:
+                return individual
+        return individuals[-1]
 
     def create_newborn(self, species_set):
-        species_set = species_set - self.id
-        cloning_rate, interspecie_rate = self._db.execute(
-            """
-            SELECT reproduction_cloning_rate, reproduction_interspecie_rate
-            FROM model_metadata
-        """)
+        """
+        :param set species_set: ids of the species a parent of an interspecie crossover can be picked from
+        :return: the genotype_kwargs of a newborn of the specie, cloned and mutated or crossed over
+        """
+        species_set = set(species_set) - {self.id}
+        metadata = ModelMetadata.of(self._db)
+        cloning_rate, interspecie_rate = metadata.reproduction_cloning_rate, metadata.reproduction_interspecie_rate
 
         if random.random() < cloning_rate:
-            parent = Genotype(self._db, genotype_id=self.select_individual().genotype_id)
-            newborn = parent.get_mutated()
-            newborn.update(
-                {
-                    'parent_genotype_ids': {parent.id, }
-                })
-            return newborn
+            parent = Individual(self._db, individual_id=self.select_individual())
+            return Genotype(self._db, genotype_id=parent.genotype_id).get_mutated()
 
         parent_2_specie = self
-        if random.random() < interspecie_rate:
+        if random.random() < interspecie_rate and species_set:
             parent_2_specie = Specie(self._db, specie_id=species_set.pop())
         parent_1 = self.select_individual()
-        parent_2 = parent_2_specie.select_individual()
-        while parent_2 == parent_1 and len(self.individual_ids) > 2:
-            parent_2 = parent_2_specie.select_individual()
+        parent_2 = parent_2_specie.select_individual(excluded_id=parent_1)
 
         newborn = Individual(self._db, individual_id=parent_1) + Individual(self._db, individual_id=parent_2)
         return newborn['genotype_kwargs']
+
+
+class Speciation:
+    """ Assigns species by comparing genotypes with one in-memory representative per specie of a population """
+
+    def __init__(self, db, population_id):
+        """
+
+        :param core.orm.database.Database db:
+        :param int population_id: population whose first individual of every specie is that specie's representative
+        """
+        self._db = db
+        self._threshold = ModelMetadata.of(self._db).speciation_tresh
+        res = self._db.execute(
+            """
+            SELECT specie_id, genotype_id, MIN(id)
+            FROM individual
+            WHERE population_id = ?
+            GROUP BY specie_id
+            ORDER BY MIN(id)
+        """,
+            (population_id,),
+        )
+        genes = Genotype.load_genes(self._db, (row[1] for row in res))
+        self.representatives = {specie_id: genes[genotype_id] for specie_id, genotype_id, _ in res}
+
+    def add(self, specie_id, genes):
+        """ Makes the genes the representative of the specie, unless it already has one """
+        self.representatives.setdefault(specie_id, genes)
+
+    def find(self, genes):
+        """
+        :return: the specie_id of the representative closest to the genes, or None when none is within the speciation
+            threshold of the model
+        """
+        if not self.representatives:
+            return None
+        distances = compatibility_distances(genes, list(self.representatives.values()))
+        closest = int(np.argmin(distances))  # The first of the closest, as representatives are in specie order
+        return list(self.representatives)[closest] if distances[closest] < self._threshold else None
+
+    def assign(self, genes):
+        """
+        :return: the specie_id found for the genes, creating a specie they represent when none is similar enough
+        """
+        specie_id = self.find(genes)
+        if not specie_id:
+            specie_id = Specie(self._db).id
+            self.add(specie_id, genes)
+        return specie_id
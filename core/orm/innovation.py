@@ -0,0 +1,93 @@
+from core.orm.enums import NodeTypes
+
+
+class InnovationRegistry:
+    """ In-memory mirror of the connection_historical table and of the split nodes of the node table """
+
+    def __init__(self, db):
+        """
+
+        :param core.orm.database.Database db:
+        """
+        self._db = db
+        self._historical_ids = {}
+        self._node_pairs = {}
+        self._split_node_ids = {}
+        self._next_id = 1  # id of the next innovation, one past the largest known
+        self.load()
+        self._db.on_rollback(self.load)
+
+    @classmethod
+    def of(cls, db):
+        """
+        :return: the registry shared by the elements of the database, attached to it on first use
+        """
+        if db.innovations is None:
+            db.innovations = cls(db)
+        return db.innovations
+
+    def load(self):
+        """ Warms the registry from the database, dropping every innovation a rollback may have undone """
+        self._historical_ids.clear()
+        self._node_pairs.clear()
+        self._split_node_ids.clear()
+        for historical_id, in_node_id, out_node_id in self._db.execute(
+                """SELECT id, in_node_id, out_node_id FROM connection_historical ORDER BY id"""):
+            self._historical_ids.setdefault((in_node_id, out_node_id), historical_id)
+            self._node_pairs[historical_id] = (in_node_id, out_node_id)
+        self._next_id = max(self._node_pairs, default=0) + 1
+        self._split_node_ids.update(
+            (historical_id, node_id) for historical_id, node_id in self._db.execute(
+                """SELECT connection_historical_id, id FROM node WHERE connection_historical_id IS NOT NULL"""))
+
+    def __contains__(self, historical_id):
+        return historical_id in self._node_pairs
+
+    def get_node_pair(self, historical_id):
+        """
+        :return: tuple of the in_node_id and out_node_id of the historical connection
+        """
+        try:
+            return self._node_pairs[historical_id]
+        except KeyError:
+            raise ValueError("No HistoricalConnection exists with that id") from None
+
+    def get_historical_id(self, in_node_id, out_node_id):
+        return self.get_historical_ids(((in_node_id, out_node_id),))[0]
+
+    def get_historical_ids(self, node_pairs):
+        """
+        Finds the innovation number of every node pair, writing the unknown ones in a single batch.
+
+        :param node_pairs: iterable of (in_node_id, out_node_id) tuples
+        :return: list of the historical_id of every node pair, in the same order
+        """
+        node_pairs = tuple((int(in_node_id), int(out_node_id)) for in_node_id, out_node_id in node_pairs)
+        if any(in_node_id == out_node_id for in_node_id, out_node_id in node_pairs):
+            raise ValueError("in_node_id and out_node_id must be different nodes")
+        new_pairs = tuple(dict.fromkeys(pair for pair in node_pairs if pair not in self._historical_ids))
+        if new_pairs:
+            new_rows = tuple((self._next_id + i, in_node_id, out_node_id) for i, (in_node_id, out_node_id) in
+                             enumerate(new_pairs))
+            self._db.executemany(
+                """INSERT INTO connection_historical (id, in_node_id, out_node_id) VALUES (?, ?, ?)""",
+                new_rows,
+            )
+            for historical_id, in_node_id, out_node_id in new_rows:
+                self._historical_ids[(in_node_id, out_node_id)] = historical_id
+                self._node_pairs[historical_id] = (in_node_id, out_node_id)
+            self._next_id += len(new_rows)
+        return [self._historical_ids[pair] for pair in node_pairs]
+
+    def get_split_node_id(self, historical_id):
+        """
+        :return: id of the hidden node splitting the historical connection, created the first time it is split
+        """
+        if historical_id not in self._split_node_ids:
+            self.get_node_pair(historical_id)
+            self._db.execute(
+                """INSERT INTO node (node_type_id, connection_historical_id) VALUES (?, ?)""",
+                (NodeTypes.hidden, historical_id),
+            )
+            self._split_node_ids[historical_id] = self._db.lastrowid
+        return self._split_node_ids[historical_id]
@@ -0,0 +1,35 @@
+from typing import NamedTuple
+
+
+class ModelMetadata(NamedTuple):
+    """ Immutable hyperparameters of a model, as stored in one row of the model_metadata table """
+    id: int
+    speciation_tresh: float
+    specie_cull_rate: float
+    reproduction_cloning_rate: float
+    reproduction_interspecie_rate: float
+    population_size: int
+    mutation_split_rate: float
+    mutation_weight_rate: float
+    mutation_switch_rate: float
+    mutation_add_rate: float
+    mutation_rate: float
+    mutation_weight_std: float
+
+    @classmethod
+    def load(cls, db):
+        """
+        :param core.orm.database.Database db:
+        :return: the latest row of the model_metadata table, its id being the version of the hyperparameters
+        """
+        res = db.execute(f"""SELECT {', '.join(cls._fields)} FROM model_metadata ORDER BY id DESC LIMIT 1""")
+        if not res:
+            raise ValueError("There must be at least one row in model_metadata table to fetch data from")
+        return cls(*res)
+
+    @classmethod
+    def of(cls, db):
+        """
+        :return: the metadata loaded once by the model sharing the database, or the latest row when there is none
+        """
+        return db.metadata if db.metadata is not None else cls.load(db)
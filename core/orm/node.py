@@ -1,33 +1,46 @@
-from core.activation import sigmoid
+from core.activation import ActivationTypes, get_activation
+from core.orm.database import transactional
 from core.orm.enums import NodeTypes
 
 
 class Node:
-    def __init__(self, db, node_type=None, connection_historical_id=None, node_id=None, activation_func=sigmoid):
+    @transactional
+    def __init__(self, db, node_type=None, connection_historical_id=None, node_id=None,
+                 activation_func=ActivationTypes.sigmoid):
         self._db = db
         self.input_sum = 0
-        self._activation_func = activation_func
+        self._activation_func = get_activation(activation_func)
 
         if isinstance(node_type, str):
             node_type = getattr(NodeTypes, node_type.lower())
 
         if node_id:
-            res = self._db.execute(
-                f"""
-            SELECT id, node_type_id, connection_historical_id  FROM node WHERE id = {node_id} LIMIT 1
-            """)
+            res = self._db.cache.get('node', node_id) or self._db.execute(
+                """
+            SELECT id, node_type_id, connection_historical_id  FROM node WHERE id = ? LIMIT 1
+            """,
+                (node_id,),
+            )
             if not res:
                 raise ValueError('No node exists with that id')
+            self._db.cache.set('node', node_id, res)
             self.id, self.node_type, self.connection_historical = res
         else:
             if not connection_historical_id and not node_type:
                 raise ValueError('A node must have a connection_historical_id or a node_type specified')
 
+            if connection_historical_id and self._db.innovations is not None:
+                self.id = self._db.innovations.get_split_node_id(connection_historical_id)
+                self.node_type = NodeTypes.hidden
+                self.connection_historical = connection_historical_id
+                return
             if connection_historical_id:
                 res = self._db.execute(
-                    f"""
-                    SELECT id FROM connection_historical WHERE id = {connection_historical_id}
-                """)
+                    """
+                    SELECT id FROM connection_historical WHERE id = ?
+                """,
+                    (connection_historical_id,),
+                )
                 if not res:
                     raise ValueError('The given connection_historical_id does not exists')
             if node_type == NodeTypes.bias:
@@ -44,21 +57,13 @@ class Node:
             else:
                 node_type = node_type or NodeTypes.hidden
                 self._db.execute(
-                    f"""
+                    """
                     INSERT INTO node (node_type_id, connection_historical_id)
-                        VALUES ({node_type}, {connection_historical_id or "NULL"})
-                """)
-                res = self._db.execute(
-                    f"""
-                    SELECT id
-                    FROM node
-                    WHERE node_type_id = {node_type} AND connection_historical_id = {connection_historical_id or "NULL"}
-                    ORDER BY id DESC
-                    LIMIT 1
-                """)
-                if not res:
-                    raise ValueError('Incorrect node_type or connection_historical_id given')
-                self.id = res[0]
+                        VALUES (?, ?)
+                """,
+                    (node_type, connection_historical_id or None),
+                )
+                self.id = self._db.lastrowid
                 self.node_type = node_type
                 self.connection_historical = connection_historical_id
 
@@ -1,33 +1,52 @@
+import numpy as np
+
+from core.activation import ActivationTypes
+from core.genome import Genome, distance_matrix
+from core.orm.database import transactional
 from core.orm.generation import Generation
-from core.orm.individual import Individual
+from core.orm.genotype import Genotype
+from core.orm.individual import Individual, Speciation
+from core.orm.metadata import ModelMetadata
 
 
 class Population:
-    def __init__(self, db, population_id=None, generation_id=None, individual_dicts=None):
+    @transactional
+    def __init__(self, db, population_id=None, generation_id=None, individual_dicts=None, parent_population_id=None):
+        """
+
+        :param core.orm.database.Database db:
+        :param int parent_population_id: population whose species representatives are used to speciate the newborns
+        """
         self._db = db
         self.individual_ids = set()
+        self._speciation = None
+        self._parent_population_id = parent_population_id
         if not population_id and not (generation_id and individual_dicts):
             raise ValueError("Must specify either a population_id or a generation_id, and individual_dicts")
         if population_id:
             res = self._db.execute(
-                f"""
+                """
             SELECT id, generation_id
             FROM population
-            WHERE id = {population_id}
+            WHERE id = ?
             ORDER BY id DESC
             LIMIT 1
-            """)
+            """,
+                (population_id,),
+            )
             if not res:
                 raise ValueError("Specified population_id doesn't exist")
 
-            self.id, self.generation_id = res[0]
+            self.id, self.generation_id = res
             res = self._db.execute(
-                f"""
+                """
             SELECT id
             FROM individual
-            WHERE population_id = {self.id}
-            """)
-            self.individual_ids = set((row[0] for row in res))
+            WHERE population_id = ?
+            """,
+                (self.id,),
+            )
+            self.individual_ids = {row[0] for row in res}
             if len(self) != self.model_pop_size:
                 raise SystemError("Size inconsistency between loaded individual_ids size and model metadata")
 
@@ -36,50 +55,230 @@ class Population:
             pop_size = self.model_pop_size  # Only need to fetch it once
             if pop_size != len(individual_dicts):
                 raise SystemError("Size inconsistency between loaded individual_dicts size and model metadata")
-            self._db.execute(f"""INSERT INTO population (generation_id) VALUES ({generation_id})""")
-            res = self._db.execute(
-                f"""
-            SELECT id from population WHERE generation_id={generation_id} ORDER BY id DESC LIMIT 1
-            """)
-            self.id = res[0]
+            self._db.execute("""INSERT INTO population (generation_id) VALUES (?)""", (generation_id,))
+            self.id = self._db.lastrowid
             self.generation_id = generation_id
-            for individual_dict in individual_dicts:
-                individual_dict["population_id"] = self.id
-                self.individual_ids.add(Individual(self._db, **individual_dict).id)
+            self.individual_ids = self._create_individuals(individual_dicts)
 
     def __len__(self):
         return len(self.individual_ids)
 
+    def individuals(self):
+        """
+        :return: list of the core.orm.individual.Individual of the population sorted by id, loaded with one query
+        """
+        return Individual.load_many(self._db, sorted(self.individual_ids))
+
+    def genotypes(self):
+        """
+        :return: dict mapping every genotype_id of the population to its Genotype, loaded with four queries
+        """
+        genotype_ids = sorted({individual.genotype_id for individual in self.individuals()})
+        return dict(zip(genotype_ids, Genotype.load_many(self._db, genotype_ids)))
+
+    def _create_individuals(self, individual_dicts):
+        """
+        Inserts all the individuals of the population, and the genotypes of the newborns, with batched statements.
+
+        :return: set of the created individual ids
+        """
+        individual_dicts = tuple(
+            dict(individual_dict, population_id=self.id) for individual_dict in individual_dicts)
+        for table in ('genotype', 'specie'):
+            element_ids = {
+                individual_dict[f'{table}_id'] for individual_dict in individual_dicts
+                if individual_dict.get(f'{table}_id')}
+            if element_ids and len(element_ids) != len(
+                    self._db.execute_in(f"""SELECT id FROM {table} WHERE id IN ({{ids}})""", element_ids)):
+                raise ValueError(f"Specified {table}_id doesn't exist")
+
+        newborns = [individual_dict for individual_dict in individual_dicts if not individual_dict.get('genotype_id')]
+        if not all(newborn.get('genotype_kwargs') for newborn in newborns):
+            raise ValueError("Every individual must have either a genotype_id or genotype_kwargs")
+        genotypes = Genotype.create_many(self._db, (newborn['genotype_kwargs'] for newborn in newborns))
+        for newborn, genotype in zip(newborns, genotypes):
+            newborn['genotype_id'] = genotype.id
+        self.speciate(individual_dicts, self.speciation)
+
+        first_id = (self._db.execute("""SELECT MAX(id) FROM individual""")[0][0] or 0) + 1
+        rows = tuple(
+            (first_id + i, individual_dict['genotype_id'], individual_dict['specie_id'],
+             individual_dict.get('score') or 0, self.id)
+            for i, individual_dict in enumerate(individual_dicts)
+        )
+        self._db.executemany(
+            """INSERT INTO individual (id, genotype_id, specie_id, score, population_id) VALUES (?, ?, ?, ?, ?)""",
+            rows,
+        )
+        return {row[0] for row in rows}
+
     @property
-    def model_pop_size(self):
+    def speciation(self):
+        """ core.orm.individual.Speciation of the population, built once and shared by every individual created """
+        if self._speciation is None:
+            self._speciation = Speciation(self._db, self._parent_population_id or self.id)
+        return self._speciation
+
+    def speciate(self, individual_dicts, speciation=None):
+        """
+        Sets the specie_id of every newborn in one pass, comparing each with one representative per specie only.
+        Newborns whose specie_id is already given become the representative of their specie if it has none.
+
+        :param individual_dicts: dicts of the newborns, each with the genotype_id of an existing genotype
+        :param core.orm.individual.Speciation speciation: defaults to the speciation of the population
+        """
+        speciation = speciation or self.speciation
+        genes = Genotype.load_genes(self._db, (individual_dict['genotype_id'] for individual_dict in individual_dicts))
+        for individual_dict in individual_dicts:
+            if individual_dict.get('specie_id'):
+                speciation.add(individual_dict['specie_id'], genes[individual_dict['genotype_id']])
+        for individual_dict in individual_dicts:
+            if not individual_dict.get('specie_id'):
+                individual_dict['specie_id'] = speciation.assign(genes[individual_dict['genotype_id']])
+
+    def compile(self, activation_func=ActivationTypes.sigmoid):
+        """
+        :return: dict mapping every individual_id of the population to its compiled core.phenotype.Phenotype
+        """
+        individuals, genomes, node_types = self.genomes()
+        return {
+            individual_id: genomes[genotype_id].compile(node_types, activation_func)
+            for individual_id, (genotype_id, _) in individuals.items()
+        }
+
+    def evaluate(self, batch_inputs, fitness_fn, activation_func=ActivationTypes.sigmoid):
+        """
+        Runs every individual over the whole batch at once and stores the resulting scores.
+
+        :param batch_inputs: array-like of shape (n_samples, n_inputs)
+        :param fitness_fn: callable mapping the (n_samples, n_outputs) outputs of one individual to its score
+        :return: dict mapping every individual_id to its score
+        """
+        batch_inputs = np.asarray(batch_inputs, dtype=float)
+        scores = {
+            individual_id: fitness_fn(phenotype.forward(batch_inputs))
+            for individual_id, phenotype in self.compile(activation_func).items()
+        }
+        self.set_scores(scores)
+        return scores
+
+    def genomes(self):
+        """
+        Loads every genotype of the population in memory with three queries.
+
+        :return: tuple of a dict mapping every individual_id to its genotype_id and specie_id, a dict mapping every
+            genotype_id to its core.genome.Genome and a dict mapping every node_id used to its node_type_id
+        """
+        individuals = {
+            individual_id: (genotype_id, specie_id) for individual_id, genotype_id, specie_id in self._db.execute(
+                """
+            SELECT id, genotype_id, specie_id
+            FROM individual
+            WHERE population_id = ?
+            ORDER BY id
+            """,
+                (self.id,),
+            )
+        }
+        node_ids = {genotype_id: set() for genotype_id, _ in individuals.values()}
+        genes = {genotype_id: [] for genotype_id in node_ids}
+        node_types = {}
+        for genotype_id, node_id, node_type in self._db.execute(
+                """
+            SELECT DISTINCT rel.genotype_id, rel.node_id, node.node_type_id
+            FROM individual AS ind
+            INNER JOIN genotype_node_rel AS rel ON rel.genotype_id = ind.genotype_id
+            INNER JOIN node ON node.id = rel.node_id
+            WHERE ind.population_id = ?
+            """,
+                (self.id,),
+        ):
+            node_ids[genotype_id].add(node_id)
+            node_types[node_id] = node_type
+        for genotype_id, *gene in self._db.execute(
+                """
+            SELECT DISTINCT conn.genotype_id, conn.historical_id, ch.in_node_id, ch.out_node_id, conn.weight,
+                conn.is_enabled
+            FROM individual AS ind
+            INNER JOIN connection AS conn ON conn.genotype_id = ind.genotype_id
+            INNER JOIN connection_historical AS ch ON ch.id = conn.historical_id
+            WHERE ind.population_id = ?
+            """,
+                (self.id,),
+        ):
+            genes[genotype_id].append(gene)
+        genomes = {
+            genotype_id: Genome(node_ids[genotype_id], *(zip(*genes[genotype_id]) if genes[genotype_id] else ((),) * 5))
+            for genotype_id in node_ids
+        }
+        return individuals, genomes, node_types
+
+    def distance_matrix(self, excess_coef=1., disjoint_coef=1., weight_coef=.4):
+        """
+        Computes the compatibility distance between every pair of individuals with a single query.
+
+        :return: tuple of the sorted individual_ids and of the matching (n_individuals, n_individuals) distance array
+        """
         res = self._db.execute(
             """
-        SELECT population_size
-        FROM model_metadata
-        ORDER BY id DESC
-        LIMIT 1
-        """)
-        if not res:
-            raise ValueError("There must be at least one row in model_metadata table to fetch data from")
-        return res[0]
+        SELECT ind.id, conn.historical_id, conn.weight
+        FROM individual AS ind
+        LEFT JOIN connection AS conn ON conn.genotype_id = ind.genotype_id
+        WHERE ind.population_id = ?
+        ORDER BY ind.id, conn.historical_id
+        """,
+            (self.id,),
+        )
+        genes = {}
+        for individual_id, historical_id, weight in res:
+            innovations, weights = genes.setdefault(individual_id, ([], []))
+            if historical_id is not None:
+                innovations.append(historical_id)
+                weights.append(weight)
+        individual_ids = tuple(genes)
+        connection_genes = [
+            (np.array(innovations, dtype=np.int64), np.array(weights, dtype=float))
+            for innovations, weights in genes.values()
+        ]
+        return individual_ids, distance_matrix(connection_genes, excess_coef, disjoint_coef, weight_coef)
+
+    def set_scores(self, scores):
+        """
+        Writes the scores of many individuals with a single bulk update.
+
+        :param dict scores: mapping of individual_id to score
+        """
+        self._db.executemany(
+            """UPDATE individual SET score = ? WHERE id = ?""",
+            ((float(score), individual_id) for individual_id, score in scores.items()),
+        )
+        self._db.cache.invalidate('individual', *scores)
+
+    @property
+    def model_pop_size(self):
+        return ModelMetadata.of(self._db).population_size
 
     @property
     def species(self):
         res = self._db.execute(
-            f"""
+            """
         SELECT specie.id
         FROM specie
         INNER JOIN individual AS ind on specie.id = ind.specie_id
-        WHERE ind.population_id = {self.id}
-        """)
-        return set((row[0] for row in res))
+        WHERE ind.population_id = ?
+        """,
+            (self.id,),
+        )
+        return {row[0] for row in res}
 
     @property
     def best_score(self):
         res = self._db.execute(
-            f"""
+            """
         SELECT MAX(score)
         FROM individual
-        WHERE individual.population_id = {self.id}
-        """)
+        WHERE individual.population_id = ?
+        """,
+            (self.id,),
+        )
         return res[0][0] or 0
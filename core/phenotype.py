@@ -0,0 +1,130 @@
+import numpy as np
+
+from core.activation import ActivationTypes, get_activation
+from core.orm.enums import NodeTypes
+
+
+class Phenotype:
+    """ Flat, array-backed feed-forward network compiled from a genotype """
+
+    def __init__(self, node_types, connections, activation_func=ActivationTypes.sigmoid, node_activations=None):
+        """
+
+        :param dict node_types: mapping of every node_id of the network to its node_type_id
+        :param connections: iterable of (in_node_id, out_node_id, weight) tuples of the enabled connections
+        :param activation_func: activation id or function applied to the hidden and output nodes
+        :param dict node_activations: optional mapping of node_id to the activation id or function overriding it
+        """
+        activation_func = get_activation(activation_func)
+        node_activations = {
+            node_id: get_activation(activation) for node_id, activation in (node_activations or {}).items()
+        }
+        activation_order = {activation_func: 0}
+        for activation in node_activations.values():
+            activation_order.setdefault(activation, len(activation_order))
+        connections = tuple(connections)
+        for in_node_id, out_node_id, _ in connections:
+            if in_node_id not in node_types or out_node_id not in node_types:
+                raise ValueError(f"Connection {in_node_id} -> {out_node_id} uses a node without a known node_type")
+            if node_types[out_node_id] in (NodeTypes.bias, NodeTypes.input):
+                raise ValueError(f"Connection {in_node_id} -> {out_node_id} targets a bias or input node")
+
+        bias_ids = sorted(node_id for node_id, node_type in node_types.items() if node_type == NodeTypes.bias)
+        input_ids = sorted(node_id for node_id, node_type in node_types.items() if node_type == NodeTypes.input)
+        layers = self._sort_layers(node_types, connections, set(bias_ids) | set(input_ids))
+        # nodes sharing an activation are made contiguous so that it is applied once per layer slice
+        layers = [
+            sorted(
+                layer,
+                key=lambda node_id: (activation_order[node_activations.get(node_id, activation_func)], node_id))
+            for layer in layers
+        ]
+
+        self.node_ids = tuple(bias_ids + input_ids + [node_id for layer in layers for node_id in layer])
+        self.input_node_ids = tuple(input_ids)
+        self.output_node_ids = tuple(
+            sorted(node_id for node_id, node_type in node_types.items() if node_type == NodeTypes.output))
+        position = {node_id: index for index, node_id in enumerate(self.node_ids)}
+        self._bias_idx = np.arange(len(bias_ids), dtype=np.intp)
+        self._input_idx = np.arange(len(bias_ids), len(bias_ids) + len(input_ids), dtype=np.intp)
+        self._output_idx = np.array([position[node_id] for node_id in self.output_node_ids], dtype=np.intp)
+
+        incoming = {}
+        for in_node_id, out_node_id, weight in connections:
+            incoming.setdefault(out_node_id, []).append((position[in_node_id], weight))
+
+        self._layers = []
+        start = len(bias_ids) + len(input_ids)
+        for layer in layers:
+            stop = start + len(layer)
+            src_idx = sorted({src for node_id in layer for src, _ in incoming.get(node_id, ())})
+            src_position = {src: index for index, src in enumerate(src_idx)}
+            block = np.zeros((len(src_idx), len(layer)))
+            for column, node_id in enumerate(layer):
+                for src, weight in incoming.get(node_id, ()):
+                    block[src_position[src], column] += weight
+            segments = []
+            for column, node_id in enumerate(layer):
+                activation = node_activations.get(node_id, activation_func)
+                if segments and segments[-1][2] is activation:
+                    segments[-1][1] = start + column + 1
+                else:
+                    segments.append([start + column, start + column + 1, activation])
+            self._layers.append((np.array(src_idx, dtype=np.intp), block, start, tuple(map(tuple, segments))))
+            start = stop
+
+    @staticmethod
+    def _sort_layers(node_types, connections, source_ids):
+        """ Groups the non input nodes by depth using Kahn's algorithm, raising on recurrent connections """
+        successors = {}
+        in_degree = {node_id: 0 for node_id in node_types if node_id not in source_ids}
+        for in_node_id, out_node_id, _ in connections:
+            successors.setdefault(in_node_id, []).append(out_node_id)
+            if in_node_id not in source_ids:
+                in_degree[out_node_id] += 1
+
+        layers = []
+        current = sorted(node_id for node_id, degree in in_degree.items() if not degree)
+        while current:
+            layers.append(current)
+            following = set()
+            for node_id in current:
+                for out_node_id in successors.get(node_id, ()):
+                    in_degree[out_node_id] -= 1
+                    if not in_degree[out_node_id]:
+                        following.add(out_node_id)
+            current = sorted(following)
+
+        if sum(len(layer) for layer in layers) != len(in_degree):
+            raise ValueError("Cannot compile a genotype whose enabled connections contain a cycle")
+        return layers
+
+    @property
+    def n_inputs(self):
+        return len(self._input_idx)
+
+    @property
+    def n_outputs(self):
+        return len(self._output_idx)
+
+    def forward(self, inputs):
+        """
+        Evaluates the network, without any database access.
+
+        :param inputs: array-like of shape (n_inputs,) or (n_samples, n_inputs), ordered like input_node_ids
+        :return: numpy array of shape (n_outputs,) or (n_samples, n_outputs), ordered like output_node_ids
+        """
+        inputs = np.asarray(inputs, dtype=float)
+        if inputs.shape[-1:] != (self.n_inputs,):
+            raise ValueError(f"Expected {self.n_inputs} inputs per sample, got an array of shape {inputs.shape}")
+        values = np.empty(inputs.shape[:-1] + (len(self.node_ids),))
+        values[..., self._bias_idx] = 1.
+        values[..., self._input_idx] = inputs
+        for src_idx, block, start, segments in self._layers:
+            weighted_sums = values[..., src_idx] @ block
+            for segment_start, segment_stop, activation in segments:
+                activation(
+                    weighted_sums[..., segment_start - start:segment_stop - start],
+                    out=values[..., segment_start:segment_stop],
+                )
+        return values[..., self._output_idx]
@@ -0,0 +1,154 @@
+"""
+In-memory reproduction of core.genome.Genome objects between two persisted generations.
+"""
+
+import random
+
+import numpy as np
+
+from core.orm.enums import NodeTypes
+
+
+def offspring_quotas(specie_scores, pop_size):
+    """
+    Shares the next population between the species in proportion to their mean score, i.e. their summed adjusted
+    fitness, with the largest remainders rounding up.
+
+    :param dict specie_scores: mapping of every specie_id to the scores of its individuals
+    :param int pop_size: size of the next population
+    :return: dict mapping every specie_id to its number of offspring, summing to pop_size
+    """
+    weights = {specie_id: sum(scores) / len(scores) for specie_id, scores in specie_scores.items()}
+    if min(weights.values()) < 0:
+        lowest = min(weights.values())
+        weights = {specie_id: weight - lowest for specie_id, weight in weights.items()}
+    if not sum(weights.values()):
+        weights = {specie_id: len(scores) for specie_id, scores in specie_scores.items()}
+    total = sum(weights.values())
+    shares = {specie_id: pop_size * weight / total for specie_id, weight in weights.items()}
+    quotas = {specie_id: int(share) for specie_id, share in shares.items()}
+    remainders = sorted(shares, key=lambda specie_id: (quotas[specie_id] - shares[specie_id], specie_id))
+    for specie_id in remainders[:pop_size - sum(quotas.values())]:
+        quotas[specie_id] += 1
+    return quotas
+
+
+def select(parents, scores):
+    """ Picks one of the parents with a probability proportional to its score, uniformly when all scores are 0 """
+    low = min(scores)
+    weights = [score - low for score in scores] if low < 0 else list(scores)
+    if not sum(weights):
+        return random.choice(parents)
+    return random.choices(parents, weights=weights)[0]
+
+
+def creates_cycle(connections, in_node_id, out_node_id):
+    """ Whether adding the in_node_id -> out_node_id connection would close a cycle through the given connections """
+    successors = {}
+    for connection_in, connection_out in connections:
+        successors.setdefault(connection_in, []).append(connection_out)
+    stack, visited = [out_node_id], set()
+    while stack:
+        node_id = stack.pop()
+        if node_id == in_node_id:
+            return True
+        if node_id not in visited:
+            visited.add(node_id)
+            stack.extend(successors.get(node_id, ()))
+    return False
+
+
+def crossover(genome, other_genome, score, other_score):
+    """
+    Matching genes come from either parent at random, disjoint and excess genes from the fitter parent, or from both
+    when they are as fit, skipping those that would make the network recurrent.
+
+    :return: the child genome
+    """
+    if other_score > score:
+        genome, other_genome = other_genome, genome
+    child = genome.copy()
+    _, index, other_index = np.intersect1d(
+        genome.innovations, other_genome.innovations, assume_unique=True, return_indices=True)
+    from_other = np.array([random.random() < .5 for _ in index], dtype=bool)
+    child.weights[index[from_other]] = other_genome.weights[other_index[from_other]]
+    child.enabled[index[from_other]] = other_genome.enabled[other_index[from_other]]
+    if score == other_score:
+        pairs = child.pairs
+        added = []
+        for gene in np.flatnonzero(~np.isin(other_genome.innovations, genome.innovations)):
+            pair = (int(other_genome.in_node_ids[gene]), int(other_genome.out_node_ids[gene]))
+            if random.random() < .5 and not creates_cycle(pairs, *pair):
+                pairs.append(pair)
+                added.append(gene)
+                child.node_ids.update(pair)
+        child.add_connections(
+            other_genome.innovations[added], other_genome.in_node_ids[added], other_genome.out_node_ids[added],
+            other_genome.weights[added], other_genome.enabled[added])
+    return child
+
+
+def mutate(genome, metadata, node_types, innovations, bias_node_id):
+    """
+    Rolls one mutation per connection, following the rates of the model: weight perturbation, switching, adding a
+    new connection or splitting the connection with a hidden node.
+
+    :param core.genome.Genome genome: genome mutated in place
+    :param core.orm.metadata.ModelMetadata metadata: rates of the model
+    :param dict node_types: mapping of node_id to node_type_id, completed with the split nodes
+    :param core.orm.innovation.InnovationRegistry innovations: registry giving the innovation numbers of the new
+        connections and the node splitting a connection
+    :param int bias_node_id:
+    :return: the mutated genome
+    """
+    new_connections = {}
+    add_connection_count = 0
+    for gene in range(len(genome)):
+        r = random.random()
+        m_rate = metadata.mutation_weight_rate
+        if r < m_rate:
+            genome.weights[gene] += (random.random() - .5) * 2 * metadata.mutation_weight_std
+            continue
+        m_rate += metadata.mutation_switch_rate
+        if r < m_rate:
+            genome.enabled[gene] = not genome.enabled[gene]
+            continue
+        m_rate += metadata.mutation_add_rate
+        if r < m_rate:
+            add_connection_count += 1
+            continue
+        m_rate += metadata.mutation_split_rate
+        if r < m_rate and genome.enabled[gene]:
+            new_node_id = innovations.get_split_node_id(int(genome.innovations[gene]))
+            if new_node_id in genome.node_ids:
+                continue
+            node_types[new_node_id] = NodeTypes.hidden
+            genome.node_ids.add(new_node_id)
+            genome.enabled[gene] = False
+            in_node_id, out_node_id = int(genome.in_node_ids[gene]), int(genome.out_node_ids[gene])
+            new_connections[(bias_node_id, new_node_id)] = 0.
+            new_connections[(in_node_id, new_node_id)] = 1.
+            new_connections[(new_node_id, out_node_id)] = float(genome.weights[gene])
+
+    pairs = genome.pairs + list(new_connections)
+    # sorted so that a run only depends on the seed, not on the order the node ids were loaded in
+    node_ids = sorted(genome.node_ids)
+    sources = [node_id for node_id in node_ids if node_types[node_id] != NodeTypes.output]
+    targets = [node_id for node_id in node_ids if node_types[node_id] in (NodeTypes.hidden, NodeTypes.output)]
+    for _ in range(add_connection_count):
+        existing = set(pairs)
+        candidates = [
+            (in_node_id, out_node_id) for in_node_id in sources for out_node_id in targets
+            if in_node_id != out_node_id and (in_node_id, out_node_id) not in existing
+        ]
+        random.shuffle(candidates)
+        for pair in candidates:
+            if not creates_cycle(pairs, *pair):
+                pairs.append(pair)
+                new_connections[pair] = (random.random() * 2) - 1
+                break
+
+    genome.add_connections(
+        innovations.get_historical_ids(new_connections), [pair[0] for pair in new_connections],
+        [pair[1] for pair in new_connections], list(new_connections.values()), [True] * len(new_connections))
+    return genome
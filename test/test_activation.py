@@ -1,6 +1,10 @@
 from unittest import TestCase
 
-from core.activation import sigmoid, relu, EPSILON, leaky_relu
+import numpy as np
+
+from core.activation import (
+    sigmoid, relu, EPSILON, leaky_relu, ActivationTypes, get_activation, register_activation, _activations,
+)
 
 
 class TestActivation(TestCase):
@@ -10,15 +14,45 @@ class TestActivation(TestCase):
         self.assertAlmostEqual(0, sigmoid(-10), 6)
         self.assertAlmostEqual(0.5, sigmoid(0), 6)
         self.assertAlmostEqual(1, sigmoid(10), 6)
-    
+
     def test_relu(self):
         """ Tests ReLu activation function """
         self.assertEqual(0, relu(0))
         self.assertEqual(1, relu(1))
         self.assertEqual(0, relu(-1))
-    
+
     def test_lrelu(self):
         """ Tests Leaky ReLu activation function """
         self.assertEqual(0, leaky_relu(0))
         self.assertEqual(1, leaky_relu(1))
         self.assertEqual(-EPSILON, leaky_relu(-1))
+
+    def test_arrays(self):
+        """ Tests the activation functions on arrays, in place and with extreme values """
+        x = np.array([[-1e300, -1000., 0.], [1., 1000., 1e300]])
+        with np.errstate(all='raise'):
+            np.testing.assert_allclose([[0., 0., .5], [1 / (1 + np.exp(-4.9)), 1., 1.]], sigmoid(x))
+            np.testing.assert_array_equal([[0., 0., 0.], [1., 1000., 1e300]], relu(x))
+            np.testing.assert_array_equal(
+                [[-1e300 * EPSILON, -1000. * EPSILON, 0.], [1., 1000., 1e300]], leaky_relu(x))
+
+        for activation in (sigmoid, relu, leaky_relu):
+            out = np.empty((3, 4))
+            view = out[:, 1:3]
+            res = activation(x.T, out=view)
+            self.assertIs(view, res)
+            np.testing.assert_array_equal(activation(x.T), out[:, 1:3])
+
+    def test_registry(self):
+        """ Tests the lookup of activation functions by id """
+        self.assertIs(sigmoid, get_activation(ActivationTypes.sigmoid))
+        self.assertIs(relu, get_activation(ActivationTypes.relu))
+        self.assertIs(leaky_relu, get_activation(ActivationTypes.leaky_relu))
+        self.assertIs(np.tanh, get_activation(np.tanh))
+        with self.assertRaises(ValueError):
+            get_activation(0)
+        with self.assertRaises(ValueError):
+            register_activation(ActivationTypes.relu, np.tanh)
+        register_activation(100, np.tanh)
+        self.addCleanup(_activations.pop, 100)
+        self.assertIs(np.tanh, get_activation(100))
@@ -0,0 +1,41 @@
+import os
+import tempfile
+from unittest import TestCase
+
+import numpy as np
+
+from core.checkpoint import read_arrays, read_meta, write_arrays
+
+
+class TestArrayFile(TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.addCleanup(self.folder.cleanup)
+        self.path = os.path.join(self.folder.name, 'arrays.bin')
+
+    def test_round_trip(self):
+        arrays = {
+            'ids': np.arange(5, dtype=np.int64),
+            'weights': np.linspace(-1, 1, 7),
+            'enabled': np.array([True, False, True]),
+            'pairs': np.arange(6, dtype=np.int32).reshape(3, 2),
+            'empty': np.empty(0, dtype=np.int64),
+        }
+        write_arrays(self.path, arrays, {'population_id': 3})
+        self.assertFalse(os.path.exists(f'{self.path}.tmp'))
+        self.assertDictEqual({'population_id': 3}, read_meta(self.path))
+        for mmap in (True, False):
+            loaded, meta = read_arrays(self.path, mmap=mmap)
+            self.assertDictEqual({'population_id': 3}, meta)
+            self.assertListEqual(list(arrays), list(loaded))
+            for name, array in arrays.items():
+                self.assertEqual(array.dtype, loaded[name].dtype)
+                np.testing.assert_array_equal(array, loaded[name])
+        self.assertIsInstance(read_arrays(self.path)[0]['weights'], np.memmap)
+        self.assertEqual(0, read_arrays(self.path)[0]['weights'].ctypes.data % 64)
+
+    def test_invalid_file(self):
+        with open(self.path, 'wb') as invalid_file:
+            invalid_file.write(b'SQLite format 3\0' + bytes(100))
+        with self.assertRaises(ValueError):
+            read_arrays(self.path)
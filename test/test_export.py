@@ -0,0 +1,125 @@
+import os
+import sys
+import tempfile
+
+from core.export import DotRenderer, Export, stream_genotype_dicts
+from core.model import NEATModel
+from core.orm.enums import NodeTypes
+from core.orm.genotype import Genotype
+from test import NEATBaseTestCaseMemory
+
+
+class TestExport(NEATBaseTestCaseMemory):
+    def setUp(self):
+        super().setUp()
+        self.model = NEATModel(self._db)
+        self.model.initialize(2, 1, pop_size=6)
+        self._db.execute("""INSERT INTO specie DEFAULT VALUES""")
+        self._db.executemany(
+            """UPDATE individual SET score = ?, specie_id = ? WHERE id = ?""",
+            ((individual_id * 10, 1 + individual_id % 2, individual_id) for individual_id in range(1, 7)),
+        )
+        self.folder = tempfile.TemporaryDirectory()
+        self.addCleanup(self.folder.cleanup)
+
+    def _read(self, genotype_id):
+        with open(os.path.join(self.folder.name, f'genotype_{genotype_id}.dot')) as dot_file:
+            return dot_file.read()
+
+    def test_stream(self):
+        queries = []
+        self._db._con.set_trace_callback(queries.append)
+        genotypes = list(stream_genotype_dicts(self._db))
+        self._db._con.set_trace_callback(None)
+        self.assertEqual(1, len(queries))
+        self.assertListEqual(list(range(1, 7)), [genotype['genotype_id'] for genotype in genotypes])
+        for genotype in genotypes:
+            legacy = Genotype(self._db, genotype['genotype_id']).as_dict()
+            self.assertSetEqual(legacy['node_ids'], genotype['node_ids'])
+            self.assertListEqual(list(legacy['connection_dicts']), genotype['connection_dicts'])
+            self.assertDictEqual({1: 1, 2: 2, 3: 2, 4: 4}, genotype['node_types'])
+
+        self.assertEqual(6, Export.from_database(self._db, self.folder.name).render())
+        genotype_dicts = (Genotype(self._db, genotype_id).as_dict() for genotype_id in (1, 2))
+        rendered = [self._read(genotype_id) for genotype_id in (1, 2)]
+        self.assertEqual(2, Export(genotype_dicts, self.folder.name).render())
+        self.assertListEqual(rendered, [self._read(genotype_id) for genotype_id in (1, 2)])
+
+    def test_filters(self):
+        def genotype_ids(**filters):
+            return [genotype['genotype_id'] for genotype in stream_genotype_dicts(self._db, **filters)]
+
+        self.assertListEqual([3], genotype_ids(genotype_ids=(3,)))
+        self.assertListEqual([1, 3, 5], genotype_ids(specie_id=2))
+        self.assertListEqual([5, 6], genotype_ids(top_k=2))
+        self.assertListEqual([5], genotype_ids(specie_id=2, top_k=1))
+        self.assertListEqual(list(range(1, 7)), genotype_ids(generation_id=1))
+        self.assertListEqual([], genotype_ids(generation_id=2))
+        self.assertEqual(1, self.model.export_individual(self.folder.name, specie_id=1, top_k=1))
+        self.assertListEqual(['genotype_6.dot'], os.listdir(self.folder.name))
+
+    def test_render(self):
+        serial_folder = tempfile.TemporaryDirectory()
+        self.addCleanup(serial_folder.cleanup)
+        self.assertEqual(6, Export.from_database(self._db, serial_folder.name).render())
+        genotype_dicts = [Genotype(self._db, genotype_id).as_dict() for genotype_id in range(1, 7)]
+        self.assertEqual(6, Export(genotype_dicts, self.folder.name).render(workers=2, batch_size=4))
+        for genotype_id in range(1, 7):
+            with open(os.path.join(serial_folder.name, f'genotype_{genotype_id}.dot')) as dot_file:
+                self.assertEqual(dot_file.read(), self._read(genotype_id))
+
+    def test_render_images(self):
+        # stand-in for the Graphviz binary, logging its calls and copying the dot file to the image
+        log_path = os.path.join(self.folder.name, 'calls.log')
+        dot_binary = os.path.join(self.folder.name, 'dot')
+        with open(dot_binary, 'w') as binary_file:
+            binary_file.write(
+                f"""#!{sys.executable}
+import shutil, sys
+with open({log_path!r}, 'a') as log_file:
+    log_file.write(sys.argv[2] + '\\n')
+shutil.copy(sys.argv[2], sys.argv[4])
+""")
+        os.chmod(dot_binary, 0o755)
+
+        def render():
+            return Export.from_database(self._db, self.folder.name, top_k=3).render(
+                image_format='png', dot_binary=dot_binary, max_concurrent_images=2)
+
+        def calls():
+            with open(log_path) as log_file:
+                return sorted(os.path.basename(line.strip()) for line in log_file)
+
+        self.assertEqual(3, render())
+        self.assertListEqual(['genotype_4.dot', 'genotype_5.dot', 'genotype_6.dot'], calls())
+        with open(os.path.join(self.folder.name, 'genotype_6.png')) as image_file:
+            self.assertEqual(self._read(6), image_file.read())
+        render()
+        self.assertEqual(3, len(calls()))
+        os.remove(os.path.join(self.folder.name, 'genotype_5.png'))
+        self._db.execute("""UPDATE connection SET weight = 5 WHERE genotype_id = 4""")
+        render()
+        self.assertListEqual(['genotype_4.dot', 'genotype_4.dot', 'genotype_5.dot', 'genotype_5.dot',
+                              'genotype_6.dot'], calls())
+
+    def test_renderer(self):
+        renderer = DotRenderer('draw', self._db)
+        genotype_dicts = [Genotype(self._db, genotype_id).as_dict() for genotype_id in range(1, 7)]
+        queries = []
+        self._db._con.set_trace_callback(queries.append)
+        layouts = [renderer.layout(genotype) for genotype in genotype_dicts]
+        self._db._con.set_trace_callback(None)
+        self.assertEqual(1, len(queries))
+        self.assertDictEqual({1: (1,), 2: (2, 3), 3: (), 4: (4,)}, layouts[0].nodes)
+        self.assertTupleEqual((1, 4, NodeTypes.output), tuple(layouts[0].connections[0][i] for i in (0, 1, 4)))
+
+        self._db.execute("""UPDATE connection SET weight = 0.1 WHERE genotype_id = 1""")
+        queries = []
+        self._db._con.set_trace_callback(queries.append)
+        drawn = Genotype(self._db, 1).draw()
+        self._db._con.set_trace_callback(None)
+        self.assertEqual(1, len([query for query in queries if 'SELECT' in query]))
+        self.assertIn('node_1 -> node_4 [color = "#000080"]', drawn)
+        self.assertEqual(drawn, renderer.render(next(stream_genotype_dicts(self._db, genotype_ids=(1,)))))
+        with self.assertRaises(ValueError):
+            DotRenderer('unknown')
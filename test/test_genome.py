@@ -0,0 +1,63 @@
+from unittest import TestCase
+
+import numpy as np
+
+from core.activation import sigmoid
+from core.genome import Genome, compatibility_distance, compatibility_distances
+from core.orm.enums import NodeTypes
+
+
+class TestGenome(TestCase):
+    def setUp(self):
+        self.genome = Genome({1, 2, 3, 4}, (5, 2), (3, 2), (4, 3), (.5, 1.), (True, True))
+
+    def test_init(self):
+        self.assertListEqual([2, 5], self.genome.innovations.tolist())
+        self.assertListEqual([(2, 3), (3, 4)], self.genome.pairs)
+        self.assertEqual(2, len(self.genome))
+
+    def test_copy(self):
+        copy = self.genome.copy()
+        copy.weights[0] = 0.
+        copy.node_ids.add(6)
+        self.assertEqual(1., self.genome.weights[0])
+        self.assertNotIn(6, self.genome.node_ids)
+
+    def test_add_connections(self):
+        self.genome.add_connections((3,), (1,), (4,), (-1.,), (False,))
+        self.assertListEqual([2, 3, 5], self.genome.innovations.tolist())
+        self.assertListEqual([1., -1., .5], self.genome.weights.tolist())
+        self.assertListEqual([True, False, True], self.genome.enabled.tolist())
+
+    def test_distance(self):
+        other = Genome({1, 2, 3, 4}, (2, 3), (2, 1), (3, 4), (0., 1.), (True, True))
+        self.assertEqual(0., self.genome.distance(self.genome.copy()))
+        self.assertAlmostEqual(
+            compatibility_distance((np.array([2, 5]), np.array([1., .5])), (np.array([2, 3]), np.array([0., 1.]))),
+            self.genome.distance(other))
+
+    def test_distances(self):
+        genes = (np.array([2, 5]), np.array([1., .5]))
+        others = ((np.array([2, 3]), np.array([0., 1.])), (np.array([], dtype=int), np.array([])),
+                  (np.array([5, 7, 9]), np.array([.5, 0., 0.])), genes)
+        expected = [compatibility_distance(genes, other) for other in others]
+        self.assertListEqual([(1 + 1) / 2 + .4, 1., (2 + 1) / 3, 0.], expected)
+        np.testing.assert_allclose(expected, compatibility_distances(genes, others))
+        self.assertEqual(0, len(compatibility_distances(genes, ())))
+
+    def test_compile(self):
+        node_types = {1: NodeTypes.bias, 2: NodeTypes.input, 3: NodeTypes.hidden, 4: NodeTypes.output}
+        phenotype = self.genome.compile(node_types)
+        self.assertTupleEqual((1, 2, 3, 4), phenotype.node_ids)
+        expected = sigmoid(.5 * sigmoid(1.))
+        self.assertAlmostEqual(expected, float(np.ravel(phenotype.forward([[1.]]))[0]))
+        self.genome.enabled[1] = False
+        self.assertAlmostEqual(.5, float(np.ravel(self.genome.compile(node_types).forward([[1.]]))[0]))
+
+    def test_as_genotype_kwargs(self):
+        kwargs = self.genome.as_genotype_kwargs((7,))
+        self.assertSetEqual({1, 2, 3, 4}, kwargs['node_ids'])
+        self.assertSetEqual({7}, kwargs['parent_genotype_ids'])
+        self.assertTupleEqual(
+            ({'historical_connection_id': 2, 'weight': 1., 'is_enabled': True},
+             {'historical_connection_id': 5, 'weight': .5, 'is_enabled': True}), kwargs['connection_dicts'])
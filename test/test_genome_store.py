@@ -0,0 +1,72 @@
+import os
+import tempfile
+
+import numpy as np
+
+from core.genome_store import GenomeStore, generation_path, publish_generation
+from core.model import NEATModel
+from core.orm.database import Database
+from test import NEATBaseTestCaseMemory
+from test.test_model import xor_fitness
+
+
+def output_sum(outputs):
+    return float(outputs.sum())
+
+
+class TestGenomeStore(NEATBaseTestCaseMemory):
+    def setUp(self):
+        super().setUp()
+        self.folder = tempfile.TemporaryDirectory()
+        self.addCleanup(self.folder.cleanup)
+        self.model = NEATModel(self._db, store_folder=self.folder.name)
+        self.model.initialize(2, 1, pop_size=20)
+        self.model.set_metadata(mutation_split_rate=0.3, mutation_add_rate=0.3)
+        self.batch_inputs = [[0., 0.], [0., 1.], [1., 0.], [1., 1.]]
+        self.model.run(self.batch_inputs, xor_fitness, 3)
+
+    def test_publish(self):
+        population = self.model._population
+        individuals, genomes, node_types = population.genomes()
+        path = self.model.publish_generation()
+        self.assertEqual(generation_path(self.folder.name, population.generation_id), path)
+        self.assertTrue(all(
+            os.path.exists(generation_path(self.folder.name, generation_id)) for generation_id in range(1, 4)))
+        mtime = os.stat(path).st_mtime_ns
+        self.assertEqual(path, publish_generation(
+            self.folder.name, self.model._run_id, population.id, population.generation_id, {}, {}, {}))
+        self.assertEqual(mtime, os.stat(path).st_mtime_ns)
+
+        store = GenomeStore(path)
+        self.assertSequenceEqual(
+            (self.model._run_id, population.id, population.generation_id),
+            (store.run_id, store.population_id, store.generation_id))
+        self.assertListEqual(sorted(individuals), store.individual_ids)
+        self.assertIsInstance(store['weights'], np.memmap)
+        self.assertDictEqual(node_types, store.node_types)
+        phenotypes = population.compile()
+        for individual_id, (genotype_id, _) in individuals.items():
+            genome = store.genome(individual_id)
+            self.assertSetEqual(genomes[genotype_id].node_ids, genome.node_ids)
+            self.assertListEqual(genomes[genotype_id].innovations.tolist(), genome.innovations.tolist())
+            self.assertListEqual(genomes[genotype_id].pairs, genome.pairs)
+            self.assertListEqual(genomes[genotype_id].weights.tolist(), genome.weights.tolist())
+            self.assertListEqual(genomes[genotype_id].enabled.tolist(), genome.enabled.tolist())
+            np.testing.assert_array_equal(
+                phenotypes[individual_id].forward(self.batch_inputs),
+                store.compile(individual_id).forward(self.batch_inputs))
+
+    def test_evaluate(self):
+        serial_scores = self.model.evaluate(self.batch_inputs, xor_fitness)
+        self.assertDictEqual(serial_scores, self.model.evaluate(self.batch_inputs, xor_fitness, workers=2))
+
+    def test_shared_folder(self):
+        db = Database(':memory:', override=True)
+        db.execute("""INSERT INTO model_metadata DEFAULT VALUES""")
+        other_model = NEATModel(db, store_folder=self.folder.name)
+        other_model.initialize(2, 1, pop_size=20)
+        path = generation_path(self.folder.name, 1)
+        self.assertNotEqual(other_model._run_id, GenomeStore(path).run_id)
+        parallel_scores = other_model.evaluate(self.batch_inputs, output_sum, workers=2)
+        self.assertEqual(other_model._run_id, GenomeStore(path).run_id)
+        self.assertDictEqual(other_model.evaluate(self.batch_inputs, output_sum, workers=1), parallel_scores)
@@ -1,11 +1,23 @@
 import os
+import random
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
 from unittest import mock
 
+import numpy as np
+
 from core.model import NEATModel
+from core.orm.database import Database
 from core.orm.enums import NodeTypes
+from core.orm.metadata import ModelMetadata
 from test import NEATBaseTestCaseMemory
 
 
+def xor_fitness(outputs):
+    targets = np.array([0., 1., 1., 0.])
+    return round(100 * (1 - np.abs(outputs[:, 0] - targets).mean()))
+
+
 class TestNeatModel(NEATBaseTestCaseMemory):
     @mock.patch('random.random', new=lambda: 1)
     def test_init(self):
@@ -58,3 +70,141 @@ class TestNeatModel(NEATBaseTestCaseMemory):
             [((i * 10) + j + 1, j + 1, i + 1, True, mocked_random) for i in range(10) for j in range(10)], res)
         
         model.export_individual(os.path.dirname(__file__), 1)
+
+    def test_init_bulk(self):
+        model = NEATModel(self._db)
+        pop_size = 1000
+        with mock.patch.object(self._db, 'execute', wraps=self._db.execute) as execute, \
+                mock.patch.object(self._db, 'executemany', wraps=self._db.executemany) as executemany:
+            model.initialize(3, 2, pop_size=pop_size)
+        self.assertLessEqual(execute.call_count + executemany.call_count, 40)
+        res = self._db.execute("""SELECT COUNT(*), COUNT(DISTINCT genotype_id), MAX(specie_id) FROM individual""")
+        self.assertSequenceEqual([(pop_size, pop_size, 1)], res)
+        res = self._db.execute("""SELECT COUNT(*), COUNT(DISTINCT historical_id) FROM connection""")
+        self.assertSequenceEqual([(2 * pop_size, 2)], res)
+
+    def test_step(self):
+        model = NEATModel(self._db)
+        model.initialize(2, 1, pop_size=20)
+        metadata = model.set_metadata(mutation_split_rate=0.2, mutation_add_rate=0.2)
+        self.assertSequenceEqual((3, 20, .2), (metadata.id, metadata.population_size, metadata.mutation_add_rate))
+        batch_inputs = [[0., 0.], [0., 1.], [1., 0.], [1., 1.]]
+        scores = model.step(batch_inputs, xor_fitness)
+        self.assertSetEqual(set(range(1, 21)), set(scores))
+        best_genotype_id = self._db.execute(
+            """SELECT genotype_id FROM individual WHERE population_id = 1 ORDER BY score DESC, id LIMIT 1""")[0]
+        res = self._db.execute("""SELECT id, generation_id FROM population""")
+        self.assertSequenceEqual([(1, 1), (2, 2)], res)
+        res = self._db.execute("""SELECT genotype_id FROM individual WHERE population_id = 2""")
+        self.assertEqual(20, len(res))
+        self.assertIn((best_genotype_id,), res)
+
+        best_scores = model.run(batch_inputs, xor_fitness, 5)
+        self.assertEqual(5, len(best_scores))
+        self.assertLessEqual(max(scores.values()), best_scores[-1])
+        self.assertEqual(7, self._db.execute("""SELECT COUNT(*) FROM population""")[0][0])
+
+    def test_step_rollback(self):
+        model = NEATModel(self._db)
+        model.initialize(2, 1, pop_size=20)
+        model.set_metadata(mutation_split_rate=1., mutation_weight_rate=0., mutation_switch_rate=0.,
+                           mutation_add_rate=0., reproduction_cloning_rate=1.)
+        count_innovations = """SELECT (SELECT COUNT(*) FROM connection_historical), (SELECT COUNT(*) FROM node)"""
+        innovations = self._db.execute(count_innovations)
+        batch_inputs = [[0., 0.], [0., 1.], [1., 0.], [1., 1.]]
+        with mock.patch('core.model.Population', side_effect=RuntimeError), self.assertRaises(RuntimeError):
+            model.step(batch_inputs, xor_fitness)
+        self.assertSequenceEqual(innovations, self._db.execute(count_innovations))
+        self.assertNotIn(innovations[0][0] + 1, self._db.innovations)
+
+        model.step(batch_inputs, xor_fitness)
+        self.assertLess(innovations[0][0], self._db.execute(count_innovations)[0][0])
+
+    def test_checkpoint(self):
+        model = NEATModel(self._db)
+        model.initialize(2, 1, pop_size=1000)
+        model.set_metadata(mutation_split_rate=0.2, mutation_add_rate=0.2)
+        batch_inputs = [[0., 0.], [0., 1.], [1., 0.], [1., 1.]]
+        model.run(batch_inputs, xor_fitness, 2)
+        model.evaluate(batch_inputs, xor_fitness)
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        path = os.path.join(folder.name, 'run.ckpt')
+        model.save_checkpoint(path)
+
+        resumed = NEATModel(Database(':memory:', override=True))
+        resumed.load_checkpoint(path)
+        self.assertEqual(model.metadata, resumed.metadata)
+        individuals, genomes, node_types = model._population.genomes()
+        resumed_individuals, resumed_genomes, resumed_node_types = resumed._population.genomes()
+        self.assertDictEqual(individuals, resumed_individuals)
+        self.assertDictEqual(node_types, resumed_node_types)
+        for genotype_id, genome in genomes.items():
+            self.assertSetEqual(genome.node_ids, resumed_genomes[genotype_id].node_ids)
+            self.assertListEqual(genome.pairs, resumed_genomes[genotype_id].pairs)
+            self.assertListEqual(genome.weights.tolist(), resumed_genomes[genotype_id].weights.tolist())
+        self.assertEqual(model._population.best_score, resumed._population.best_score)
+        query = """
+            SELECT conn.id, conn.genotype_id, conn.historical_id
+            FROM connection AS conn
+            INNER JOIN individual AS ind ON ind.genotype_id = conn.genotype_id
+            WHERE ind.population_id = ?
+            ORDER BY conn.id
+            """
+        self.assertSequenceEqual(
+            self._db.execute(query, (model._population.id,)), resumed._db.execute(query, (resumed._population.id,)))
+
+        # the nodes and the hyperparameters of the checkpoint can't overwrite those of the database
+        for statement in (
+                """INSERT INTO model_metadata (id) VALUES (10)""",
+                """INSERT INTO node (node_type_id) VALUES (4)""",
+        ):
+            db = Database(':memory:', override=True)
+            db.execute(statement)
+            with self.assertRaises(ValueError):
+                NEATModel(db).load_checkpoint(path)
+            self.assertEqual(0, db.execute("""SELECT COUNT(*) FROM population""")[0][0])
+
+        # both models breed from the random state of the checkpoint, restored by load_checkpoint
+        random_state = random.getstate()
+        scores = model.step(batch_inputs, xor_fitness)
+        random.setstate(random_state)
+        self.assertDictEqual(scores, resumed.step(batch_inputs, xor_fitness))
+        self.assertDictEqual(model.evaluate(batch_inputs, xor_fitness), resumed.evaluate(batch_inputs, xor_fitness))
+        with self.assertRaises(ValueError):
+            resumed.load_checkpoint(path)
+
+    def test_metadata(self):
+        model = NEATModel(self._db)
+        self.assertEqual(1, model.metadata.id)
+        self._db.execute("""UPDATE model_metadata SET population_size = 10""")
+        with mock.patch.object(self._db, 'execute', wraps=self._db.execute) as execute:
+            self.assertEqual(100, ModelMetadata.of(self._db).population_size)
+        self.assertEqual(0, execute.call_count)
+        self.assertEqual(10, model.reload_metadata().population_size)
+
+        metadata = model.set_metadata(speciation_tresh=.5)
+        self.assertSequenceEqual((2, .5, 10), (metadata.id, metadata.speciation_tresh, metadata.population_size))
+        self.assertAlmostEqual(
+            metadata.mutation_split_rate + metadata.mutation_weight_rate + metadata.mutation_switch_rate +
+            metadata.mutation_add_rate, metadata.mutation_rate)
+        with self.assertRaises(ValueError):
+            model.set_metadata(unknown_rate=1.)
+        with self.assertRaises(AttributeError):
+            metadata.speciation_tresh = 1.
+
+    def test_evaluate(self):
+        model = NEATModel(self._db, workers=2)
+        model.initialize(2, 1, pop_size=6)
+        batch_inputs = [[0., 0.], [0., 1.], [1., 0.], [1., 1.]]
+        parallel_scores = model.evaluate(batch_inputs, xor_fitness)
+        serial_scores = model.evaluate(batch_inputs, xor_fitness, workers=1)
+        self.assertSetEqual({1, 2, 3, 4, 5, 6}, set(parallel_scores))
+        self.assertDictEqual(serial_scores, parallel_scores)
+        res = self._db.execute("""SELECT id, score FROM individual ORDER BY id""")
+        self.assertSequenceEqual(sorted(parallel_scores.items()), res)
+
+        with mock.patch('core.model.ProcessPoolExecutor', wraps=ProcessPoolExecutor) as executor:
+            best_scores = model.run(batch_inputs, xor_fitness, 3)
+        self.assertEqual(3, len(best_scores))
+        self.assertEqual(1, executor.call_count)
@@ -1,12 +1,20 @@
 import os.path
+import sqlite3
+import tempfile
 from unittest import TestCase, mock
 
+import numpy as np
+
+from core.genome import compatibility_distance, compatibility_distances, distance_matrix
+from core.model import NEATModel
 from core.orm.connections import HistoricalConnection, Connection
+from core.orm.cache import EntityCache
 from core.orm.database import Database
-from core.orm.enums import MutationTypes, NodeTypes
+from core.orm.enums import MutationTypes, NodeTypes, validate_enums
 from core.orm.generation import Generation
 from core.orm.genotype import Genotype
 from core.orm.individual import Specie, Individual
+from core.orm.innovation import InnovationRegistry
 from core.orm.node import Node
 from core.orm.population import Population
 from test import NEATBaseTestCase
@@ -34,6 +42,283 @@ class TestMetaData(TestCase):
             Population(self._db, generation_id=1, individual_dicts=ind_dicts)
 
 
+class TestDatabase(TestCase):
+    def setUp(self):
+        self._db = Database('test/test', override=True)
+        self._reader = sqlite3.connect(self._db._filename)
+        self.addCleanup(self._reader.close)
+
+    def _read_generation_ids(self):
+        return [row[0] for row in self._reader.execute("""SELECT id FROM generation ORDER BY id""")]
+
+    def test_transaction(self):
+        with self._db.transaction():
+            Generation(self._db)
+            Generation(self._db)
+            self.assertSequenceEqual([], self._read_generation_ids())
+        self.assertSequenceEqual([1, 2], self._read_generation_ids())
+
+        with self.assertRaises(ValueError), self._db.transaction():
+            Generation(self._db)
+            Generation(self._db, generation_id=100)
+        self.assertSequenceEqual([1, 2], self._read_generation_ids())
+        self.assertSequenceEqual([(1,), (2,)], self._db.execute("""SELECT id FROM generation"""))
+
+    def test_nested_transaction(self):
+        with self._db.transaction():
+            Generation(self._db)
+            with self.assertRaises(ValueError), self._db.transaction():
+                Generation(self._db)
+                Specie(self._db, specie_id=100)
+            with self._db.transaction():
+                Generation(self._db)
+            self.assertSequenceEqual([], self._read_generation_ids())
+        self.assertSequenceEqual([1, 2], self._read_generation_ids())
+
+        Generation(self._db)
+        self.assertSequenceEqual([1, 2, 3], self._read_generation_ids())
+
+    def test_rollback_callbacks(self):
+        callback = mock.Mock()
+        self._db.on_rollback(callback)
+        with self._db.transaction():
+            with self.assertRaises(ValueError), self._db.transaction():
+                Specie(self._db, specie_id=100)
+            with self.assertRaises(ValueError):
+                self._db.execute("""INSERT INTO node_type (name) VALUES ('Bias')""")
+            callback.assert_not_called()
+            with self.assertRaises(ValueError), self._db.transaction():
+                Generation(self._db)
+                Specie(self._db, specie_id=100)
+            callback.assert_called_once()
+        with self.assertRaises(ValueError):
+            self._db.executemany("""INSERT INTO node_type (name) VALUES (?)""", (('Other',), ('Bias',)))
+        self.assertEqual(2, callback.call_count)
+        with self.assertRaises(ValueError):
+            self._db.execute("""INSERT INTO node_type (name) VALUES ('Bias')""")
+        self.assertEqual(2, callback.call_count)
+
+    def test_execute_parameters(self):
+        self._db.execute("""INSERT INTO node (node_type_id, connection_historical_id) VALUES (?, ?)""", (2, None))
+        self.assertEqual(2, self._db.lastrowid)
+        query = """SELECT id FROM node WHERE node_type_id = ? AND connection_historical_id IS ?"""
+        self.assertSequenceEqual([(1,)], self._db.execute(query, (NodeTypes.bias, None)))
+        self.assertSequenceEqual([(2,)], self._db.execute(query, (NodeTypes.input, None)))
+        self.assertSequenceEqual([(2,)], self._read_node_ids())
+        with self.assertRaises(ValueError):
+            self._db.execute("""INSERT INTO node (id, node_type_id) VALUES (?, ?)""", (2, NodeTypes.input))
+
+    def test_query_plans(self):
+        self.assertEqual(len(self._db._migrations), self._db.schema_version)
+        queries = {
+            """SELECT id, genotype_id, is_enabled, weight FROM connection WHERE genotype_id = ?""":
+                'COVERING INDEX connection_genotype_idx',
+            """SELECT historical_id FROM connection WHERE genotype_id = ?""":
+                'COVERING INDEX connection_genotype_idx',
+            """SELECT id FROM connection_historical WHERE in_node_id = ? AND out_node_id = ?""":
+                'COVERING INDEX connection_historical_nodes_idx',
+            """SELECT node_id FROM genotype_node_rel WHERE genotype_node_rel.genotype_id = ?""":
+                'COVERING INDEX genotype_node_rel_genotype_idx',
+            """SELECT id, genotype_id FROM individual WHERE population_id = ?""":
+                'COVERING INDEX individual_population_idx',
+            """SELECT id FROM individual WHERE individual.specie_id = ?""":
+                'COVERING INDEX individual_specie_idx',
+            """SELECT MAX(score) FROM individual WHERE individual.specie_id = ?""":
+                'COVERING INDEX individual_specie_idx',
+            """
+            SELECT MAX(score)
+            FROM individual
+            INNER JOIN population AS pop ON pop.id = individual.population_id
+            WHERE pop.generation_id = ?
+            """: 'COVERING INDEX population_generation_idx',
+        }
+        for query, index in queries.items():
+            plan = self._db.explain(query, (1,) * query.count('?'))
+            self.assertTrue(any(index in line for line in plan), plan)
+            self.assertFalse(any(line.startswith('SCAN') for line in plan), plan)
+
+    def test_migrate(self):
+        self._db.execute("""DROP INDEX connection_genotype_idx""")
+        self._db.execute("""PRAGMA user_version = 0""")
+        self._db.migrate()
+        self.assertEqual(len(self._db._migrations), self._db.schema_version)
+        plan = self._db.explain("""SELECT historical_id FROM connection WHERE genotype_id = ?""", (1,))
+        self.assertIn('connection_genotype_idx', plan[0])
+        columns = {row[1]: row[2] for row in self._db.execute("""PRAGMA table_info(individual)""")}
+        self.assertEqual('REAL', columns['score'])
+
+    def test_migrate_integer_scores(self):
+        self._db._cursor.executescript(
+            """
+            PRAGMA foreign_keys = OFF;
+            DROP TABLE individual;
+            CREATE TABLE individual (
+                id INTEGER PRIMARY KEY,
+                genotype_id INTEGER NOT NULL,
+                specie_id INTEGER NOT NULL,
+                score INTEGER DEFAULT 0 NOT NULL,
+                population_id INTEGER NOT NULL
+                );
+            INSERT INTO individual (id, genotype_id, specie_id, score, population_id) VALUES (1, 1, 1, 7, 1);
+            PRAGMA foreign_keys = ON;
+            PRAGMA user_version = 1;
+            """
+        )
+        self._db.migrate()
+        self.assertEqual(len(self._db._migrations), self._db.schema_version)
+        self.assertSequenceEqual(
+            [(1, 7., 'real')], self._db.execute("""SELECT id, score, typeof(score) FROM individual"""))
+        plan = self._db.explain("""SELECT id FROM individual WHERE individual.specie_id = ?""", (1,))
+        self.assertIn('individual_specie_idx', plan[0])
+
+    def test_profiles(self):
+        expected = {'durable': ('delete', 2, -16384, 0, 0), 'fast': ('wal', 1, -65536, 2 ** 28, 2),
+                    'ephemeral': ('memory', 0, -65536, 2 ** 28, 2)}
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        for profile, pragmas in expected.items():
+            db = Database(os.path.join(directory.name, profile), override=True, profile=profile)
+            self.assertEqual(profile, db.profile)
+            self.assertTupleEqual(pragmas, tuple(
+                db._cursor.execute(f"""PRAGMA {pragma}""").fetchone()[0]
+                for pragma in ('journal_mode', 'synchronous', 'cache_size', 'mmap_size', 'temp_store')))
+            db.close()
+        with self.assertRaises(ValueError):
+            Database('test/test', override=True, profile='unknown')
+
+    def test_override(self):
+        Generation(self._db)
+        self._db.close()
+        self._db = Database('test/test', override=True)
+        self.assertSequenceEqual([], self._read_generation_ids())
+        self.assertSequenceEqual([(1,)], self._db.execute("""SELECT id FROM node"""))
+        self.assertEqual(len(self._db._migrations), self._db.schema_version)
+
+    def test_execute_in(self):
+        for _ in range(40):
+            Generation(self._db)
+        query = """SELECT id FROM generation WHERE id IN ({ids}) AND id > ? ORDER BY id"""
+        self.assertSequenceEqual([(3,), (5,)], self._db.execute_in(query, (1, 3, 5), (2,)))
+        self._db._max_bound_ids = 4
+        self.assertSequenceEqual([(i,) for i in range(3, 40)], self._db.execute_in(query, range(1, 40), (2,)))
+        self.assertSequenceEqual([], self._db.execute("""SELECT id FROM temp.selected_ids"""))
+
+    def _read_node_ids(self):
+        return self._reader.execute("""SELECT id FROM node WHERE node_type_id != 1""").fetchall()
+
+
+class TestWriteBehind(TestCase):
+    def setUp(self):
+        self._db = Database('test/test', override=True, write_behind=True)
+        self.addCleanup(self._db.close)
+        self._reader = sqlite3.connect(self._db._filename)
+        self.addCleanup(self._reader.close)
+
+    def _read_generation_ids(self):
+        self._db.flush()
+        return [row[0] for row in self._reader.execute("""SELECT id FROM generation ORDER BY id""")]
+
+    def test_write_behind(self):
+        self.assertTrue(self._db.write_behind)
+        self.assertEqual('delete', self._reader.execute("""PRAGMA journal_mode""").fetchone()[0])
+        with self._db.transaction():
+            Generation(self._db)
+            with self.assertRaises(ValueError), self._db.transaction():
+                Generation(self._db)
+                Specie(self._db, specie_id=100)
+            Generation(self._db)
+        self.assertSequenceEqual([1, 2], self._read_generation_ids())
+
+        with self.assertRaises(ValueError), self._db.transaction():
+            Generation(self._db)
+            Generation(self._db, generation_id=100)
+        Generation(self._db)
+        self._db.executemany("""INSERT INTO generation (id) VALUES (?)""", ((i,) for i in (10, 11)))
+        self.assertSequenceEqual([1, 2, 3, 10, 11], self._read_generation_ids())
+        self.assertSequenceEqual([(1,), (2,), (3,), (10,), (11,)], self._db.execute("""SELECT id FROM generation"""))
+
+    def test_reads_not_replayed(self):
+        Generation(self._db)
+        self._db.flush()
+        with mock.patch.object(self._db._writer, 'put', wraps=self._db._writer.put) as put:
+            self._db.execute("""WITH ids(id) AS (SELECT id FROM generation) SELECT id FROM ids""")
+            self._db.execute("""PRAGMA table_info(generation)""")
+            self._db.execute("""UPDATE generation SET id = 2 WHERE id = 100""")
+            self._db.execute("""WITH ids(id) AS (VALUES (5)) INSERT INTO generation (id) SELECT id FROM ids""")
+        self.assertEqual(1, put.call_count)
+        self.assertSequenceEqual([1, 5], self._read_generation_ids())
+
+    def test_writer_error(self):
+        self._reader.execute("""INSERT INTO generation (id) VALUES (5)""")
+        self._reader.commit()
+        self._db.execute("""INSERT INTO generation (id) VALUES (5)""")
+        with self.assertRaisesRegex(RuntimeError, 'failed, 0 later'):
+            self._db.flush()
+        with self.assertRaises(RuntimeError):
+            self._db.execute("""INSERT INTO generation (id) VALUES (6)""")
+        with self.assertRaisesRegex(RuntimeError, 'failed, 1 later'):
+            self._db.close()
+        self.assertSequenceEqual([(5,)], self._reader.execute("""SELECT id FROM generation""").fetchall())
+
+    def test_foreign_keys(self):
+        with self.assertRaises(ValueError):
+            self._db.execute(
+                """INSERT INTO individual (genotype_id, specie_id, score, population_id) VALUES (?, ?, ?, ?)""",
+                (100, 100, 0, 100),
+            )
+        self._db.flush()
+        self.assertEqual(0, self._reader.execute("""SELECT COUNT(*) FROM individual""").fetchone()[0])
+
+    def test_close(self):
+        for _ in range(20):
+            Generation(self._db)
+        self._db.close()
+        self.assertEqual(20, self._reader.execute("""SELECT COUNT(*) FROM generation""").fetchone()[0])
+        with self.assertRaises(ValueError):
+            Database(':memory:', override=True, write_behind=True)
+
+
+class TestEntityCache(NEATBaseTestCase):
+    def test_lru(self):
+        cache = EntityCache(maxsize=2)
+        cache.set('node', 1, (1,))
+        cache.set('node', 2, (2,))
+        self.assertEqual((1,), cache.get('node', 1))
+        cache.set('node', 3, (3,))
+        self.assertIsNone(cache.get('node', 2))
+        self.assertSequenceEqual([(1,), (3,)], [cache.get('node', 1), cache.get('node', 3)])
+        cache.invalidate('node', 1, 2)
+        self.assertEqual(1, len(cache))
+        EntityCache(maxsize=0).set('node', 1, (1,))
+        self.assertEqual(0, len(EntityCache(maxsize=0)))
+
+    def test_identity_map(self):
+        input_id = Node(self._db, 'input').id
+        output_id = Node(self._db, 'output').id
+        connection_dicts = ({'in_node_id': input_id, 'out_node_id': output_id, 'weight': 0.5},)
+        genotype = Genotype(self._db, node_ids={input_id, output_id}, connection_dicts=connection_dicts)
+        Node(self._db, node_id=input_id)
+        Connection(self._db, connection_id=1)
+
+        with mock.patch.object(self._db, 'execute', wraps=self._db.execute) as execute:
+            loaded = Genotype(self._db, genotype_id=genotype.id)
+            self.assertEqual(NodeTypes.input, Node(self._db, node_id=input_id).node_type)
+            self.assertEqual(0.5, Connection(self._db, connection_id=1).weight)
+        self.assertEqual(0, execute.call_count)
+        loaded.node_ids.add(100)
+        self.assertNotIn(100, Genotype(self._db, genotype_id=genotype.id).node_ids)
+
+        Connection(self._db, connection_id=1).weight = 0.25
+        Connection(self._db, connection_id=1).is_enabled = False
+        self.assertEqual(0.25, Connection(self._db, connection_id=1).weight)
+        self.assertFalse(Connection(self._db, connection_id=1).is_enabled)
+
+        with self.assertRaises(ValueError), self._db.transaction():
+            Connection(self._db, connection_id=1).weight = 2.
+            Specie(self._db, specie_id=100)
+        self.assertEqual(0.25, Connection(self._db, connection_id=1).weight)
+
+
 class TestNodeTypes(TestCase):
     def test_attributes(self):
         self.assertEqual(1, NodeTypes.bias)
@@ -41,6 +326,13 @@ class TestNodeTypes(TestCase):
         self.assertEqual(3, NodeTypes.hidden)
         self.assertEqual(4, NodeTypes.output)
 
+    def test_validate_enums(self):
+        db = Database(':memory:', override=True)
+        validate_enums(db)
+        db.execute("""UPDATE node_type SET name = 'Unknown' WHERE id = ?""", (NodeTypes.hidden,))
+        with self.assertRaises(ValueError):
+            validate_enums(db)
+
 
 class TestMutationTypes(TestCase):
     def test_attributes(self):
@@ -102,6 +394,52 @@ class TestHistoricalConnection(NEATBaseTestCase):
             HistoricalConnection(self._db, in_node_id=1, out_node_id=1)
 
 
+class TestInnovationRegistry(NEATBaseTestCase):
+    def test_init(self):
+        input_ids = [Node(self._db, 'input').id for _ in range(3)]
+        output_id = Node(self._db, 'output').id
+        HistoricalConnection(self._db, in_node_id=input_ids[0], out_node_id=output_id)
+        split_node_id = Node(self._db, connection_historical_id=1).id
+
+        self._db.innovations = InnovationRegistry(self._db)
+        with mock.patch.object(self._db, 'execute', wraps=self._db.execute) as execute:
+            self.assertEqual(1, HistoricalConnection(self._db, in_node_id=input_ids[0], out_node_id=output_id).id)
+            self.assertEqual(output_id, HistoricalConnection(self._db, historical_connection_id=1).out_node)
+            self.assertEqual(split_node_id, Node(self._db, connection_historical_id=1).id)
+        self.assertEqual(0, execute.call_count)
+
+        with mock.patch.object(self._db, 'executemany', wraps=self._db.executemany) as executemany:
+            self.assertSequenceEqual(
+                [2, 1, 3, 2],
+                self._db.innovations.get_historical_ids(
+                    ((input_ids[1], output_id), (input_ids[0], output_id), (input_ids[2], output_id),
+                     (input_ids[1], output_id))))
+        self.assertEqual(1, executemany.call_count)
+        res = self._db.execute("""SELECT id, in_node_id, out_node_id FROM connection_historical ORDER BY id""")
+        self.assertSequenceEqual([(i + 1, input_id, output_id) for i, input_id in enumerate(input_ids)], res)
+
+        new_split_node_id = Node(self._db, connection_historical_id=2).id
+        self.assertEqual(new_split_node_id, Node(self._db, connection_historical_id=2).id)
+        self.assertSequenceEqual(
+            [(NodeTypes.hidden, 2)],
+            self._db.execute("""SELECT node_type_id, connection_historical_id FROM node WHERE id = ?""",
+                             (new_split_node_id,)))
+
+        with self.assertRaises(ValueError):
+            HistoricalConnection(self._db, historical_connection_id=100)
+        with self.assertRaises(ValueError):
+            Node(self._db, connection_historical_id=100)
+        with self.assertRaises(ValueError):
+            HistoricalConnection(self._db, in_node_id=100, out_node_id=200)
+        self.assertNotIn(4, self._db.innovations)
+
+        with self.assertRaises(ValueError), self._db.transaction():
+            self._db.innovations.get_historical_id(output_id, input_ids[0])
+            Specie(self._db, specie_id=100)
+        self.assertNotIn(4, self._db.innovations)
+        self.assertEqual(4, self._db.innovations.get_historical_id(output_id, input_ids[0]))
+
+
 class TestConnection(NEATBaseTestCase):
     def test_init(self):
         self._db.execute(
@@ -197,9 +535,83 @@ class TestGenotype(NEATBaseTestCase):
         with self.assertRaises(TypeError):
             _ = gen & {6, }
         self.assertEqual(1.0, gen & genode2)
-        self.assertEqual(1 / 3, gen & genode3)
+        # one excess connection out of two, the matching one having the same weight
+        self.assertEqual(.5, gen & genode3)
         self.assertNotIn(new_node_id, gen.node_ids)
 
+    def test_init_batch(self):
+        input_ids = [Node(self._db, 'input').id for _ in range(20)]
+        output_ids = [Node(self._db, 'output').id for _ in range(10)]
+        connection_dicts = tuple(
+            {'in_node_id': in_node_id, 'out_node_id': out_node_id, 'weight': in_node_id / out_node_id}
+            for in_node_id in input_ids for out_node_id in output_ids
+        )
+        with mock.patch.object(self._db, 'execute', wraps=self._db.execute) as execute, \
+                mock.patch.object(self._db, 'executemany', wraps=self._db.executemany) as executemany:
+            gen = Genotype(self._db, node_ids=set(input_ids + output_ids), connection_dicts=connection_dicts)
+        self.assertLessEqual(execute.call_count + executemany.call_count, 10)
+        self.assertEqual(200, len(gen.connection_ids))
+        res = self._db.execute("""SELECT historical_id, weight, is_enabled FROM connection ORDER BY id""")
+        self.assertSequenceEqual(
+            [(i + 1, connection['weight'], True) for i, connection in enumerate(connection_dicts)], res)
+
+        gen2 = Genotype(
+            self._db,
+            node_ids=set(input_ids + output_ids),
+            connection_dicts=connection_dicts[:2] + ({'historical_connection_id': 10, 'is_enabled': False},),
+        )
+        res = self._db.execute(
+            f"""SELECT historical_id, weight, is_enabled FROM connection WHERE genotype_id = {gen2.id} ORDER BY id""")
+        self.assertSequenceEqual([(1, connection_dicts[0]['weight'], True), (2, connection_dicts[1]['weight'], True),
+                                  (10, 1., False)], res)
+        self.assertEqual(200, self._db.execute("""SELECT COUNT(*) FROM connection_historical""")[0][0])
+        with self.assertRaises(ValueError):
+            Genotype(self._db, node_ids={1, 2}, connection_dicts=({'historical_connection_id': 1000},))
+
+    def test_distance(self):
+        input_ids = [Node(self._db, 'input').id for _ in range(5)]
+        output_id = Node(self._db, 'output').id
+        genotypes = [
+            Genotype(
+                self._db, node_ids=set(input_ids) | {output_id},
+                connection_dicts=tuple(
+                    {'in_node_id': input_ids[i], 'out_node_id': output_id, 'weight': weight} for i, weight in genes))
+            for genes in (((0, 1.), (1, 1.), (2, 1.)), ((0, .5), (2, 1.), (3, 1.), (4, 1.)), ((4, 2.),))
+        ]
+        # 1 and 3 are matching, 2 is disjoint, 4 and 5 are excess
+        self.assertAlmostEqual((2 + 1) / 4 + .4 * .25, genotypes[0].distance(genotypes[1]))
+        self.assertAlmostEqual(3 / 3 + 1 / 3, genotypes[0].distance(genotypes[2]))
+        self.assertAlmostEqual(0., genotypes[1].distance(genotypes[1]))
+        self.assertAlmostEqual(1., compatibility_distance(genotypes[2].connection_genes, (np.array([]), np.array([]))))
+
+        loaded = [Genotype(self._db, genotype_id=genotype.id) for genotype in genotypes]
+        with mock.patch.object(self._db, 'execute', wraps=self._db.execute) as execute:
+            self.assertEqual(genotypes[0] & genotypes[1], loaded[0] & loaded[1])
+            self.assertEqual(loaded[0] & loaded[2], loaded[0] & loaded[2])
+        self.assertEqual(3, execute.call_count)
+
+        rng = np.random.default_rng(0)
+        connection_genes = [
+            (np.sort(rng.choice(30, size, replace=False)), rng.normal(size=size)) for size in (0, 1, 5, 12, 30, 7)
+        ]
+        matrix = distance_matrix(connection_genes)
+        self.assertEqual((6, 6), matrix.shape)
+        for i, genes in enumerate(connection_genes):
+            for j, other_genes in enumerate(connection_genes):
+                self.assertAlmostEqual(compatibility_distance(genes, other_genes), matrix[i, j])
+
+    @mock.patch('random.random', new=lambda: .095)  # within the split rate of the default metadata
+    def test_get_mutated(self):
+        NEATModel(self._db).initialize(2, 1, pop_size=2)
+        mutant = Genotype(self._db, genotype_id=1).get_mutated()
+        self.assertSetEqual({1}, mutant['parent_genotype_ids'])
+        self.assertSetEqual({1, 2, 3, 4, 5}, mutant['node_ids'])
+        self.assertEqual(NodeTypes.hidden, Node(self._db, node_id=5).node_type)
+        genome = Genotype(self._db, **mutant).as_genome()
+        self.assertListEqual([(1, 4), (1, 5), (5, 4)], genome.pairs)
+        self.assertListEqual([False, True, True], genome.enabled.tolist())
+        self.assertEqual(1., genome.weights[1])
+
     def test_draw(self):
         node_b = Node(self._db, node_type='bias')
         node_i1 = Node(self._db, node_type='input')
@@ -305,14 +717,14 @@ class TestIndividual(NEATBaseTestCase):
         ind1 = Individual(self._db, population_id=1, genotype_kwargs=genotype_kwargs)
         self.assertEqual(1, ind1.id)
         self.assertEqual(0, ind1.score_raw)
-        self.assertEqual(ind1.score_raw // 2, ind1.score)
+        self.assertEqual(ind1.score_raw / 2, ind1.score)
         self.assertEqual(1, ind1.specie_id)
         self.assertEqual(1, ind1.genotype_id)
         self.assertEqual(1, ind1.population_id)
         ind2 = Individual(self._db, population_id=1, genotype_kwargs=genotype_kwargs, score=10)
         self.assertEqual(2, ind2.id)
         self.assertEqual(10, ind2.score_raw)
-        self.assertEqual(ind2.score_raw // 2, ind2.score)
+        self.assertEqual(ind2.score_raw / 2, ind2.score)
         self.assertEqual(1, ind2.specie_id)
         self.assertEqual(2, ind2.genotype_id)
         self.assertEqual(1, ind2.population_id)
@@ -430,7 +842,8 @@ class TestIndividual(NEATBaseTestCase):
         self.assertSetEqual(geno2.historical_connection_ids, geno3.historical_connection_ids)
         self.assertSetEqual(set(), geno2.connection_ids & geno3.connection_ids)
         self.assertSetEqual(geno2.node_ids, geno3.node_ids)
-        self.assertEqual(1, geno3 & geno2)
+        # same genes, their weights differing by .5
+        self.assertAlmostEqual(.8, geno3 & geno2)
 
 
 class TestPopulation(NEATBaseTestCase):
@@ -514,6 +927,121 @@ class TestPopulation(NEATBaseTestCase):
         self.assertEqual(2, pop2.generation_id)
         self.assertEqual(0, pop2.best_score)
 
+    def test_load_many(self):
+        node_ids = [Node(self._db, node_type).id for node_type in (NodeTypes.input, NodeTypes.output)]
+        self._db.execute("""INSERT INTO model_metadata (population_size) VALUES (60)""")
+        individual_dicts = [
+            {'genotype_kwargs': {'node_ids': set(node_ids), 'connection_dicts': (
+                {'in_node_id': node_ids[0], 'out_node_id': node_ids[1], 'weight': i},
+                {'in_node_id': 1, 'out_node_id': node_ids[1], 'is_enabled': bool(i % 2)},
+            )}}
+            for i in range(60)
+        ]
+        population_id = Population(
+            self._db, generation_id=Generation(self._db).id, individual_dicts=individual_dicts).id
+        self._db.cache.clear()
+        self._db._max_bound_ids = 16
+        queries = []
+        self._db._con.set_trace_callback(queries.append)
+        population = Population(self._db, population_id=population_id)
+        individuals = population.individuals()
+        genotypes = population.genotypes()
+        connections = Connection.load_for_genotypes(self._db, genotypes)
+        self._db._con.set_trace_callback(None)
+        self.assertLessEqual(len([query for query in queries if 'SELECT' in query]), 10)
+
+        self.assertListEqual(sorted(population.individual_ids), [individual.id for individual in individuals])
+        self.assertEqual(60, len(genotypes))
+        for individual in individuals[::7]:
+            loaded = Individual(self._db, individual_id=individual.id)
+            self.assertTupleEqual((loaded.genotype_id, loaded.specie_id, loaded.score_raw, loaded.population_id),
+                                  (individual.genotype_id, individual.specie_id, individual.score_raw,
+                                   individual.population_id))
+            genotype = genotypes[individual.genotype_id]
+            self._db.cache.clear()
+            loaded = Genotype(self._db, genotype_id=genotype.id)
+            self.assertSetEqual(loaded.node_ids, genotype.node_ids)
+            self.assertSetEqual(loaded.connection_ids, genotype.connection_ids)
+            loaded_connections = (
+                Connection(self._db, connection_id=connection_id) for connection_id in sorted(loaded.connection_ids))
+            self.assertListEqual(
+                [(c.id, c.historical_id, c.in_node, c.out_node, c.weight, c.is_enabled) for c in loaded_connections],
+                [(c.id, c.historical_id, c.in_node, c.out_node, c.weight, c.is_enabled) for c in
+                 connections[genotype.id]])
+        with self.assertRaises(ValueError):
+            Genotype.load_many(self._db, (1, 1000))
+        with self.assertRaises(ValueError):
+            Individual.load_many(self._db, (1000,))
+
+    def test_speciate(self):
+        input_ids = [Node(self._db, NodeTypes.input).id for _ in range(4)]
+        output_id = Node(self._db, NodeTypes.output).id
+        pop_size = 40
+        self._db.execute("""INSERT INTO model_metadata (population_size) VALUES (?)""", (pop_size,))
+        Generation(self._db)
+        individual_dicts = tuple(
+            {
+                'genotype_kwargs': {
+                    "node_ids": {input_ids[i % 2], output_id},
+                    "connection_dicts": ({'in_node_id': input_ids[i % 2], 'out_node_id': output_id},),
+                }
+            } for i in range(pop_size)
+        )
+        with mock.patch('core.orm.individual.compatibility_distances', wraps=compatibility_distances) as compared:
+            pop = Population(self._db, generation_id=1, individual_dicts=individual_dicts)
+        self.assertSetEqual({1, 2}, pop.species)
+        self.assertLessEqual(compared.call_count, pop_size)
+        res = self._db.execute("""SELECT id, specie_id FROM individual ORDER BY id""")
+        self.assertSequenceEqual([(i + 1, (i % 2) + 1) for i in range(pop_size)], res)
+
+        newborns = [
+            {'genotype_id': Genotype(
+                self._db, node_ids={input_id, output_id},
+                connection_dicts=({'in_node_id': input_id, 'out_node_id': output_id},)).id}
+            for input_id in input_ids[1:]
+        ]
+        pop.speciate(newborns)
+        self.assertSequenceEqual([2, 3, 4], [newborn['specie_id'] for newborn in newborns])
+
+        with self.assertRaises(ValueError):
+            Population(self._db, generation_id=1, individual_dicts=({'specie_id': 100, 'genotype_id': 1},) * pop_size)
+
+        individual_ids, matrix = pop.distance_matrix()
+        self.assertSequenceEqual(range(1, pop_size + 1), individual_ids)
+        self.assertAlmostEqual(0., matrix[0, 2])
+        self.assertAlmostEqual(2., matrix[0, 1])
+
+    def test_evaluate(self):
+        node_i1 = Node(self._db, NodeTypes.input)
+        node_i2 = Node(self._db, NodeTypes.input)
+        node_o = Node(self._db, NodeTypes.output)
+        self._db.execute("""INSERT INTO model_metadata (population_size) VALUES (2)""")
+        Generation(self._db)
+        individual_dicts = tuple(
+            {
+                'genotype_kwargs': {
+                    "node_ids": {node_i1.id, node_i2.id, node_o.id},
+                    "connection_dicts": (
+                        {'in_node_id': node_i1.id, 'out_node_id': node_o.id, 'weight': weight},
+                        {'in_node_id': node_i2.id, 'out_node_id': node_o.id, 'weight': -weight},
+                    )
+                }
+            } for weight in (1., -1.)
+        )
+        pop = Population(self._db, generation_id=1, individual_dicts=individual_dicts)
+        batch_inputs = np.array([[1., 0.], [0., 1.], [1., 1.], [0., 0.]])
+        targets = np.array([1., 0., 0.5, 0.5])
+
+        def fitness_fn(outputs):
+            return 100 * (1 - np.abs(outputs[:, 0] - targets).mean())
+
+        scores = pop.evaluate(batch_inputs, fitness_fn)
+        self.assertSetEqual(pop.individual_ids, set(scores))
+        self.assertGreater(scores[1], scores[2])
+        res = self._db.execute("""SELECT id, score, typeof(score) FROM individual ORDER BY id""")
+        self.assertSequenceEqual([(1, scores[1], 'real'), (2, scores[2], 'real')], res)
+        self.assertEqual(scores[1], Population(self._db, population_id=pop.id).best_score)
+
 
 class TestSpecie(NEATBaseTestCase):
 
@@ -595,6 +1123,18 @@ class TestSpecie(NEATBaseTestCase):
         self.assertSequenceEqual(((2,), (5,)), specie1.get_culled_individuals())
         self.assertEqual(5, specie1.score)
         self.assertEqual(2, specie1.select_individual())
+        self.assertEqual(2, specie1.select_individual(excluded_id=1))
+
+    def test_create_newborn(self):
+        NEATModel(self._db).initialize(2, 1, pop_size=4)
+        specie = Specie(self._db, specie_id=1)
+        with mock.patch('random.random', new=lambda: 0.):  # cloned
+            newborn = specie.create_newborn({1})
+        self.assertEqual(1, len(newborn['parent_genotype_ids']))
+        with mock.patch('random.random', new=lambda: .5):  # crossed over within the specie
+            newborn = specie.create_newborn({1})
+        self.assertEqual(2, len(newborn['parent_genotype_ids']))
+        Genotype(self._db, **newborn)
 
 
 class TestGeneration(NEATBaseTestCase):
@@ -0,0 +1,100 @@
+from unittest import TestCase
+
+import numpy as np
+
+from core.activation import ActivationTypes, relu, sigmoid
+from core.orm.enums import NodeTypes
+from core.orm.genotype import Genotype
+from core.orm.node import Node
+from core.phenotype import Phenotype
+from test import NEATBaseTestCase
+
+
+class TestPhenotype(TestCase):
+    def setUp(self):
+        self.node_types = {
+            1: NodeTypes.bias,
+            2: NodeTypes.input,
+            3: NodeTypes.input,
+            4: NodeTypes.hidden,
+            5: NodeTypes.hidden,
+            6: NodeTypes.output,
+        }
+        self.connections = (
+            (2, 4, 1.),
+            (3, 4, -1.),
+            (4, 5, 2.),
+            (1, 5, -1.),
+            (5, 6, 1.),
+            (2, 6, 0.5),
+        )
+
+    def test_layers(self):
+        phenotype = Phenotype(self.node_types, self.connections, activation_func=relu)
+        self.assertSequenceEqual((1, 2, 3, 4, 5, 6), phenotype.node_ids)
+        self.assertSequenceEqual((2, 3), phenotype.input_node_ids)
+        self.assertSequenceEqual((6,), phenotype.output_node_ids)
+        self.assertEqual(2, phenotype.n_inputs)
+        self.assertEqual(1, phenotype.n_outputs)
+
+    def test_forward(self):
+        phenotype = Phenotype(self.node_types, self.connections, activation_func=relu)
+        # h4 = relu(2 - 1) = 1, h5 = relu(2 * 1 - 1) = 1, o6 = relu(1 + 0.5 * 2) = 2
+        np.testing.assert_allclose([2.], phenotype.forward([2., 1.]))
+        # h4 = 0, h5 = relu(-1) = 0, o6 = relu(0 + 0.5 * 3) = 1.5
+        np.testing.assert_allclose([1.5], phenotype.forward([3., 5.]))
+
+    def test_forward_batch(self):
+        phenotype = Phenotype(self.node_types, self.connections)
+        batch = np.array([[2., 1.], [3., 5.], [0., 0.], [-1., 4.]])
+        outputs = phenotype.forward(batch)
+        self.assertEqual((4, 1), outputs.shape)
+        for row, output in zip(batch, outputs):
+            np.testing.assert_allclose(phenotype.forward(row), output)
+        with self.assertRaises(ValueError):
+            phenotype.forward([1., 2., 3.])
+
+    def test_node_activations(self):
+        phenotype = Phenotype(
+            self.node_types, self.connections, activation_func=ActivationTypes.relu,
+            node_activations={5: ActivationTypes.sigmoid},
+        )
+        # h4 = relu(2 - 1) = 1, h5 = sigmoid(2 * 1 - 1), o6 = relu(h5 + 0.5 * 2)
+        np.testing.assert_allclose([sigmoid(1.) + 1.], phenotype.forward([2., 1.]))
+        with self.assertRaises(ValueError):
+            Phenotype(self.node_types, self.connections, activation_func=0)
+
+    def test_disconnected_output(self):
+        phenotype = Phenotype({1: NodeTypes.bias, 2: NodeTypes.input, 3: NodeTypes.output}, ())
+        np.testing.assert_allclose([sigmoid(0)], phenotype.forward([10.]))
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            Phenotype(self.node_types, self.connections + ((5, 4, 1.),))
+        with self.assertRaises(ValueError):
+            Phenotype(self.node_types, self.connections + ((6, 2, 1.),))
+        with self.assertRaises(ValueError):
+            Phenotype(self.node_types, self.connections + ((6, 7, 1.),))
+
+
+class TestGenotypeCompile(NEATBaseTestCase):
+    def test_compile(self):
+        node_i1 = Node(self._db, node_type='input')
+        node_i2 = Node(self._db, node_type='input')
+        node_h = Node(self._db, node_type='hidden')
+        node_o = Node(self._db, node_type='output')
+        connection_dicts = (
+            {'in_node_id': node_i1.id, 'out_node_id': node_h.id, 'weight': 1., 'is_enabled': True},
+            {'in_node_id': node_i2.id, 'out_node_id': node_h.id, 'weight': -1., 'is_enabled': True},
+            {'in_node_id': node_h.id, 'out_node_id': node_o.id, 'weight': 2., 'is_enabled': True},
+            {'in_node_id': node_i1.id, 'out_node_id': node_o.id, 'weight': 5., 'is_enabled': False},
+        )
+        genotype = Genotype(
+            self._db,
+            node_ids={node_i1.id, node_i2.id, node_h.id, node_o.id},
+            connection_dicts=connection_dicts,
+        )
+        phenotype = genotype.compile(activation_func=relu)
+        self.assertSequenceEqual((node_i1.id, node_i2.id), phenotype.input_node_ids)
+        self.assertSequenceEqual((node_o.id,), phenotype.output_node_ids)
+        np.testing.assert_allclose([[2.], [0.]], phenotype.forward([[3., 2.], [1., 4.]]))
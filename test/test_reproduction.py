@@ -0,0 +1,61 @@
+from unittest import TestCase, mock
+
+from core.genome import Genome
+from core.orm.enums import NodeTypes
+from core.orm.metadata import ModelMetadata
+from core.reproduction import creates_cycle, crossover, mutate, offspring_quotas, select
+
+
+class TestReproduction(TestCase):
+    def setUp(self):
+        self.node_types = {1: NodeTypes.bias, 2: NodeTypes.input, 3: NodeTypes.hidden, 4: NodeTypes.output}
+        self.genome = Genome({1, 2, 3, 4}, (1, 2), (2, 3), (3, 4), (1., .5), (True, True))
+
+    def test_offspring_quotas(self):
+        self.assertDictEqual({1: 7, 2: 3}, offspring_quotas({1: [30, 40], 2: [10, 20]}, 10))
+        self.assertDictEqual({1: 3, 2: 2}, offspring_quotas({1: [0, 0, 0], 2: [0, 0]}, 5))
+        self.assertEqual(11, sum(offspring_quotas({1: [1], 2: [1], 3: [1]}, 11).values()))
+        self.assertDictEqual({1: 0, 2: 4}, offspring_quotas({1: [-5], 2: [5]}, 4))
+
+    def test_select(self):
+        self.assertEqual('b', select(['a', 'b'], [0, 3]))
+        self.assertIn(select(['a', 'b'], [0, 0]), ('a', 'b'))
+
+    def test_creates_cycle(self):
+        self.assertTrue(creates_cycle(self.genome.pairs, 4, 2))
+        self.assertFalse(creates_cycle(self.genome.pairs, 2, 4))
+
+    def test_crossover(self):
+        other = self.genome.copy()
+        other.weights[0] = -1.
+        other.add_connections((3, 4), (3, 2), (2, 4), (1., 1.), (True, True))
+        with mock.patch('random.random', new=lambda: 0):
+            child = crossover(self.genome, other, 1, 1)
+        self.assertListEqual([(2, 3), (3, 4), (2, 4)], child.pairs)
+        self.assertListEqual([1, 2, 4], child.innovations.tolist())
+        self.assertListEqual([-1., .5, 1.], child.weights.tolist())
+        child = crossover(self.genome, other, 2, 1)
+        self.assertSetEqual({(2, 3), (3, 4)}, set(child.pairs))
+        self.assertEqual(1., self.genome.weights[0])
+
+    def test_mutate(self):
+        metadata = ModelMetadata(*(0.,) * len(ModelMetadata._fields))._replace(mutation_split_rate=1.)
+        innovations = mock.Mock()
+        innovations.get_historical_ids.side_effect = lambda pairs: list(range(10, 10 + len(pairs)))
+        innovations.get_split_node_id.side_effect = lambda historical_id: 4 + historical_id
+        genome = mutate(self.genome.copy(), metadata, self.node_types, innovations, 1)
+        self.assertSetEqual({1, 2, 3, 4, 5, 6}, genome.node_ids)
+        self.assertEqual(NodeTypes.hidden, self.node_types[5])
+        self.assertListEqual([False, False, True, True, True, True, True, True], genome.enabled.tolist())
+        self.assertListEqual(
+            [(2, 3), (3, 4), (1, 5), (2, 5), (5, 3), (1, 6), (3, 6), (6, 4)], genome.pairs)
+        self.assertListEqual([1., .5, 0., 1., 1., 0., 1., .5], genome.weights.tolist())
+        innovations.get_historical_ids.assert_called_once()
+
+        metadata = metadata._replace(mutation_split_rate=0., mutation_add_rate=1.)
+        genome = mutate(self.genome.copy(), metadata, self.node_types, innovations, 1)
+        self.assertEqual(4, len(genome))
+        pairs = genome.pairs
+        for in_node_id, out_node_id in pairs:
+            self.assertNotEqual(NodeTypes.output, self.node_types[in_node_id])
+            self.assertFalse(creates_cycle(set(pairs) - {(in_node_id, out_node_id)}, in_node_id, out_node_id))